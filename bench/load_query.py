@@ -0,0 +1,152 @@
+"""
+Load test of the query service.
+
+Generates synthetic smiley XML, serves it with filter_xml.query_service.QueryService and lets a
+number of concurrent clients send requests to every endpoint over keep-alive connections. Reports
+throughput and latency percentiles per endpoint, as seen by the clients. Exits with status 1 if
+the median latency of any endpoint exceeds --max-median-ms.
+
+    $ python -m bench.load_query --rows 100000 --clients 8 --requests 2000
+"""
+import http.client
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from argparse import ArgumentParser
+from typing import Dict, List, Optional
+
+from bench.run import query_points
+from filter_xml.cvr import ZipcodeFinder
+from filter_xml.filters import PreFilters, FilterLog
+from filter_xml.generator import SmileyXMLGenerator
+from filter_xml.query_service import QueryIndex, QueryService
+from filter_xml.smiley_extractor import SmileyExtractor
+
+ENDPOINTS = ['by_id', 'by_pnr', 'nearby', 'nearest']
+
+
+def paths(catalog, endpoint: str, amount: int, seed: int) -> List[str]:
+    """
+    :param amount request paths for :param endpoint, drawn from :param catalog
+    """
+    rnd = random.Random(seed)
+    if endpoint == 'by_id':
+        return [f'/restaurants/{res.name_seq_nr}' for res in rnd.choices(catalog.catalog, k=amount)]
+    if endpoint == 'by_pnr':
+        with_pnr = [res for res in catalog.catalog if res.pnr] or catalog.catalog
+        return [f'/restaurants?pnr={res.pnr}' for res in rnd.choices(with_pnr, k=amount)]
+
+    points = query_points(catalog, amount)
+    if endpoint == 'nearby':
+        return [f'/nearby?lat={lat:.6f}&lng={lng:.6f}&radius=250&limit=20' for lat, lng in points]
+    return [f'/nearest?lat={lat:.6f}&lng={lng:.6f}&k=10' for lat, lng in points]
+
+
+def client(service: QueryService, requests: List[str], latencies: List[float]) -> None:
+    """
+    Send every path in :param requests over a single connection, recording the latencies
+    """
+    connection = http.client.HTTPConnection(service.host, service.port)
+    try:
+        for path in requests:
+            start = time.perf_counter()
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            latencies.append(time.perf_counter() - start)
+            if response.status != 200:
+                raise RuntimeError(f'{path} answered {response.status}')
+    finally:
+        connection.close()
+
+
+def percentile(values: List[float], share: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def load(service: QueryService, catalog, endpoint: str, clients: int,
+         requests: int) -> Dict[str, float]:
+    """
+    Let :param clients concurrent clients send :param requests requests each to :param endpoint
+    """
+    latencies = [[] for _ in range(clients)]  # type: List[List[float]]
+    threads = [threading.Thread(target=client,
+                                args=(service, paths(catalog, endpoint, requests, n), latencies[n]))
+               for n in range(clients)]
+
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    merged = [x for thread_latencies in latencies for x in thread_latencies]
+    return {
+        'requests': len(merged),
+        'throughput': len(merged) / elapsed,
+        'p50_ms': percentile(merged, 0.5) * 1000,
+        'p95_ms': percentile(merged, 0.95) * 1000,
+        'p99_ms': percentile(merged, 0.99) * 1000
+    }
+
+
+arg_parser = ArgumentParser(description='Load test the filter_xml query service')
+arg_parser.add_argument('--rows', '-r', type=int, default=100000, help='catalog size')
+arg_parser.add_argument('--clients', '-c', type=int, default=8, help='concurrent clients')
+arg_parser.add_argument('--requests', '-n', type=int, default=2000,
+                        help='requests per client and endpoint')
+arg_parser.add_argument('--only', nargs='+', choices=ENDPOINTS, help='only load these endpoints')
+arg_parser.add_argument('--max-median-ms', type=float, default=None,
+                        help='fail if the median latency of an endpoint exceeds this')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = arg_parser.parse_args(argv)
+
+    # the zip code lookup would otherwise go to the network for rows without a city
+    PreFilters.ZIP_CODES = ZipcodeFinder(SmileyXMLGenerator.zip_map())
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # every file written by filter_xml ends up in the temporary directory
+        os.chdir(directory)
+        FilterLog()
+        try:
+            xml_path = os.path.join(directory, 'smiley.xml')
+            print(f'Generating {args.rows} rows')
+            SmileyXMLGenerator(args.rows, seed=args.rows).write(xml_path)
+            catalog = SmileyExtractor(xml_path, False).create_smiley_json()
+        finally:
+            os.chdir(cwd)
+
+    index = QueryIndex()
+    start = time.perf_counter()
+    index.update(catalog)
+    print(f'Indexed {len(index)} restaurants in {time.perf_counter() - start:.2f}s')
+
+    service = QueryService(index, 0, '127.0.0.1').start()
+    failed = []
+    try:
+        for endpoint in args.only or ENDPOINTS:
+            result = load(service, catalog, endpoint, args.clients, args.requests)
+            print(f'  {endpoint:<8} {result["throughput"]:8.0f} req/s  '
+                  f'p50 {result["p50_ms"]:.2f}ms  p95 {result["p95_ms"]:.2f}ms  '
+                  f'p99 {result["p99_ms"]:.2f}ms')
+            if args.max_median_ms is not None and result['p50_ms'] > args.max_median_ms:
+                failed.append(endpoint)
+    finally:
+        service.stop()
+
+    for endpoint in failed:
+        print(f'SLOW {endpoint}: median latency above {args.max_median_ms}ms')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+"""
+Benchmark suite for filter_xml.
+
+Generates synthetic smiley XML at the given sizes, times every benchmark in BENCHMARKS on it and
+compares the results against a stored baseline. Exits with status 1 if any benchmark is slower
+than its baseline by more than the threshold. No baseline is committed, as timings depend on the
+machine, so run with --update-baseline once before comparing.
+
+    $ python -m bench.run --rows 10000 100000 --update-baseline
+    $ python -m bench.run --rows 10000 100000 --threshold 0.25
+"""
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from argparse import ArgumentParser
+from xml.etree import ElementTree as ET
+from typing import Callable, Dict, List, Optional
+
+from filter_xml.aggregates import Aggregates
+from filter_xml.blacklist import Blacklist
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.cvr import ZipcodeFinder
+from filter_xml.filters import PreFilters, FilterLog
+from filter_xml.generator import SmileyXMLGenerator
+from filter_xml.merge_diff import MergeDiff
+from filter_xml.query_service import QueryIndex
+from filter_xml.search import SearchIndex
+from filter_xml.smiley_extractor import SmileyExtractor
+from filter_xml.temp_file import TempFile
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+OUTPUT = 'bench_output.txt'
+
+# TempFile rewrites the whole file on every add, so it is timed on a capped amount of rows
+TEMP_FILE_ROWS = 200
+# amount of queries timed per query benchmark
+QUERIES = 1000
+# search queries, from selective to matching a large share of the generated names, with typos
+SEARCHES = ['jensens bøfhus aarhus', 'netto århus', 'sticks', 'pizza', 'café nørre',
+            'piza vestregade', 'kro algade 12', 'lagkagehus']
+
+
+class Fixture:
+    """
+    Data shared by the benchmarks of a single size
+    """
+
+    def __init__(self, size: int, directory: str):
+        self.size = size
+        self.xml_path = os.path.join(directory, f'smiley_{size}.xml')
+        SmileyXMLGenerator(size, seed=size).write(self.xml_path)
+
+        self.rows = [{col.tag: col.text for col in row}
+                     for row in ET.parse(self.xml_path).getroot()]
+        self.unfiltered = [Restaurant.from_xml(row) for row in self.rows]
+        self.catalog = SmileyExtractor(self.xml_path, False).create_smiley_json()
+        self.json_rows = self.catalog.as_dict()
+        self.old_catalog = self._old_catalog()
+        self.query_index = QueryIndex()
+        self.query_index.update(self.catalog)
+        self.query_points = query_points(self.catalog, QUERIES)
+        self.search_index = SearchIndex()
+        self.search_index.update(self.catalog)
+        self.aggregates = Aggregates('')
+        self.aggregates.rebuild(self.old_catalog)
+        self.aggregate_diffs = [self._diff(self.catalog, self.old_catalog),
+                                self._diff(self.old_catalog, self.catalog)]
+
+    def _old_catalog(self) -> RestaurantCatalog:
+        """
+        Construct a previous state of the catalog, where 5% of the rows have since been inserted,
+        5% have been deleted and 5% have been updated
+        """
+        old = RestaurantCatalog()
+        size = self.catalog.catalog_size
+        inserted, deleted, updated = size // 20, size // 20, size // 20
+
+        for res in self.catalog.catalog[inserted:size - updated]:
+            old.add(res)
+        for res in self.catalog.catalog[size - updated:]:
+            changed = copy.deepcopy(res)
+            changed.name = f'{changed.name} (old)'
+            old.add(changed)
+        for i in range(deleted):
+            gone = Restaurant()
+            gone.name_seq_nr = f'deleted-{i}'
+            old.add(gone)
+
+        return old
+
+    @staticmethod
+    def _diff(new: RestaurantCatalog, old: RestaurantCatalog) -> tuple:
+        """
+        The restaurants of :param new by name_seq_nr, and the changed and deleted name_seq_nr
+        from :param old to :param new
+        """
+        new.setup_diff(old)
+        changed = [row['name_seq_nr'] for row in new.insert_set() + new.update_set()]
+        return new.new_by_key, changed, new.delete_set()
+
+
+def query_points(catalog: RestaurantCatalog, amount: int) -> List[tuple]:
+    """
+    :param amount query points scattered around the restaurants of :param catalog
+    """
+    located = [res for res in catalog.catalog if res.geo_lat is not None]
+    rnd = random.Random(amount)
+    return [(res.geo_lat + rnd.uniform(-0.01, 0.01), res.geo_lng + rnd.uniform(-0.01, 0.01))
+            for res in rnd.choices(located, k=amount)] if located else []
+
+
+def bench_extract(fixture: Fixture) -> None:
+    SmileyExtractor(fixture.xml_path, False).create_smiley_json()
+
+
+def bench_pre_filters(fixture: Fixture) -> None:
+    pre_filters = PreFilters()
+    for res in fixture.unfiltered:
+        pre_filters.filter(res)
+
+
+def bench_row_filters(fixture: Fixture) -> None:
+    pre_filters = PreFilters()
+    # copies, as row_filter_city fills in missing cities
+    for row in fixture.rows:
+        pre_filters.accepts_row(row.copy())
+
+
+def bench_from_json(fixture: Fixture) -> None:
+    for row in fixture.json_rows:
+        Restaurant.from_json(row)
+
+
+def bench_as_dict(fixture: Fixture) -> None:
+    fixture.catalog.as_dict()
+
+
+def bench_temp_file(fixture: Fixture) -> None:
+    temp_file = TempFile()
+    for res in fixture.catalog.catalog[:TEMP_FILE_ROWS]:
+        temp_file.add_data(res)
+    temp_file.close()
+
+
+def bench_blacklist(fixture: Fixture) -> None:
+    Blacklist._restaurants = set()
+    Blacklist._loaded = False
+    for res in fixture.catalog.catalog:
+        Blacklist.add(res)
+    for res in fixture.catalog.catalog:
+        Blacklist.contains(res.name_seq_nr)
+    Blacklist.close_file()
+    Blacklist._file = Blacklist._file_writer = None
+    os.remove(Blacklist._file_path)
+
+
+def bench_setup_diff(fixture: Fixture) -> None:
+    fixture.catalog.setup_diff(fixture.old_catalog)
+
+
+def bench_insert_set(fixture: Fixture) -> None:
+    fixture.catalog.setup_diff(fixture.old_catalog)
+    fixture.catalog.insert_set()
+
+
+def bench_update_set(fixture: Fixture) -> None:
+    fixture.catalog.setup_diff(fixture.old_catalog)
+    fixture.catalog.update_set()
+
+
+def bench_delete_set(fixture: Fixture) -> None:
+    fixture.catalog.setup_diff(fixture.old_catalog)
+    fixture.catalog.delete_set()
+
+
+def bench_merge_diff(fixture: Fixture) -> None:
+    with MergeDiff(fixture.catalog) as diff:
+        diff.spill(fixture.old_catalog)
+        for stream in [diff.inserts(), diff.updates(), diff.deletes()]:
+            for _ in stream:
+                pass
+
+
+def bench_query_index(fixture: Fixture) -> None:
+    QueryIndex().update(fixture.catalog)
+
+
+def bench_query_by_id(fixture: Fixture) -> None:
+    for res in fixture.catalog.catalog[:QUERIES]:
+        fixture.query_index.get(res.name_seq_nr)
+
+
+def bench_query_radius(fixture: Fixture) -> None:
+    for lat, lng in fixture.query_points:
+        fixture.query_index.radius(lat, lng, 500, limit=100)
+
+
+def bench_query_nearest(fixture: Fixture) -> None:
+    for lat, lng in fixture.query_points:
+        fixture.query_index.nearest(lat, lng, 10)
+
+
+def bench_search_index(fixture: Fixture) -> None:
+    SearchIndex().update(fixture.catalog)
+
+
+def bench_search(fixture: Fixture) -> None:
+    for _ in range(QUERIES // len(SEARCHES)):
+        for query in SEARCHES:
+            fixture.search_index.search(query)
+
+
+def bench_aggregates(fixture: Fixture) -> None:
+    Aggregates('').rebuild(fixture.catalog)
+
+
+def bench_aggregates_apply(fixture: Fixture) -> None:
+    # apply the diff from the old catalog to the current one, and back again
+    for restaurants, changed, deleted in fixture.aggregate_diffs:
+        fixture.aggregates.apply(restaurants, changed, deleted)
+
+
+BENCHMARKS = {
+    'extract': bench_extract,
+    'pre_filters': bench_pre_filters,
+    'row_filters': bench_row_filters,
+    'from_json': bench_from_json,
+    'as_dict': bench_as_dict,
+    'temp_file': bench_temp_file,
+    'blacklist': bench_blacklist,
+    'setup_diff': bench_setup_diff,
+    'insert_set': bench_insert_set,
+    'update_set': bench_update_set,
+    'delete_set': bench_delete_set,
+    'merge_diff': bench_merge_diff,
+    'query_index': bench_query_index,
+    'query_by_id': bench_query_by_id,
+    'query_radius': bench_query_radius,
+    'query_nearest': bench_query_nearest,
+    'search_index': bench_search_index,
+    'search': bench_search,
+    'aggregates': bench_aggregates,
+    'aggregates_apply': bench_aggregates_apply,
+}  # type: Dict[str, Callable[[Fixture], None]]
+
+
+def time_benchmark(fun: Callable[[Fixture], None], fixture: Fixture, repeat: int) -> float:
+    """
+    Run :param fun :param repeat times and return the fastest run in seconds
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fun(fixture)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            threshold: float) -> List[str]:
+    """
+    Compare :param results against :param baseline. Returns a line per regression
+    """
+    regressions = []
+    for size, timings in results.items():
+        for name, seconds in timings.items():
+            base = baseline.get(size, {}).get(name)
+            if base and seconds > base * (1 + threshold):
+                regressions.append(f'{name} @ {size} rows: {seconds:.4f}s vs baseline {base:.4f}s '
+                                   f'(+{(seconds / base - 1) * 100:.0f}%)')
+    return regressions
+
+
+arg_parser = ArgumentParser(description='Run the filter_xml benchmark suite')
+arg_parser.add_argument('--rows', '-r', type=int, nargs='+', default=[10000],
+                        help='sizes to benchmark, e.g. 10000 100000 1000000')
+arg_parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS),
+                        help='only run these benchmarks')
+arg_parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, best is kept')
+arg_parser.add_argument('--baseline', type=str, default=BASELINE, help='baseline file')
+arg_parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown relative to the baseline, default: 0.25')
+arg_parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = arg_parser.parse_args(argv)
+    baseline_path = os.path.abspath(args.baseline)
+    output_path = os.path.abspath(OUTPUT)
+    names = args.only or list(BENCHMARKS)
+
+    # the zip code lookup would otherwise go to the network for rows without a city
+    PreFilters.ZIP_CODES = ZipcodeFinder(SmileyXMLGenerator.zip_map())
+
+    results = {}  # type: Dict[str, Dict[str, float]]
+    cwd = os.getcwd()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # every file written by filter_xml ends up in the temporary directory
+        os.chdir(directory)
+        FilterLog()
+        try:
+            for size in args.rows:
+                print(f'Generating {size} rows')
+                fixture = Fixture(size, directory)
+                results[str(size)] = {}
+                for name in names:
+                    seconds = time_benchmark(BENCHMARKS[name], fixture, args.repeat)
+                    results[str(size)][name] = seconds
+                    print(f'  {name:<12} {seconds:10.4f}s')
+        finally:
+            os.chdir(cwd)
+
+    with open(output_path, 'w') as f:
+        f.write(json.dumps(results, indent=4))
+
+    baseline = {}
+    if os.path.isfile(baseline_path):
+        with open(baseline_path, 'r') as f:
+            baseline = json.loads(f.read())
+
+    if args.update_baseline:
+        for size, timings in results.items():
+            baseline.setdefault(size, {}).update(timings)
+        with open(baseline_path, 'w') as f:
+            f.write(json.dumps(baseline, indent=4, sort_keys=True))
+        print(f'Baseline written to {baseline_path}')
+        return 0
+
+    if not baseline:
+        print('No baseline to compare against, run with --update-baseline to store one')
+        return 0
+
+    regressions = compare(results, baseline, args.threshold)
+    for line in regressions:
+        print(f'REGRESSION {line}')
+    if not regressions:
+        print(f'No regressions beyond {args.threshold * 100:.0f}%')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,8 +1,23 @@
+import glob
+import json
 import os
+import time
 
 from argparse import ArgumentParser
 
+from .cache_manifest import CacheManifest
+from .catalog import RestaurantCatalog
+from .config import FilterXMLConfig
+from .cvr import get_cvr_handler
+from .daemon import Daemon
 from .data_handler import DataHandler
+from .data_outputter import FileOutputter
+from .industry_screen import IndustryScreen
+from .sharding import ShardedProcessor
+from .profiling import Profiler
+from .query_service import QueryIndex, QueryService
+from .smiley_extractor import SmileyExtractor
+from .stand_in import StandInServer, ElasticStandIn, DataEndpointStandIn
 
 arg_parser = ArgumentParser()
 arg_parser.add_argument('--sample', '-s', nargs='?', metavar='SIZE', type=int, default=0,
@@ -11,19 +26,58 @@ arg_parser.add_argument('--no-scrape', '-ns', action='store_true',
                         help='skip scraping during run')
 arg_parser.add_argument('--push', '-p', action='store_true',
                         help='push output to rust server')
+arg_parser.add_argument('--parquet', action='store_true',
+                        help='export the processed catalog as Parquet instead of JSON files, '
+                             'requires pyarrow')
+arg_parser.add_argument('--shards', action='store_true',
+                        help='write the processed catalog as content-addressed shards by zip code '
+                             'or region, with a manifest of their hashes, cf. [shards] in the '
+                             'config file')
 arg_parser.add_argument('--file', '-f', nargs=1, type=str,
                         help='file path for xml to use (default: get from fødevarestyrelsen)')
 arg_parser.add_argument('--clean', '-c', action='store_true',
                         help='clean all temp files and exit')
+arg_parser.add_argument('--workers', '-w', metavar='N', type=int, default=1,
+                        help='amount of processes to enrich data in, default: 1')
+arg_parser.add_argument('--deadline', metavar='SECONDS', type=float, default=None,
+                        help='stop enriching SECONDS after the run starts, prioritising new '
+                             'restaurants and new inspections, and output the partial result')
+arg_parser.add_argument('--profile', nargs='?', metavar='DIR', const='profile',
+                        help='write per-stage cProfile stats to DIR, default: profile')
+arg_parser.add_argument('--trace-memory', action='store_true',
+                        help='write per-stage top allocations, traced with tracemalloc, to the '
+                             'profile directory')
+arg_parser.add_argument('--stand-in', action='store_true',
+                        help='serve local stand-ins for the elastic search and data endpoints')
+arg_parser.add_argument('--daemon', '-d', action='store_true',
+                        help='keep running, and process the smiley XML whenever it changes')
+arg_parser.add_argument('--serve', action='store_true',
+                        help='serve a local query API over the processed catalog, cf. [query] in '
+                             'the config file')
+arg_parser.add_argument('--measure-screen', action='store_true',
+                        help='look up the valid production units of the smiley XML in CVR, print '
+                             'the precision and recall of the industry screen and exit, cf. '
+                             '[industry_screen] in the config file')
+arg_parser.add_argument('--control', choices=list(Daemon.COMMANDS), metavar='COMMAND',
+                        help=f'send a command to a running daemon and exit, one of '
+                             f'[ {" | ".join(Daemon.COMMANDS)} ]')
 
 
 def run():
     args = arg_parser.parse_args()
 
+    if args.daemon and (args.sample or args.workers > 1):
+        arg_parser.error('--daemon cannot be combined with --sample or --workers')
+    if args.deadline is not None and (args.daemon or args.workers > 1):
+        arg_parser.error('--deadline cannot be combined with --daemon or --workers')
+
     if args.clean:
-        files = ['blacklist.csv', 'temp.csv', 'filter_log.json',
-                 'smiley_json_processed_delete.json', 'smiley_json_processed_insert.json',
-                 'smiley_json_processed_update.json']
+        files = ['blacklist.csv', 'temp.csv', 'filter_log.json', ShardedProcessor.MANIFEST,
+                 FilterXMLConfig.mirror_path(), FilterXMLConfig.aggregates_path(),
+                 FilterXMLConfig.schedule_path(),
+                 CacheManifest.FILE_NAME]
+        files += glob.glob(f'{FileOutputter.FILE_BASE}*')
+        files += glob.glob('temp_shard_*') + glob.glob('filter_log_shard_*')
 
         for file in files:
             print(f'removing file {file}')
@@ -32,10 +86,67 @@ def run():
 
         return
 
+    if args.stand_in:
+        servers = [StandInServer(ElasticStandIn, FilterXMLConfig.stand_in_elastic_port()).start(),
+                   StandInServer(DataEndpointStandIn, FilterXMLConfig.stand_in_data_port()).start()]
+        for server in servers:
+            print(f'serving {server.handler.__name__} on {server.url()}')
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            for server in servers:
+                server.stop()
+        return
+
+    if args.control:
+        print(json.dumps(Daemon.send(args.control), indent=4))
+        return
+
+    if args.measure_screen:
+        extractor = SmileyExtractor(args.file[0] if args.file else DataHandler.SMILEY_XML,
+                                    not args.file)
+        restaurants = [res for res in extractor.iter_restaurants()
+                       if res.is_valid_production_unit()]
+        if args.sample:
+            restaurants = restaurants[:args.sample]
+        print(json.dumps(IndustryScreen.load().measure(restaurants, get_cvr_handler()),
+                         indent=4))
+        return
+
+    if args.profile or args.trace_memory:
+        Profiler.configure(args.profile or 'profile', cpu=bool(args.profile),
+                           memory=args.trace_memory)
+
     dh = DataHandler(
         sample=args.sample,
         no_scrape=args.no_scrape,
         push=args.push,
-        file=args.file[0] if args.file else None
+        parquet=args.parquet,
+        shards=args.shards,
+        file=args.file[0] if args.file else None,
+        workers=args.workers,
+        deadline=args.deadline
     )
-    dh.collect()
+
+    index = QueryIndex() if args.serve else None
+    service = QueryService(index).start() if args.serve else None
+    if service:
+        print(f'serving the query API on {service.url()}')
+
+    try:
+        if args.daemon:
+            Daemon(dh, index=index).run()
+        else:
+            dh.collect()
+        if service and not args.daemon:
+            index.update(dh.data_processor.last_output or RestaurantCatalog())
+            print(f'{len(index)} restaurants indexed, press Ctrl+C to stop')
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+    finally:
+        if service:
+            service.stop()
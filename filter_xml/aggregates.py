@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import json
+import os
+
+from datetime import date
+from typing import Dict, Iterable, List, Optional
+
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+
+
+class _Group:
+    """
+    Counters of a single group of restaurants, e.g. every restaurant in zip code 8000
+    """
+    __slots__ = ['restaurants', 'smileys', 'elite', 'inspected', 'inspection_days', 'latest',
+                 '_latest']
+
+    def __init__(self):
+        self.restaurants = 0
+        # amount of restaurants by their latest smiley
+        self.smileys = dict()  # type: Dict[str, int]
+        self.elite = 0
+        self.inspected = 0
+        # sum of the latest inspection of every inspected restaurant, as date ordinals
+        self.inspection_days = 0
+        # amount of restaurants by their latest inspection, as date ordinals
+        self.latest = dict()  # type: Dict[int, int]
+        self._latest = None  # type: Optional[int]
+
+    def apply(self, contribution: list, sign: int) -> None:
+        """
+        Add (:param sign 1) or remove (-1) the :param contribution of a single restaurant
+        """
+        _, smiley, elite, inspected = contribution
+        self.restaurants += sign
+        self.elite += sign * elite
+        if smiley is not None:
+            self.smileys[smiley] = self.smileys.get(smiley, 0) + sign
+            if not self.smileys[smiley]:
+                del self.smileys[smiley]
+        if inspected is not None:
+            self.inspected += sign
+            self.inspection_days += sign * inspected
+            self.latest[inspected] = self.latest.get(inspected, 0) + sign
+            if not self.latest[inspected]:
+                del self.latest[inspected]
+            # the most recent inspection is only searched for again once it is removed
+            if sign > 0 and (self._latest is None or inspected > self._latest):
+                self._latest = inspected
+            elif sign < 0 and inspected == self._latest and inspected not in self.latest:
+                self._latest = max(self.latest) if self.latest else None
+
+    def stats(self, today: int) -> dict:
+        return {
+            'restaurants': self.restaurants,
+            'smileys': dict(sorted(self.smileys.items())),
+            'elite_share': self.elite / self.restaurants if self.restaurants else 0.0,
+            'inspected': self.inspected,
+            'mean_days_since_inspection':
+                today - self.inspection_days / self.inspected if self.inspected else None,
+            'latest_inspection':
+                date.fromordinal(self._latest).isoformat() if self._latest else None
+        }
+
+    def as_dict(self) -> dict:
+        return {'restaurants': self.restaurants, 'smileys': self.smileys, 'elite': self.elite,
+                'inspected': self.inspected, 'inspection_days': self.inspection_days,
+                'latest': {str(k): v for k, v in self.latest.items()}}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> _Group:
+        self = _Group()
+        self.restaurants = data['restaurants']
+        self.smileys = data['smileys']
+        self.elite = data['elite']
+        self.inspected = data['inspected']
+        self.inspection_days = data['inspection_days']
+        self.latest = {int(k): v for k, v in data['latest'].items()}
+        self._latest = max(self.latest) if self.latest else None
+        return self
+
+
+class Aggregates:
+    """
+    Smiley statistics of the processed catalog per zip code, city, franchise and industry code,
+    cf. DIMENSIONS, kept up to date by DataProcessor.output().
+
+    Every group keeps counters, rather than its restaurants, so statistics are read in constant
+    time with get(), and a restaurant is added or removed by adding or subtracting its
+    contribution. The contribution of every restaurant is kept as well, such that restaurants
+    can be removed and updated by name_seq_nr alone, e.g. from a delete set:
+        >>> aggregates = Aggregates.load()
+        >>> aggregates.apply(catalog.new_by_key, changed=['81615'], deleted=['12345'])
+        >>> aggregates.get('city', 'Aarhus C')
+        {'restaurants': 1012, 'smileys': {'1': 899, '2': 98, ...}, 'elite_share': 0.31, ...}
+
+    The statistics of a group are
+        restaurants                 amount of restaurants
+        smileys                     amount of restaurants by their latest smiley
+        elite_share                 share of restaurants with an elite smiley
+        inspected                   amount of restaurants with at least one smiley report
+        mean_days_since_inspection  mean days since the latest inspection of each restaurant
+        latest_inspection           date of the most recent inspection, YYYY-MM-DD
+    """
+    DIMENSIONS = ['zip_code', 'city', 'franchise_name', 'industry_code']
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else FilterXMLConfig.aggregates_path()
+        self.token = None  # type: Optional[str]
+        # name_seq_nr -> [groups by dimension, latest smiley, elite, latest inspection]
+        self._contributions = dict()  # type: Dict[str, list]
+        self._groups = self._no_groups()  # type: Dict[str, Dict[str, _Group]]
+
+    @classmethod
+    def _no_groups(cls) -> Dict[str, Dict[str, _Group]]:
+        return {dimension: dict() for dimension in cls.DIMENSIONS}
+
+    def __len__(self) -> int:
+        return len(self._contributions)
+
+    def __contains__(self, seq_nr: str) -> bool:
+        return seq_nr in self._contributions
+
+    def ids(self) -> set:
+        return set(self._contributions)
+
+    @classmethod
+    def contribution(cls, res: Restaurant) -> list:
+        """
+        What :param res adds to the groups it belongs to
+        """
+        latest = max((r for r in res.smiley_reports if r.date), key=lambda r: r.date,
+                     default=None)
+        return [[getattr(res, dimension) for dimension in cls.DIMENSIONS],
+                str(latest.smiley) if latest and latest.smiley is not None else None,
+                int(res.elite_smiley == '1'),
+                latest.date.toordinal() if latest else None]
+
+    def add(self, res: Restaurant) -> None:
+        """
+        Add :param res, replacing its previous contribution if any
+        """
+        self.remove(res.name_seq_nr)
+        contribution = self.contribution(res)
+        self._contributions[res.name_seq_nr] = contribution
+        self._apply(contribution, 1)
+
+    def remove(self, seq_nr: str) -> None:
+        contribution = self._contributions.pop(seq_nr, None)
+        if contribution is not None:
+            self._apply(contribution, -1)
+
+    def _apply(self, contribution: list, sign: int) -> None:
+        for dimension, group in zip(self.DIMENSIONS, contribution[0]):
+            if group is None:
+                continue
+            groups = self._groups[dimension]
+            if group not in groups:
+                groups[group] = _Group()
+            groups[group].apply(contribution, sign)
+            if not groups[group].restaurants:
+                del groups[group]
+
+    def apply(self, restaurants: Dict[str, Restaurant], changed: Iterable[str],
+              deleted: Iterable[str]) -> None:
+        """
+        Apply a diff: add or update the :param changed restaurants, found in :param restaurants
+        by name_seq_nr, and remove the :param deleted ones
+        """
+        for seq_nr in deleted:
+            self.remove(seq_nr)
+        for seq_nr in changed:
+            self.add(restaurants[seq_nr])
+
+    def rebuild(self, catalog: RestaurantCatalog) -> None:
+        """
+        Forget every group, and aggregate :param catalog from scratch
+        """
+        self._contributions = dict()
+        self._groups = self._no_groups()
+        for res in catalog.catalog:
+            self.add(res)
+
+    def get(self, dimension: str, group: str) -> Optional[dict]:
+        """
+        Statistics of :param group in :param dimension, or None if it has no restaurants
+        """
+        found = self._groups[dimension].get(group)
+        return found.stats(date.today().toordinal()) if found else None
+
+    def groups(self, dimension: str) -> List[str]:
+        return sorted(self._groups[dimension])
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> Aggregates:
+        """
+        Load the aggregates from disk. Missing or unreadable aggregates are empty
+        """
+        self = Aggregates(path)
+        if not self.path or not os.path.isfile(self.path):
+            return self
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.loads(f.read())
+        except (OSError, ValueError):
+            print('Failed to read aggregates, aggregating the full catalog')
+            return self
+
+        self.token = data['token']
+        self._contributions = data['restaurants']
+        self._groups = {dimension: {group: _Group.from_dict(counters)
+                                    for group, counters in data['counters'][dimension].items()}
+                        for dimension in self.DIMENSIONS}
+        return self
+
+    def save(self) -> None:
+        """
+        Write the statistics of every group along with the counters and contributions they are
+        kept up to date from, to a temporary file which is then moved into place
+        """
+        if not self.path:
+            return
+
+        today = date.today().toordinal()
+        with open(f'{self.path}.tmp', 'w') as f:
+            f.write(json.dumps({
+                'token': self.token,
+                'groups': {dimension: {group: counters.stats(today)
+                                       for group, counters in sorted(groups.items())}
+                           for dimension, groups in self._groups.items()},
+                'counters': {dimension: {group: counters.as_dict()
+                                         for group, counters in groups.items()}
+                             for dimension, groups in self._groups.items()},
+                'restaurants': self._contributions
+            }))
+        os.replace(f'{self.path}.tmp', self.path)
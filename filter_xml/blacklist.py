@@ -14,7 +14,8 @@ class Blacklist:
     after every ended session.
     """
     _file_path = 'blacklist.csv'
-    _restaurants = []
+    _restaurants = set()
+    _loaded = False
     _file_writer = None
     _file = None
 
@@ -27,13 +28,14 @@ class Blacklist:
         if cls.contains(seq_nr):
             return
         cls._write_to_file(seq_nr)
+        cls._restaurants.add(seq_nr)
 
     @classmethod
     def contains(cls, seq_nr: str):
         """
         Check if blacklist contains entry with given sequence number
         """
-        if not cls._restaurants:
+        if not cls._loaded:
             cls._read_restaurants_file()
         return seq_nr in cls._restaurants
 
@@ -60,12 +62,14 @@ class Blacklist:
     @classmethod
     def _read_restaurants_file(cls):
         """
-        Retrieve all blacklisted restaurants from the blacklist file
+        Retrieve all blacklisted restaurants from the blacklist file. The file is only read once,
+        later additions are kept in memory as well by add()
         """
+        cls._loaded = True
         try:
             with open(cls._file_path, 'r') as f:
                 reader = csv.reader(f)
                 for row in reader:
-                    cls._restaurants.append(row[0])
+                    cls._restaurants.add(row[0])
         except FileNotFoundError:
             return {}
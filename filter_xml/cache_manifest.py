@@ -0,0 +1,114 @@
+import hashlib
+import inspect
+import json
+import os
+
+from datetime import datetime
+from typing import Dict, Optional
+
+from filter_xml.config import FilterXMLConfig
+
+
+class CacheManifest:
+    """
+    Handler for cache_manifest.json.
+
+    Records the inputs behind every derived artifact of a run, e.g. the digest of the smiley XML
+    and the version of the pre-filters behind smiley_json.json. An artifact is reused as long as
+    it exists and was derived from the same inputs, and is recomputed as soon as any of them
+    changes.
+
+        >>> manifest = CacheManifest()
+        >>> inputs = {'xml': manifest.digest('smiley_xml.xml')}
+        >>> if not manifest.is_current('smiley_json', inputs, 'smiley_json.json'):
+        ...     create_smiley_json()
+        ...     manifest.record('smiley_json', inputs, 'smiley_json.json')
+    """
+    FILE_NAME = 'cache_manifest.json'
+
+    def __init__(self, file_name: str = FILE_NAME):
+        self.file_name = file_name
+        self._artifacts = dict()  # type: Dict[str, dict]
+        self._digests = dict()  # type: Dict[str, dict]
+
+        if os.path.isfile(self.file_name):
+            try:
+                with open(self.file_name, 'r') as f:
+                    data = json.loads(f.read())
+                self._artifacts = data['artifacts']
+                self._digests = data['digests']
+            except (ValueError, KeyError):
+                print(f'Failed to read {self.file_name}, recomputing every artifact')
+
+    def get(self, artifact: str) -> Optional[dict]:
+        """
+        Retrieve the inputs recorded for :param artifact, or None if it has not been recorded
+        """
+        entry = self._artifacts.get(artifact)
+        return entry['inputs'] if entry else None
+
+    def is_current(self, artifact: str, inputs: dict, path: Optional[str] = None) -> bool:
+        """
+        Whether :param artifact was derived from :param inputs, and still exists at :param path
+        """
+        if path is not None and not os.path.isfile(path):
+            return False
+        return self.get(artifact) == inputs
+
+    def record(self, artifact: str, inputs: dict) -> None:
+        """
+        Record that :param artifact has been derived from :param inputs
+        """
+        self._artifacts[artifact] = {
+            'inputs': inputs,
+            'created': datetime.now().strftime(FilterXMLConfig.iso_fmt())
+        }
+        self.save()
+
+    def invalidate(self, artifact: str) -> None:
+        if self._artifacts.pop(artifact, None):
+            self.save()
+
+    def digest(self, path: str) -> str:
+        """
+        SHA-256 digest of the file at :param path. Digests are remembered by size and
+        modification time, such that an unchanged file is only read once
+        """
+        stat = os.stat(path)
+        known = self._digests.get(path)
+        if known and known['size'] == stat.st_size and known['mtime'] == stat.st_mtime:
+            return known['digest']
+
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(block)
+
+        self._digests[path] = {'size': stat.st_size, 'mtime': stat.st_mtime,
+                               'digest': sha.hexdigest()}
+        self.save()
+        return sha.hexdigest()
+
+    @staticmethod
+    def source_digest(*objects) -> str:
+        """
+        Digest of the source code of :param objects, e.g. a set of filters, such that changing
+        the code changes the digest
+        """
+        sha = hashlib.sha256()
+        for obj in objects:
+            try:
+                sha.update(inspect.getsource(obj).encode('utf-8'))
+            except (OSError, TypeError):
+                # source is unavailable, e.g. in a frozen build, so fall back to the name
+                sha.update(obj.__qualname__.encode('utf-8'))
+        return sha.hexdigest()
+
+    def save(self) -> None:
+        """
+        Write the manifest to a temporary file and move it into place
+        """
+        with open(f'{self.file_name}.tmp', 'w') as f:
+            f.write(json.dumps({'artifacts': self._artifacts, 'digests': self._digests},
+                               indent=4))
+        os.replace(f'{self.file_name}.tmp', self.file_name)
@@ -3,12 +3,67 @@
 # note that __future__ imports must be the first line of the file
 from __future__ import annotations
 
+import hashlib
+import json
+import sys
+import zlib
+
+from functools import lru_cache
 from typing import Optional, List, Set, Dict
 from datetime import datetime
 
 from filter_xml.config import FilterXMLConfig
 
 
+@lru_cache(maxsize=8192)
+def parse_date(value: str, fmt: str) -> datetime:
+    """
+    datetime.strptime(), memoized as the same dates recur across thousands of rows. Parsed
+    datetimes are shared between rows, which is safe as datetimes are immutable
+    """
+    return datetime.strptime(value, fmt)
+
+
+class _IsoDate:
+    """
+    A datetime attribute that may also be assigned its ISO 8601 string, as done by from_json().
+    The string is kept as is and only parsed when the attribute is read, and iso() passes it
+    through untouched, so dates that are loaded and saved again are never parsed nor formatted.
+
+    The value is kept in a private attribute, e.g. _start_date for start_date
+    """
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.attr = f'_{name}'
+
+    def __get__(self, obj, owner=None):
+        if obj is None:
+            return self
+        value = getattr(obj, self.attr)
+        if value.__class__ is str and value:
+            return parse_date(value, FilterXMLConfig.iso_fmt())
+        return value
+
+    def __set__(self, obj, value) -> None:
+        setattr(obj, self.attr, value)
+
+    def iso(self, obj) -> Optional[str]:
+        """
+        The date of :param obj as an ISO 8601 string, or the empty value it was assigned
+        """
+        value = getattr(obj, self.attr)
+        if value.__class__ is str or not value:
+            return value
+        return value.strftime(FilterXMLConfig.iso_fmt())
+
+
+def _intern(value: Optional[str]) -> Optional[str]:
+    """
+    Share a single copy of categorical values, e.g. cities and industries, between every row
+    """
+    return sys.intern(value) if value else value
+
+
 class Restaurant:
     """
     A class representing a single row of the smiley data
@@ -23,6 +78,15 @@ class Restaurant:
                  'niche_industry', 'url', 'address', 'name', 'zip_code', 'ad_protection',
                  'company_type']
 
+    # every member, in the order they are output by as_dict()
+    FIELDS = ['cvrnr', 'pnr', 'region', 'industry_code', 'industry_text', 'start_date', 'end_date',
+              'smiley_reports', 'city', 'elite_smiley', 'geo_lat', 'geo_lng', 'niche_industry',
+              'url', 'address', 'name', 'name_seq_nr', 'zip_code', 'ad_protection', 'company_type',
+              'franchise_name']
+
+    start_date = _IsoDate()
+    end_date = _IsoDate()
+
     def __init__(self):
         self.cvrnr = None  # type: Optional[str]
         self.pnr = None  # type: Optional[str]
@@ -74,26 +138,26 @@ class Restaurant:
 
         self.cvrnr = row['cvrnr']
         self.pnr = row['pnr']
-        self.region = row['region']
-        self.industry_code = row['brancheKode']
-        self.industry_text = row['branche']
+        self.region = _intern(row['region'])
+        self.industry_code = _intern(row['brancheKode'])
+        self.industry_text = _intern(row['branche'])
         self.start_date = None
         self.end_date = None
         self.smiley_reports = [SmileyReport.from_xml(row[x[0]], row[x[1]])
                                for x in cls.REPORT_KEYS if row[x[0]]]
-        self.city = row['By']
-        self.elite_smiley = row['Elite_Smiley']
+        self.city = _intern(row['By'])
+        self.elite_smiley = _intern(row['Elite_Smiley'])
         self.geo_lat = float(row['Geo_Lat']) if row['Geo_Lat'] else None
         self.geo_lng = float(row['Geo_Lng']) if row['Geo_Lng'] else None
-        self.niche_industry = row['Pixibranche']
+        self.niche_industry = _intern(row['Pixibranche'])
         self.url = row['URL']
         self.address = row['adresse1']
         self.name = row['navn1'].strip() if row['navn1'] else None
         self.name_seq_nr = row['navnelbnr']
-        self.zip_code = row['postnr']
-        self.ad_protection = row['reklame_beskyttelse']
-        self.company_type = row['virksomhedstype']
-        self.franchise_name = row['Kaedenavn']
+        self.zip_code = _intern(row['postnr'])
+        self.ad_protection = _intern(row['reklame_beskyttelse'])
+        self.company_type = _intern(row['virksomhedstype'])
+        self.franchise_name = _intern(row['Kaedenavn'])
 
         return self
 
@@ -109,28 +173,27 @@ class Restaurant:
 
         self.cvrnr = row['cvrnr']
         self.pnr = row['pnr']
-        self.region = row['region']
-        self.industry_code = row['industry_code']
-        self.industry_text = row['industry_text']
-        self.start_date = datetime.strptime(row['start_date'], FilterXMLConfig.iso_fmt()) \
-            if row['start_date'] else ''
-        self.end_date = datetime.strptime(row['end_date'], FilterXMLConfig.iso_fmt()) \
-            if row['end_date'] else ''
+        self.region = _intern(row['region'])
+        self.industry_code = _intern(row['industry_code'])
+        self.industry_text = _intern(row['industry_text'])
+        # dates are parsed once read, cf. _IsoDate
+        self.start_date = _intern(row['start_date']) or ''
+        self.end_date = _intern(row['end_date']) or ''
         self.smiley_reports = [SmileyReport.from_json(report)
                                for report in row['smiley_reports']]
-        self.city = row['city']
-        self.elite_smiley = row['elite_smiley']
+        self.city = _intern(row['city'])
+        self.elite_smiley = _intern(row['elite_smiley'])
         self.geo_lat = float(row['geo_lat']) if row['geo_lat'] else None
         self.geo_lng = float(row['geo_lng']) if row['geo_lng'] else None
-        self.niche_industry = row['niche_industry']
+        self.niche_industry = _intern(row['niche_industry'])
         self.url = row['url']
         self.address = row['address']
         self.name = row['name'].strip() if row['name'] else None
         self.name_seq_nr = row['name_seq_nr']
-        self.zip_code = row['zip_code']
-        self.ad_protection = row['ad_protection']
-        self.company_type = row['company_type']
-        self.franchise_name = row['franchise_name']
+        self.zip_code = _intern(row['zip_code'])
+        self.ad_protection = _intern(row['ad_protection'])
+        self.company_type = _intern(row['company_type'])
+        self.franchise_name = _intern(row['franchise_name'])
 
         return self
 
@@ -139,14 +202,14 @@ class Restaurant:
         """
         ISO-8601 formatted start date string property
         """
-        return self.start_date.strftime(FilterXMLConfig.iso_fmt()) if self.start_date else None
+        return Restaurant.start_date.iso(self) or None
 
     @property
     def end_date_string(self) -> str:
         """
         ISO-8601 formatted start date string property
         """
-        return self.end_date.strftime(FilterXMLConfig.iso_fmt()) if self.end_date else ''
+        return Restaurant.end_date.iso(self) or ''
 
     def is_valid_production_unit(self) -> bool:
         """
@@ -159,11 +222,71 @@ class Restaurant:
         """
         Formats object as a dict
         """
-        d = self.__dict__.copy()
-        d['smiley_reports'] = [report.as_dict() for report in self.smiley_reports]
-        d['start_date'] = self.start_date_string
-        d['end_date'] = self.end_date_string
-        return d
+        formatted = {
+            'smiley_reports': [report.as_dict() for report in self.smiley_reports],
+            'start_date': self.start_date_string,
+            'end_date': self.end_date_string
+        }
+        return {key: formatted[key] if key in formatted else getattr(self, key)
+                for key in self.FIELDS}
+
+    def fingerprint(self) -> str:
+        """
+        Hash of every compared member and smiley report. Two restaurants have the same
+        fingerprint if they are equal, except that an appended or removed smiley report also
+        changes the fingerprint
+        """
+        values = [self._comp_value(k) for k in self.COMP_KEYS]
+        values.append([[report.report_id, report.smiley, report.date_string]
+                       for report in self.smiley_reports])
+        return hashlib.sha1(json.dumps(values).encode('utf-8')).hexdigest()
+
+    def signature(self) -> dict:
+        """
+        Compact description of every compared member and smiley report, from which a patch can
+        be calculated without the full restaurant. Members are hashed, and reports are kept as
+        [report_id, smiley, date]
+        """
+        return {
+            'fields': {k: zlib.crc32(json.dumps(self._comp_value(k)).encode('utf-8'))
+                       for k in self.COMP_KEYS},
+            'reports': [[report.report_id, report.smiley, report.date_string]
+                        for report in self.smiley_reports]
+        }
+
+    def patch(self, old: Optional[dict]) -> dict:
+        """
+        Construct a patch from the restaurant described by the signature :param old to self, i.e.
+            name_seq_nr     identifies the restaurant
+            set             changed members and their new values
+            add_reports     smiley reports that have been added
+            remove_reports  smiley reports that have been removed, as [report_id, smiley, date]
+
+        Without :param old, every member is set and the reports are replaced by 'reports'
+        """
+        if old is None:
+            d = self.as_dict()
+            return {'name_seq_nr': self.name_seq_nr,
+                    'set': {k: d[k] for k in self.COMP_KEYS},
+                    'reports': d['smiley_reports']}
+
+        new = self.signature()
+        d = self.as_dict()
+        reports = new['reports']
+
+        return {
+            'name_seq_nr': self.name_seq_nr,
+            'set': {k: d[k] for k in self.COMP_KEYS if new['fields'][k] != old['fields'].get(k)},
+            'add_reports': [d['smiley_reports'][i] for i, report in enumerate(reports)
+                            if report not in old['reports']],
+            'remove_reports': [report for report in old['reports'] if report not in reports]
+        }
+
+    def _comp_value(self, key: str):
+        """
+        Value of the compared member :param key, with dates formatted as in as_dict()
+        """
+        return self.start_date_string if key == 'start_date' else getattr(self, key)
 
     def has_update(self, old: Restaurant) -> bool:
         """
@@ -179,6 +302,8 @@ class SmileyReport:
     """
     COMP_KEYS = ['report_id', 'smiley', 'date']
 
+    date = _IsoDate()
+
     def __init__(self):
         self.report_id = None  # type: Optional[str]
         self.smiley = None  # type: Optional[int]
@@ -206,7 +331,7 @@ class SmileyReport:
 
         self.report_id = None
         self.smiley = int(smiley) if smiley else None
-        self.date = datetime.strptime(date, '%d-%m-%Y %H:%M:%S')
+        self.date = parse_date(date, '%d-%m-%Y %H:%M:%S')
 
         return self
 
@@ -222,7 +347,7 @@ class SmileyReport:
 
         self.report_id = row['report_id']
         self.smiley = int(row['smiley'])
-        self.date = datetime.strptime(row['date'], FilterXMLConfig.iso_fmt())
+        self.date = _intern(row['date'])
 
         return self
 
@@ -231,15 +356,13 @@ class SmileyReport:
         """
         ISO-8601 formatted date string property
         """
-        return self.date.strftime(FilterXMLConfig.iso_fmt())
+        return SmileyReport.date.iso(self)
 
     def as_dict(self) -> dict:
         """
         Formats object as a dict
         """
-        d = self.__dict__.copy()
-        d['date'] = self.date_string
-        return d
+        return {'report_id': self.report_id, 'smiley': self.smiley, 'date': self.date_string}
 
 
 class RestaurantCatalog:
@@ -258,6 +381,10 @@ class RestaurantCatalog:
         self.old_by_key = dict()  # type: Dict[str, Restaurant]
         self.new_ids = set()  # type: Set[str]
         self.new_by_key = dict()  # type: Dict[str, Restaurant]
+        self.old_fingerprints = dict()  # type: Dict[str, str]
+        self.old_signatures = dict()  # type: Dict[str, dict]
+        # restaurants of the old state that are kept as they are, although not in this catalog
+        self.retained = set()  # type: Set[str]
 
     def add(self, restaurant: Restaurant) -> None:
         """
@@ -285,6 +412,42 @@ class RestaurantCatalog:
         self.new_ids = set(self.new_by_key.keys())
         self.old_by_key = {res.name_seq_nr: res for res in current_db.catalog}
         self.old_ids = set(self.old_by_key.keys())
+        self.old_fingerprints = dict()
+        self.old_signatures = dict()
+
+    def setup_fingerprint_diff(self, fingerprints: Dict[str, str],
+                               signatures: Optional[Dict[str, dict]] = None) -> None:
+        """
+        Setup for calculating diffs against a state only known by the fingerprints of its
+        restaurants, indexed by name_seq_nr, e.g. as kept by filter_xml.mirror.Mirror.
+        Patches can only be calculated for restaurants in :param signatures
+        """
+        self.new_by_key = {res.name_seq_nr: res for res in self.catalog}
+        self.new_ids = set(self.new_by_key.keys())
+        self.old_by_key = dict()
+        self.old_fingerprints = fingerprints
+        self.old_signatures = signatures or dict()
+        self.old_ids = set(fingerprints.keys())
+
+    def signatures(self) -> Dict[str, dict]:
+        """
+        Signatures of every restaurant in the catalog, indexed by name_seq_nr
+        """
+        return {res.name_seq_nr: res.signature() for res in self.catalog}
+
+    def fingerprints(self) -> Dict[str, str]:
+        """
+        Fingerprints of every restaurant in the catalog, indexed by name_seq_nr
+        """
+        return {res.name_seq_nr: res.fingerprint() for res in self.catalog}
+
+    def _is_updated(self, seq_nr: str) -> bool:
+        """
+        Whether the restaurant :param seq_nr differs from its old counterpart
+        """
+        if seq_nr in self.old_by_key:
+            return self.new_by_key[seq_nr] != self.old_by_key[seq_nr]
+        return self.new_by_key[seq_nr].fingerprint() != self.old_fingerprints[seq_nr]
 
     def insert_set(self) -> list:
         """
@@ -300,14 +463,30 @@ class RestaurantCatalog:
         and collecting rows that have been updated by comparing them to their old counterparts
         """
         return [self.new_by_key[x].as_dict() for x in self.new_ids.intersection(self.old_ids)
-                if self.new_by_key[x] != self.old_by_key[x]]
+                if self._is_updated(x)]
+
+    def patch_set(self) -> list:
+        """
+        Construct the update set as patches, containing only the changed members and smiley
+        reports of each updated restaurant, cf. Restaurant.patch()
+        """
+        return [self.new_by_key[x].patch(self._old_signature(x))
+                for x in self.new_ids.intersection(self.old_ids) if self._is_updated(x)]
+
+    def _old_signature(self, seq_nr: str) -> Optional[dict]:
+        """
+        Signature of the old counterpart of :param seq_nr, or None if unknown
+        """
+        if seq_nr in self.old_by_key:
+            return self.old_by_key[seq_nr].signature()
+        return self.old_signatures.get(seq_nr)
 
     def delete_set(self) -> list:
         """
         Construct the delete set using
-            old_set \ new_set
+            old_set \ (new_set ∪ retained)
         """
-        return list(self.old_ids.difference(self.new_ids))
+        return list(self.old_ids.difference(self.new_ids, self.retained))
 
     def as_dict(self) -> list:
         return [res.as_dict() for res in self.catalog]
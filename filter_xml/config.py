@@ -54,9 +54,336 @@ class FilterXMLConfig:
         """
         return cls.open_config().get('cvr_elastic', 'password')
 
+    @classmethod
+    def cvr_elastic_url(cls) -> str:
+        """
+        Retrieves cvr_elastic search URL from config file, defaults to the Virk distribution
+        endpoint
+        """
+        return cls.open_config().get(
+            'cvr_elastic', 'url',
+            fallback='http://distribution.virk.dk/cvr-permanent/produktionsenhed/_search')
+
+    @classmethod
+    def cvr_elastic_bulk(cls) -> bool:
+        """
+        Retrieves whether to export every production unit that can pass the post-filters, rather
+        than looking up the p-numbers of the smiley XML, from config file, defaults to False
+        """
+        return cls.open_config().getboolean('cvr_elastic', 'bulk', fallback=False)
+
+    @classmethod
+    def cvr_elastic_slices(cls) -> int:
+        """
+        Retrieves the amount of slices scrolled in parallel by the bulk export from config file,
+        defaults to 4
+        """
+        return cls.open_config().getint('cvr_elastic', 'slices', fallback=4)
+
+    @classmethod
+    def cvr_elastic_page_size(cls) -> int:
+        """
+        Retrieves the amount of production units per page of the bulk export from config file,
+        defaults to 1000
+        """
+        return cls.open_config().getint('cvr_elastic', 'page_size', fallback=1000)
+
+    @classmethod
+    def cvr_elastic_scroll(cls) -> str:
+        """
+        Retrieves how long the bulk export keeps its scroll contexts alive between pages from
+        config file, defaults to 1m
+        """
+        return cls.open_config().get('cvr_elastic', 'scroll', fallback='1m')
+
     @classmethod
     def data_endpoint(cls) -> str:
         """
         Retrieves the data endpoint from config file
         """
-        return cls.open_config().get('filter_xml', 'data_endpoint')
\ No newline at end of file
+        return cls.open_config().get('filter_xml', 'data_endpoint')
+
+    @classmethod
+    def http_mode(cls) -> str:
+        """
+        Retrieves HTTP mode from config file, valid choices: [ live | record | replay ]
+        """
+        return cls.open_config().get('http', 'mode', fallback='live')
+
+    @classmethod
+    def http_cassette(cls) -> str:
+        """
+        Retrieves the path of the cassette used for recording and replaying HTTP responses
+        """
+        return cls.open_config().get('http', 'cassette', fallback='cassette.json.gz')
+
+    @classmethod
+    def http_latency(cls) -> float:
+        """
+        Retrieves the latency in seconds injected into every replayed HTTP response
+        """
+        return cls.open_config().getfloat('http', 'latency', fallback=0)
+
+    @classmethod
+    def http_jitter(cls) -> float:
+        """
+        Retrieves the maximum random jitter in seconds added on top of the replay latency
+        """
+        return cls.open_config().getfloat('http', 'jitter', fallback=0)
+
+    @classmethod
+    def http_pool_size(cls) -> int:
+        """
+        Retrieves the maximum amount of pooled connections kept open per host
+        """
+        return cls.open_config().getint('http', 'pool_size', fallback=10)
+
+    @classmethod
+    def diff_delta(cls) -> bool:
+        """
+        Retrieves whether updated restaurants are output as patches of the changed members,
+        rather than as full restaurants
+        """
+        return cls.open_config().getboolean('diff', 'delta', fallback=False)
+
+    @classmethod
+    def diff_external(cls) -> bool:
+        """
+        Retrieves whether diffs are computed by an external merge join over sorted spill files,
+        cf. filter_xml.merge_diff.MergeDiff, rather than in memory, defaults to False
+        """
+        return cls.open_config().getboolean('diff', 'external', fallback=False)
+
+    @classmethod
+    def diff_run_size(cls) -> int:
+        """
+        Retrieves the amount of records sorted in memory at a time by the external diff from
+        config file, defaults to 10000
+        """
+        return cls.open_config().getint('diff', 'run_size', fallback=10000)
+
+    @classmethod
+    def diff_spill_directory(cls) -> str:
+        """
+        Retrieves the directory of the spill files of the external diff from config file, empty
+        for the system temporary directory
+        """
+        return cls.open_config().get('diff', 'spill_directory', fallback='')
+
+    @classmethod
+    def mirror_path(cls) -> str:
+        """
+        Retrieves the path of the local mirror of the state last pushed to the data endpoint,
+        empty to disable the mirror
+        """
+        return cls.open_config().get('mirror', 'path', fallback='mirror.json')
+
+    @classmethod
+    def aggregates_path(cls) -> str:
+        """
+        Retrieves the path the smiley aggregates of the processed catalog are exported to,
+        empty to disable the aggregates
+        """
+        return cls.open_config().get('aggregates', 'path', fallback='aggregates.json')
+
+    @classmethod
+    def schedule_path(cls) -> str:
+        """
+        Retrieves the path of the enrichment schedule, i.e. when every restaurant was last output,
+        used to prioritise enrichment under --deadline. Empty to disable the schedule
+        """
+        return cls.open_config().get('schedule', 'path', fallback='schedule.json')
+
+    @classmethod
+    def industry_screen(cls) -> bool:
+        """
+        Retrieves whether to skip the CVR lookup of rows whose smiley XML industry can never pass
+        the industry code post-filter from config file, defaults to False
+        """
+        return cls.open_config().getboolean('industry_screen', 'enabled', fallback=False)
+
+    @classmethod
+    def industry_screen_mapping(cls) -> str:
+        """
+        Retrieves the path of a JSON file extending the industry screen mapping from config file,
+        empty to use the default mapping only
+        """
+        return cls.open_config().get('industry_screen', 'mapping', fallback='')
+
+    @classmethod
+    def output_format(cls) -> str:
+        """
+        Retrieves the format of files written by FileOutputter, valid choices: [ json | jsonl ]
+        """
+        return cls.open_config().get('output', 'format', fallback='json')
+
+    @classmethod
+    def output_compression(cls) -> str:
+        """
+        Retrieves the compression of files written by FileOutputter, valid choices:
+        [ none | gzip | zstd ]
+        """
+        return cls.open_config().get('output', 'compression', fallback='none')
+
+    @classmethod
+    def parquet_directory(cls) -> str:
+        """
+        Retrieves the directory of the Parquet files written by ParquetOutputter
+        """
+        return cls.open_config().get('parquet', 'directory', fallback='parquet')
+
+    @classmethod
+    def parquet_row_group_size(cls) -> int:
+        """
+        Retrieves the amount of rows per Parquet row group
+        """
+        return cls.open_config().getint('parquet', 'row_group_size', fallback=50000)
+
+    @classmethod
+    def parquet_compression(cls) -> str:
+        """
+        Retrieves the compression codec of Parquet files, e.g. [ zstd | snappy | gzip | none ]
+        """
+        return cls.open_config().get('parquet', 'compression', fallback='zstd')
+
+    @classmethod
+    def shards_directory(cls) -> str:
+        """
+        Retrieves the directory of the shard files and manifest written by ShardOutputter
+        """
+        return cls.open_config().get('shards', 'directory', fallback='shards')
+
+    @classmethod
+    def shards_partition(cls) -> str:
+        """
+        Retrieves what restaurants are partitioned into shards by, i.e. [ zip_code | region ]
+        """
+        return cls.open_config().get('shards', 'partition', fallback='zip_code')
+
+    @classmethod
+    def shards_zip_range(cls) -> int:
+        """
+        Retrieves the amount of consecutive zip codes per shard, when partitioning by zip code
+        """
+        return cls.open_config().getint('shards', 'zip_range', fallback=100)
+
+    @classmethod
+    def shards_compression(cls) -> str:
+        """
+        Retrieves the compression of shard files, i.e. [ none | gzip | zstd ]
+        """
+        return cls.open_config().get('shards', 'compression', fallback='gzip')
+
+    @classmethod
+    def upload_chunk_bytes(cls) -> int:
+        """
+        Retrieves the maximum size in bytes of the uncompressed JSON rows sent to the data
+        endpoint in a single request
+        """
+        return cls.open_config().getint('upload', 'chunk_bytes', fallback=1048576)
+
+    @classmethod
+    def upload_workers(cls) -> int:
+        """
+        Retrieves the amount of chunks sent to the data endpoint in parallel
+        """
+        return cls.open_config().getint('upload', 'workers', fallback=4)
+
+    @classmethod
+    def upload_retries(cls) -> int:
+        """
+        Retrieves the amount of times failed chunks are resent to the data endpoint
+        """
+        return cls.open_config().getint('upload', 'retries', fallback=3)
+
+    @classmethod
+    def upload_compress(cls) -> bool:
+        """
+        Retrieves whether chunks sent to the data endpoint are gzip compressed
+        """
+        return cls.open_config().getboolean('upload', 'compress', fallback=True)
+
+    @classmethod
+    def daemon_interval(cls) -> float:
+        """
+        Retrieves the amount of seconds between two polls of the smiley XML in daemon mode
+        """
+        return cls.open_config().getfloat('daemon', 'interval', fallback=300)
+
+    @classmethod
+    def daemon_socket(cls) -> str:
+        """
+        Retrieves the path of the unix control socket of the daemon
+        """
+        return cls.open_config().get('daemon', 'socket', fallback='filter_xml.sock')
+
+    @classmethod
+    def query_host(cls) -> str:
+        """
+        Retrieves the host the local query service binds to
+        """
+        return cls.open_config().get('query', 'host', fallback='127.0.0.1')
+
+    @classmethod
+    def query_port(cls) -> int:
+        """
+        Retrieves the port of the local query service
+        """
+        return cls.open_config().getint('query', 'port', fallback=8000)
+
+    @classmethod
+    def query_cell_size(cls) -> float:
+        """
+        Retrieves the size in degrees of the grid cells of the spatial index of the query service
+        """
+        return cls.open_config().getfloat('query', 'cell_size', fallback=0.0025)
+
+    @classmethod
+    def stand_in_elastic_port(cls) -> int:
+        """
+        Retrieves the port for the local elastic search stand-in server
+        """
+        return cls.open_config().getint('stand_in', 'elastic_port', fallback=9200)
+
+    @classmethod
+    def stand_in_data_port(cls) -> int:
+        """
+        Retrieves the port for the local data endpoint stand-in server
+        """
+        return cls.open_config().getint('stand_in', 'data_port', fallback=8080)
+
+    @classmethod
+    def pipeline_queue_size(cls) -> int:
+        """
+        Retrieves the maximum amount of restaurants waiting between two processing stages
+        """
+        return cls.open_config().getint('pipeline', 'queue_size', fallback=100)
+
+    @classmethod
+    def pipeline_workers(cls, stage: str) -> int:
+        """
+        Retrieves the amount of worker threads for the processing stage :param stage, i.e. one of
+        [ pre_filter | cvr | post_filter | smiley | persist ]
+        """
+        return cls.open_config().getint('pipeline', f'{stage}_workers', fallback=1)
+
+    @classmethod
+    def metrics_json(cls) -> str:
+        """
+        Retrieves the path of the JSON metrics file written at the end of each run
+        """
+        return cls.open_config().get('metrics', 'json', fallback='metrics.json')
+
+    @classmethod
+    def metrics_prometheus(cls) -> str:
+        """
+        Retrieves the path of the Prometheus textfile written at the end of each run
+        """
+        return cls.open_config().get('metrics', 'prometheus', fallback='metrics.prom')
+
+    @classmethod
+    def metrics_progress_interval(cls) -> float:
+        """
+        Retrieves the minimum amount of seconds between two progress reports
+        """
+        return cls.open_config().getfloat('metrics', 'progress_interval', fallback=5)
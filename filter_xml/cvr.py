@@ -1,11 +1,17 @@
 import json
+import threading
 
-from requests import get, post
 from bs4 import BeautifulSoup
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.exceptions import RequestException
+from typing import Optional, Dict
+from urllib.parse import urlsplit
 
 from filter_xml.config import FilterXMLConfig
+from filter_xml.http_client import delete, get, post
 from filter_xml.catalog import Restaurant
+from filter_xml.metrics import Metrics
 
 
 class CVRHandlerBase:
@@ -17,6 +23,8 @@ class CVRHandlerBase:
     SHOULD_SLEEP = False
     CRAWL_DELAY = 0
     PRE_PROCESSING_STEP = False
+    # fields of a Restaurant collected from CVR, cf. result()
+    FIELDS = ['industry_code', 'industry_text', 'start_date', 'end_date']
 
     def __init__(self):
         # collect all class methods prefixed by 'append_'
@@ -28,28 +36,85 @@ class CVRHandlerBase:
     def pre_processing(self, data: list):
         return
 
+    def prepare(self) -> None:
+        """
+        Pre-processing covering every restaurant rather than a batch of them, performed at most
+        once per run. Performed before a sharded run is forked, such that every shard inherits it
+        """
+        return
+
     def collect_data(self, data: Restaurant) -> Restaurant:
         """
         Data collection method. All inherited classes should override this and return a super() call
         """
         return data
 
+    @classmethod
+    def result(cls, data: Restaurant) -> tuple:
+        """
+        The CVR data collected for :param data, such that it can be shared with other rows of the
+        same production unit through apply_result()
+        """
+        return tuple(getattr(data, field) for field in cls.FIELDS)
+
+    @classmethod
+    def apply_result(cls, data: Restaurant, result: tuple) -> Restaurant:
+        for field, value in zip(cls.FIELDS, result):
+            setattr(data, field, value)
+        return data
+
 
 class CVRHandlerElastic(CVRHandlerBase):
     """
     CVR handler for elastic search on virk.dk. Will be implemented once (if) we get access.
 
     https://data.virk.dk/datakatalog/erhvervsstyrelsen/system-til-system-adgang-til-cvr-data
+
+    By default the p-numbers of the smiley XML are looked up in chunks. With [cvr_elastic]
+    bulk=true, the predicates of PostFilters are pushed into the query instead, and every
+    production unit that can pass them is exported once through slices scrolled in parallel, so
+    units that would be filtered away never cross the wire.
     """
-    URL = 'http://distribution.virk.dk/cvr-permanent/produktionsenhed/_search'
+    URL = FilterXMLConfig.cvr_elastic_url()
     PRE_PROCESSING_STEP = True
+    SOURCE = [
+        'VrproduktionsEnhed.livsforloeb.periode.gyldigFra',
+        'VrproduktionsEnhed.livsforloeb.periode.gyldigTil',
+        'VrproduktionsEnhed.pNummer',
+        'VrproduktionsEnhed.produktionsEnhedMetadata.nyesteHovedbranche.branchekode',
+        'VrproduktionsEnhed.produktionsEnhedMetadata.nyesteHovedbranche.branchetekst'
+    ]
 
     def __init__(self):
         super().__init__()
         self.lookup_data = {}
+        self.bulk = FilterXMLConfig.cvr_elastic_bulk()
+        self._exported = False
+        self._export_lock = threading.Lock()
+
+    def prepare(self) -> None:
+        """
+        Perform the bulk export, if enabled. The export covers every restaurant, so only the
+        first call performs it
+        """
+        if not self.bulk:
+            return
+
+        with self._export_lock:
+            if not self._exported:
+                self._exported = self.bulk_export()
+            if not self._exported:
+                print('Bulk export failed, looking up p-numbers instead')
+                self.bulk = False
 
     def pre_processing(self, data: list):
-        all_pnrs = [r.pnr for r in data if r.pnr is not None]
+        self.prepare()
+        if self.bulk:
+            return
+
+        # rows of the same production unit share a p-number, which is only requested once
+        all_pnrs = list(dict.fromkeys(r.pnr for r in data if r.pnr is not None))
+        Metrics.increment('coalesced.cvr', sum(r.pnr is not None for r in data) - len(all_pnrs))
         chunks = list(self.chunks(all_pnrs, 3000))
         num_reqs = len(chunks)
         print(f'Fetching pnr-info on {len(all_pnrs)} pnrs in {num_reqs} request(s):')
@@ -65,19 +130,15 @@ class CVRHandlerElastic(CVRHandlerBase):
                         'VrproduktionsEnhed.pNummer': chunks[i]
                     }
                 },
-                '_source': [
-                    'VrproduktionsEnhed.livsforloeb.periode.gyldigFra',
-                    'VrproduktionsEnhed.livsforloeb.periode.gyldigTil',
-                    'VrproduktionsEnhed.pNummer',
-                    'VrproduktionsEnhed.produktionsEnhedMetadata.nyesteHovedbranche.branchekode',
-                    'VrproduktionsEnhed.produktionsEnhedMetadata.nyesteHovedbranche.branchetekst'
-                ]
+                '_source': self.SOURCE
             }
-            res = post(self.URL, json=data, auth=auth)
+            with Metrics.stage('elastic_chunk'):
+                res = post(self.URL, json=data, auth=auth)
 
             if res.status_code == 200:
                 self.parse_response(res.json())
             else:
+                Metrics.increment('errors.cvr_elastic')
                 print("Bad response code")
 
             if i + 1 != num_reqs:
@@ -85,6 +146,95 @@ class CVRHandlerElastic(CVRHandlerBase):
             else:
                 print('Done!', flush=True)
 
+    @staticmethod
+    def bulk_query() -> dict:
+        """
+        Query matching the production units that can pass PostFilters
+        """
+        # filter_xml.filters imports this module
+        from filter_xml.filters import PostFilters
+
+        return {
+            'bool': {
+                'filter': [{
+                    'terms': {
+                        'VrproduktionsEnhed.produktionsEnhedMetadata.nyesteHovedbranche'
+                        '.branchekode': PostFilters.INCLUDE_CODES
+                    }
+                }],
+                # life spans are listed oldest first, so a unit with any ended span has an ended
+                # first span, which PostFilters.filter_end_date rejects
+                'must_not': [{
+                    'exists': {'field': 'VrproduktionsEnhed.livsforloeb.periode.gyldigTil'}
+                }]
+            }
+        }
+
+    def scroll_url(self) -> str:
+        parts = urlsplit(self.URL)
+        return f'{parts.scheme}://{parts.netloc}/_search/scroll'
+
+    def bulk_export(self) -> bool:
+        """
+        Export every production unit matching bulk_query() into self.lookup_data, scrolling
+        [cvr_elastic] slices in parallel. Returns whether every slice was exported
+        """
+        slices = FilterXMLConfig.cvr_elastic_slices()
+        print(f'Exporting production units that can pass the post-filters in {slices} slice(s)')
+
+        with Metrics.stage('elastic_export'), ThreadPoolExecutor(max_workers=slices) as pool:
+            exported = list(pool.map(lambda i: self._export_slice(i, slices), range(slices)))
+
+        print(f'Exported {len(self.lookup_data)} production units')
+        return all(exported)
+
+    def _export_slice(self, slice_id: int, slices: int) -> bool:
+        """
+        Scroll through slice :param slice_id of :param slices until it has no more hits
+        """
+        auth = (FilterXMLConfig.cvr_elastic_username(), FilterXMLConfig.cvr_elastic_password())
+        scroll = FilterXMLConfig.cvr_elastic_scroll()
+        body = {
+            'size': FilterXMLConfig.cvr_elastic_page_size(),
+            'query': self.bulk_query(),
+            '_source': self.SOURCE
+        }
+        if slices > 1:
+            body['slice'] = {'id': slice_id, 'max': slices}
+
+        scroll_id = None
+        try:
+            res = post(self.URL, params={'scroll': scroll}, json=body, auth=auth)
+            while res.status_code == 200:
+                page = res.json()
+                scroll_id = page.get('_scroll_id', scroll_id)
+                hits = page['hits']['hits']
+                if not hits:
+                    return True
+
+                self.parse_response(page)
+                Metrics.increment('cvr_elastic.exported', len(hits))
+                with Metrics.stage('elastic_scroll'):
+                    res = post(self.scroll_url(), json={'scroll': scroll, 'scroll_id': scroll_id},
+                               auth=auth)
+        except RequestException as e:
+            print(f'Failed to export slice {slice_id}: {e}')
+        finally:
+            if scroll_id:
+                self._clear_scroll(scroll_id, auth)
+
+        Metrics.increment('errors.cvr_elastic')
+        return False
+
+    def _clear_scroll(self, scroll_id: str, auth: tuple) -> None:
+        """
+        Release the scroll context on the server rather than waiting for it to expire
+        """
+        try:
+            delete(self.scroll_url(), json={'scroll_id': scroll_id}, auth=auth)
+        except RequestException:
+            pass
+
     def parse_response(self, data: dict) -> None:
         for result in data['hits']['hits']:
             curr_res = result['_source']['VrproduktionsEnhed']
@@ -101,11 +251,15 @@ class CVRHandlerElastic(CVRHandlerBase):
             self.lookup_data[str(curr_res['pNummer'])] = value
 
     def collect_data(self, data: Restaurant) -> Restaurant:
+        Metrics.cache('cvr_elastic_lookup', data.pnr in self.lookup_data)
         if data.pnr in self.lookup_data:
             data.industry_code = self.lookup_data[data.pnr]['industrycode']
             data.industry_text = self.lookup_data[data.pnr]['industrydesc']
             data.start_date = self.lookup_data[data.pnr]['startdate']
             data.end_date = self.lookup_data[data.pnr]['enddate']
+        elif self.bulk:
+            # not exported, so it cannot pass the post-filters
+            data.industry_code = data.industry_text = None
         else:
             print(f'Skipping restaurant with p-nr {data.pnr}: record not found remotely')
 
@@ -158,6 +312,7 @@ class CVRHandlerCVRAPI(CVRHandlerBase):
             for appender in self.appenders:
                 data = appender(content, data)
         else:
+            Metrics.increment('errors.cvrapi')
             print(f'Skipping restaurant with p-nr {data.pnr}: record not found remotely')
 
         return super().collect_data(data)
@@ -296,11 +451,22 @@ class FindSmileyHandler:
         Data collection method. Retrieves findsmiley.dk page for the given company and runs
         every appender on it.
         """
-        smiley = get(data.url)
-        smiley_soup = BeautifulSoup(smiley.content.decode('utf-8'), 'html.parser')
+        return self.apply_page(data, self.page(data.url))
 
+    @staticmethod
+    def page(url: str) -> BeautifulSoup:
+        """
+        Retrieve the findsmiley.dk page at :param url
+        """
+        smiley = get(url)
+        return BeautifulSoup(smiley.content.decode('utf-8'), 'html.parser')
+
+    def apply_page(self, data: Restaurant, soup: BeautifulSoup) -> Restaurant:
+        """
+        Run every appender on the findsmiley.dk page :param soup of :param data
+        """
         for appender in self.appenders:
-            data = appender(smiley_soup, data)
+            data = appender(soup, data)
 
         return data
 
@@ -309,19 +475,33 @@ class FindSmileyHandler:
         """
         Append smiley report IDs from findsmiley.dk for the given row
         """
+        return FindSmileyHandler.apply_result(row, FindSmileyHandler.report_ids(soup))
+
+    @staticmethod
+    def report_ids(soup: BeautifulSoup) -> tuple:
+        """
+        Every report ID on the findsmiley.dk page :param soup, in the order of the page, such
+        that they can be shared by every row of the page through apply_result()
+        """
         tags = soup.findAll('a', attrs={'target': '_blank'})
+        # use default if we cant find urls - will yield error page
+        return tuple(tag.attrs['href'].split('?')[1] if tag.attrs.get('href') else 'Virk'
+                     for tag in tags)
 
+    @staticmethod
+    def apply_result(data: Restaurant, result: tuple) -> Restaurant:
+        """
+        Set the report IDs :param result of a findsmiley.dk page on the reports of :param data
+        """
         # we assume that pdfs will continue to appear in descending order
         # if we want safe guarding against changes in order we can use
         # date = t.find('p', attrs={'class': 'DateText'}).text
         # and check the date against the fields of param: row
-        for tag, report in zip(tags, row.smiley_reports):
+        for report_id, report in zip(result, data.smiley_reports):
             if report:
-                url = tag.attrs['href']
-                # use default if we cant find urls - will yield error page
-                report.report_id = url.split('?')[1] if url else 'Virk'
+                report.report_id = report_id
 
-        return row
+        return data
 
 
 class ZipcodeFinder:
@@ -330,8 +510,16 @@ class ZipcodeFinder:
     """
     URL = 'https://api.dataforsyningen.dk/postnumre'
 
-    def __init__(self):
-        self.zip_map = {row['nr']: row['navn'] for row in get(self.URL).json()}
+    def __init__(self, zip_map: Optional[Dict[str, str]] = None):
+        # fetched on first lookup rather than on import, such that importing filter_xml does
+        # not require network access
+        self._zip_map = zip_map  # type: Optional[Dict[str, str]]
+
+    @property
+    def zip_map(self) -> Dict[str, str]:
+        if self._zip_map is None:
+            self._zip_map = {row['nr']: row['navn'] for row in get(self.URL).json()}
+        return self._zip_map
 
     def __getitem__(self, key: str):
         if key not in self.zip_map.keys():
@@ -0,0 +1,237 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from filter_xml.blacklist import Blacklist
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+from filter_xml.data_handler import DataHandler
+from filter_xml.metrics import Metrics
+from filter_xml.query_service import QueryIndex
+from filter_xml.smiley_extractor import SmileyExtractor
+from filter_xml.temp_file import TempFile
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    """
+    Answers a single command per connection on the control socket, cf. Daemon.COMMANDS
+    """
+
+    def handle(self) -> None:
+        command = self.rfile.readline().decode('utf-8').strip()
+        response = self.server.daemon.control(command)
+        self.wfile.write((json.dumps(response) + '\n').encode('utf-8'))
+
+
+class _ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon):
+        self.daemon = daemon
+        super().__init__(path, _ControlHandler)
+
+
+class Daemon:
+    """
+    Long running mode, started by the --daemon CLI arg.
+
+    Keeps the enriched catalog, the CVR provider and the zip codes in memory, and polls the
+    smiley XML every [daemon] interval seconds with a conditional request. When the XML has
+    changed, only restaurants that are new or whose row has changed are enriched - every other
+    restaurant is reused from the previous cycle - after which the result is diffed against the
+    local mirror and output.
+
+    A unix socket at [daemon] socket accepts a single command per connection, cf. COMMANDS,
+    and answers with a JSON line. Use the --control CLI arg to send commands.
+
+    Given a QueryIndex, the index is updated with the result of every cycle.
+    """
+    COMMANDS = {
+        'status': 'report the state of the daemon',
+        'poll': 'poll the smiley XML now',
+        'refresh': 'enrich every restaurant again on the next cycle',
+        'stop': 'stop the daemon once the current cycle ends'
+    }
+
+    def __init__(self, handler: DataHandler, interval: Optional[float] = None,
+                 socket_path: Optional[str] = None, index: Optional[QueryIndex] = None):
+        self.handler = handler
+        self.index = index
+        self.processor = handler.data_processor
+        self.interval = interval if interval is not None else FilterXMLConfig.daemon_interval()
+        self.socket_path = socket_path if socket_path is not None \
+            else FilterXMLConfig.daemon_socket()
+
+        # enriched restaurants, and the fingerprint of the XML row they were enriched from.
+        # Rows that were filtered while enriching have a fingerprint, but no restaurant
+        self._enriched = dict()  # type: Dict[str, Restaurant]
+        self._sources = dict()  # type: Dict[str, str]
+        self._digest = None  # type: Optional[str]
+
+        self._wake = threading.Event()
+        self._refresh = threading.Event()
+        self._stopped = threading.Event()
+        self._server = None  # type: Optional[_ControlServer]
+        self._status = {
+            'state': 'starting',
+            'cycles': 0,
+            'last_poll': None,
+            'last_change': None,
+            'last_cycle_seconds': None,
+            'last_enriched': 0,
+            'last_error': None
+        }
+
+    def run(self) -> None:
+        """
+        Poll and process until stopped by the control socket or a keyboard interrupt
+        """
+        self._serve_control()
+        print(f'Daemon polling every {self.interval} seconds, control socket at '
+              f'{self.socket_path}')
+        try:
+            while not self._stopped.is_set():
+                self._status['state'] = 'processing'
+                refresh = self._refresh.is_set()
+                self._refresh.clear()
+                try:
+                    self.cycle(force=refresh)
+                except Exception as e:
+                    if refresh:
+                        self._refresh.set()
+                    Metrics.increment('errors.daemon')
+                    self._status['last_error'] = f'{type(e).__name__}: {e}'
+                    print(f'Daemon cycle failed: {self._status["last_error"]}')
+
+                self._status['state'] = 'idle'
+                self._wake.wait(self.interval)
+                self._wake.clear()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._status['state'] = 'stopped'
+            self._stop_control()
+            Blacklist.close_file()
+
+    def cycle(self, force: bool = False) -> bool:
+        """
+        Poll the smiley XML, and process it if it has changed since the last cycle or if
+        :param force, in which case every restaurant is enriched again. Returns whether the XML
+        was processed
+        """
+        if self.handler.should_get_xml:
+            self.handler.refresh_xml()
+        digest = self.handler.manifest.digest(self.handler.smiley_file)
+        self._status['last_poll'] = datetime.now().strftime(FilterXMLConfig.iso_fmt())
+
+        if digest == self._digest and not force:
+            return False
+
+        start = time.perf_counter()
+        Metrics.reset()
+
+        with Metrics.stage('daemon_cycle'):
+            rows = SmileyExtractor(self.handler.smiley_file, False).iter_restaurants()
+            current, sources, changed = self._split(rows, refresh=force)
+
+            temp_file = TempFile()
+            enriched = self.processor.enrich(changed, temp_file)
+            temp_file.close()
+
+            for res in enriched.catalog:
+                current[res.name_seq_nr] = res
+
+            result = RestaurantCatalog()
+            result.add_many(list(current.values()))
+            self.processor.output(result)
+            if self.index is not None:
+                self.index.update(result)
+
+        self._enriched, self._sources, self._digest = current, sources, digest
+        Metrics.increment('daemon.reused', len(current) - enriched.catalog_size)
+        Metrics.write()
+
+        self._status.update({
+            'cycles': self._status['cycles'] + 1,
+            'last_change': self._status['last_poll'],
+            'last_cycle_seconds': time.perf_counter() - start,
+            'last_enriched': len(changed),
+            'last_error': None
+        })
+        return True
+
+    def _split(self, rows, refresh: bool = False) -> tuple:
+        """
+        Split freshly parsed :param rows into restaurants that can be reused from the previous
+        cycle, and restaurants that have to be enriched, i.e. every restaurant if :param refresh.
+        Returns the reused restaurants and the source fingerprints of every row, both indexed by
+        name_seq_nr, and the changed rows
+        """
+        current = dict()  # type: Dict[str, Restaurant]
+        sources = dict()  # type: Dict[str, str]
+        changed = []  # type: List[Restaurant]
+
+        for res in rows:
+            fingerprint = res.fingerprint()
+            sources[res.name_seq_nr] = fingerprint
+
+            if refresh or self._sources.get(res.name_seq_nr) != fingerprint:
+                changed.append(res)
+            elif res.name_seq_nr in self._enriched:
+                current[res.name_seq_nr] = self._enriched[res.name_seq_nr]
+
+        return current, sources, changed
+
+    def control(self, command: str) -> dict:
+        """
+        Execute a single control command, cf. COMMANDS
+        """
+        if command == 'status':
+            return dict(self._status, restaurants=len(self._enriched), interval=self.interval)
+        if command == 'poll':
+            self._wake.set()
+            return {'ok': True}
+        if command == 'refresh':
+            self._refresh.set()
+            self._wake.set()
+            return {'ok': True}
+        if command == 'stop':
+            self._stopped.set()
+            self._wake.set()
+            return {'ok': True}
+        return {'error': f'unknown command "{command}", please choose one of '
+                         f'[ {" | ".join(self.COMMANDS)} ]'}
+
+    @classmethod
+    def send(cls, command: str, socket_path: Optional[str] = None) -> dict:
+        """
+        Send :param command to a running daemon and return its response
+        """
+        path = socket_path if socket_path is not None else FilterXMLConfig.daemon_socket()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall((command + '\n').encode('utf-8'))
+            with client.makefile('r', encoding='utf-8') as f:
+                return json.loads(f.readline())
+
+    def _serve_control(self) -> None:
+        # a socket left behind by a daemon that was killed would block the address
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = _ControlServer(self.socket_path, self)
+        threading.Thread(target=self._server.serve_forever, name='daemon-control',
+                         daemon=True).start()
+
+    def _stop_control(self) -> None:
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
@@ -1,11 +1,18 @@
 import json
+import os
+
+from typing import Iterator
 
 from filter_xml.data_outputter import get_outputter
 from filter_xml.smiley_extractor import SmileyExtractor
 from filter_xml.data_processor import DataProcessor
-from filter_xml.util import is_file_old
+from filter_xml.sharding import ShardedProcessor
+from filter_xml.cache_manifest import CacheManifest
+from filter_xml.config import FilterXMLConfig
 from filter_xml.catalog import RestaurantCatalog, Restaurant
-from filter_xml.filters import PreFilters
+from filter_xml.filters import PreFilters, PostFilters
+from filter_xml.metrics import Metrics
+from filter_xml.profiling import Profiler
 
 
 class DataHandler:
@@ -15,30 +22,114 @@ class DataHandler:
     def __init__(self, *args, **kwargs) -> None:
         sample_size = kwargs.pop('sample', 0)
         skip_scrape = kwargs.pop('no_scrape', False)
-        outputter = get_outputter(kwargs.pop('push', False))
+        outputter = get_outputter(kwargs.pop('push', False), kwargs.pop('parquet', False),
+                                  kwargs.pop('shards', False))
         smiley_file = kwargs.pop('file', None)
+        workers = kwargs.pop('workers', 1)
+        deadline = kwargs.pop('deadline', None)
 
         self.smiley_file = smiley_file if smiley_file else self.SMILEY_XML
-        self.should_get_xml = False if smiley_file else is_file_old(self.SMILEY_XML)
+        self.should_get_xml = not smiley_file
+        self.manifest = CacheManifest()
 
-        self.data_processor = DataProcessor(sample_size, skip_scrape, outputter)
+        self.data_processor = DataProcessor(sample_size, skip_scrape, outputter, deadline)
+        self.processor = ShardedProcessor(self.data_processor, workers) \
+            if workers > 1 else self.data_processor
 
     def collect(self) -> None:
         """
-            Main runner for collection
+            Main runner for collection. Metrics and profiling reports for the run are written once
+            it ends, also if it crashes
+        """
+        try:
+            self._collect()
+        finally:
+            Metrics.write()
+            Profiler.write()
+
+    def _collect(self) -> None:
         """
-        if not is_file_old(self.SMILEY_JSON):
+        Recompute exactly the artifacts whose inputs have changed since they were derived, as
+        recorded in the cache manifest:
+            smiley_xml      downloaded again only if modified since the last download
+            smiley_json     the smiley XML digest and the pre-filter version
+            enrichment      progress of a crashed run is only resumed if the smiley XML digest,
+                            the CVR provider and the post-filter version are unchanged
+        """
+        if self.should_get_xml:
+            self.refresh_xml()
+
+        xml_digest = self.manifest.digest(self.smiley_file)
+        self._check_progress({
+            'xml': xml_digest,
+            'provider': FilterXMLConfig.cvr_provider(),
+            'cvr_elastic_url': FilterXMLConfig.cvr_elastic_url(),
+            'post_filters': CacheManifest.source_digest(PostFilters)
+        })
+
+        json_inputs = {'xml': xml_digest, 'pre_filters': CacheManifest.source_digest(PreFilters)}
+        use_cache = self.manifest.is_current('smiley_json', json_inputs, self.SMILEY_JSON)
+        Metrics.cache('smiley_json', use_cache)
+
+        if use_cache:
             data = RestaurantCatalog()
             pre_filters = PreFilters()
-            with open(self.SMILEY_JSON, 'r') as f:
-                temp = [Restaurant.from_json(row) for row in json.loads(f.read())]
-            temp = [r for r in temp if pre_filters.filter(r)]
+            with Metrics.stage('json_load'), Profiler.stage('json_load'):
+                with open(self.SMILEY_JSON, 'r') as f:
+                    temp = [Restaurant.from_json(row) for row in json.loads(f.read())]
+            with Metrics.stage('pre_filters'), Profiler.stage('pre_filters'):
+                temp = [r for r in temp if pre_filters.filter(r)]
             data.add_many(temp)
+            self.processor.process_smiley_json(data.catalog)
         else:
-            smiley_extractor = SmileyExtractor(self.smiley_file, self.should_get_xml)
-            data = smiley_extractor.create_smiley_json()
+            # the cache is rewritten below, so it must not be trusted if the run crashes midway
+            self.manifest.invalidate('smiley_json')
+            smiley_extractor = SmileyExtractor(self.smiley_file, False)
+            rows = self._cache_rows(smiley_extractor.iter_restaurants(), json_inputs)
+            self.processor.process_smiley_json(rows)
+
+            # the processor may stop early, e.g. when a sample size is given, so make sure the
+            # rest of the rows reach the cache as well
+            for _ in rows:
+                pass
+
+    def refresh_xml(self) -> None:
+        """
+        Download the smiley XML, unless it has not been modified since the last download
+        """
+        validators = self.manifest.get('smiley_xml') \
+            if os.path.isfile(self.SMILEY_XML) else None
+
+        with Metrics.stage('xml_download'):
+            validators = SmileyExtractor(self.SMILEY_XML, True).retrieve_smiley_data(validators)
+        self.manifest.record('smiley_xml', validators)
+
+    def _check_progress(self, inputs: dict) -> None:
+        """
+        Discard the progress of a crashed run if it was made from other inputs than
+        :param inputs
+        """
+        if self.manifest.is_current('enrichment', inputs):
+            return
+
+        print('Inputs of the enrichment have changed, discarding progress of previous runs')
+        self.processor.discard_progress()
+        self.manifest.record('enrichment', inputs)
+
+    def _cache_rows(self, rows: Iterator[Restaurant], inputs: dict) -> Iterator[Restaurant]:
+        """
+        Pass :param rows through while writing them to the smiley JSON cache. The cache is only
+        put in place, and recorded as derived from :param inputs, once every row has been written.
+        """
+        temp_path = f'{self.SMILEY_JSON}.tmp'
 
-            with open(self.SMILEY_JSON, 'w') as f:
-                f.write(json.dumps(data.as_dict(), indent=4))
+        with open(temp_path, 'w') as f:
+            f.write('[')
+            for i, row in enumerate(rows):
+                f.write(',\n' if i else '\n')
+                f.write(json.dumps(row.as_dict(), indent=4))
+                yield row
+            f.write('\n]')
 
-        self.data_processor.process_smiley_json(data)
+        os.replace(temp_path, self.SMILEY_JSON)
+        self.manifest.record('smiley_json', inputs)
@@ -1,25 +1,49 @@
+import gzip
+import hashlib
+import io
 import json
-import requests
-from requests.exceptions import ConnectionError
-from typing import Union
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from requests.exceptions import RequestException
+from typing import Union, List, Optional, Tuple, Iterable, Iterator, TextIO, Dict
 from filter_xml.catalog import RestaurantCatalog, Restaurant
 from filter_xml.config import FilterXMLConfig
+from filter_xml import http_client
+from filter_xml.metrics import Metrics
+from filter_xml.util import normalise
 
 
 class _BaseDataOutputter:
     """
         An abstract class that is used to define different output strategies
     """
+    # whether a successful output updates the data endpoint, and thus the local mirror of it
+    MIRRORED = False
 
-    def get(self) -> RestaurantCatalog:
+    def get(self) -> Optional[RestaurantCatalog]:
         """
-        Abstract implementation of method for retrieving a list of all restaurants
+        Abstract implementation of method for retrieving a list of all restaurants, or None if
+        they could not be retrieved
 
         Should be overridden in inherited classes
         """
         raise NotImplementedError('Method called on base class; use inherited')
 
-    def insert(self, data: Union[dict, list], token: str) -> None:
+    def version(self) -> Optional[str]:
+        """
+        Abstract implementation of method for retrieving the version of the current data, or None
+        if unknown
+
+        Should be overridden in inherited classes
+        """
+        raise NotImplementedError('Method called on base class; use inherited')
+
+    def insert(self, data: Union[dict, list], token: str) -> bool:
         """
         Abstract implementation of method for sending a list of restaurants that should be
         inserted to the API
@@ -27,12 +51,13 @@ class _BaseDataOutputter:
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
+        :return: whether every restaurant was output
 
         Should be overridden in inherited classes
         """
         raise NotImplementedError('Method called on base class; use inherited')
 
-    def update(self, data: Union[dict, list], token: str) -> None:
+    def update(self, data: Union[dict, list], token: str) -> bool:
         """
         Abstract implementation of method for sending a list of restaurants that should be
         updated to the API
@@ -40,12 +65,27 @@ class _BaseDataOutputter:
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
+        :return: whether every restaurant was output
+
+        Should be overridden in inherited classes
+        """
+        raise NotImplementedError('Method called on base class; use inherited')
+
+    def patch(self, data: Union[dict, list], token: str) -> bool:
+        """
+        Abstract implementation of method for sending a list of patches to restaurants that
+        should be updated to the API, cf. filter_xml.catalog.Restaurant.patch()
+
+        :param data: a list of patches or a single patch
+        :param token: an identifier for the current session, to ensure that separate
+                      POST / PUT / DELETE requests are recognized as a single version of data
+        :return: whether every patch was output
 
         Should be overridden in inherited classes
         """
         raise NotImplementedError('Method called on base class; use inherited')
 
-    def delete(self, data: Union[dict, list], token: str) -> None:
+    def delete(self, data: Union[dict, list], token: str) -> bool:
         """
         Abstract implementation of method for sending a list of restaurants that should be
         deleted to the API
@@ -53,6 +93,7 @@ class _BaseDataOutputter:
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
+        :return: whether every restaurant was output
 
         Should be overridden in inherited classes
         """
@@ -60,78 +101,579 @@ class _BaseDataOutputter:
 
 
 class FileOutputter(_BaseDataOutputter):
-    FILE_BASE = 'smiley_json_processed_'
+    """
+    Writes restaurants to smiley_json_processed_<insert|update|delete>.<json|jsonl>, optionally
+    compressed as .gz or .zst.
+
+    Restaurants are encoded and written one at a time, so a set is never held in memory as a
+    single string. Files are written under a temporary name and renamed into place once complete,
+    such that readers never see a partially written file. Formats:
+        json    the {"timestamp": token, "data": [...]} envelope, with a restaurant per line
+        jsonl   a {"timestamp": token} header line followed by a restaurant per line
 
-    def get(self) -> RestaurantCatalog:
+    Settings default to [output] in config file.
+    """
+    FILE_BASE = 'smiley_json_processed_'
+    FORMATS = ['json', 'jsonl']
+    COMPRESSIONS = {'none': '', 'gzip': '.gz', 'zstd': '.zst'}
+
+    def __init__(self, format: Optional[str] = None, compression: Optional[str] = None):
+        self.format = format if format is not None else FilterXMLConfig.output_format()
+        self.compression = compression if compression is not None \
+            else FilterXMLConfig.output_compression()
+
+        if self.format not in self.FORMATS:
+            raise KeyError(f'output format \"{self.format}\" is invalid, please choose one of '
+                           f'[ json | jsonl ]')
+        if self.compression not in self.COMPRESSIONS:
+            raise KeyError(f'output compression \"{self.compression}\" is invalid, please choose '
+                           f'one of [ none | gzip | zstd ]')
+
+    def get(self) -> Optional[RestaurantCatalog]:
         """
         Retrieve sample restaurants from file
         """
         return DatabaseOutputter().get()
 
-    def insert(self, data: Union[dict, list], token: str) -> None:
+    def version(self) -> Optional[str]:
+        """
+        Retrieve the version of the data the files are diffed against
+        """
+        return DatabaseOutputter().version()
+
+    def insert(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
         """
-        Output restaurants marked as insert to smiley_json_processed_PUT.json
+        Output restaurants marked as insert to smiley_json_processed_insert.json
 
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        put_data = {
-            'timestamp': token,
-            'data': data
-        }
-        with open(f'{self.FILE_BASE}insert.json', 'w') as f:
-            f.write(json.dumps(put_data, indent=4))
+        self._write('insert', data, token)
+        return True
 
-    def update(self, data: Union[dict, list], token: str) -> None:
+    def update(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
         """
-        Output restaurants marked as update to smiley_json_processed_POST.json
+        Output restaurants marked as update to smiley_json_processed_update.json
 
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        post_data = {
-            'timestamp': token,
-            'data': data
-        }
-        with open(f'{self.FILE_BASE}update.json', 'w') as f:
-            f.write(json.dumps(post_data, indent=4))
+        self._write('update', data, token)
+        return True
+
+    def patch(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        """
+        Output patches to restaurants marked as update to smiley_json_processed_patch.json
 
-    def delete(self, data: Union[dict, list], token: str) -> None:
+        :param data: a list of patches or a single patch
+        :param token: an identifier for the current session, to ensure that separate
+                      POST / PUT / DELETE requests are recognized as a single version of data
         """
-        Output restaurants marked as delete to smiley_json_processed_DELETE.json
+        self._write('patch', data, token)
+        return True
+
+    def delete(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        """
+        Output restaurants marked as delete to smiley_json_processed_delete.json
 
         :param data: a list of restaurants or a single restaurant
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        delete_data = {
-            'timestamp': token,
-            'data': data
-        }
-        with open(f'{self.FILE_BASE}delete.json', 'w') as f:
-            f.write(json.dumps(delete_data, indent=4))
+        self._write('delete', data, token)
+        return True
+
+    def path(self, kind: str) -> str:
+        """
+        Retrieve the path of the file written for :param kind, i.e. one of
+        [ insert | update | patch | delete ]
+        """
+        return f'{self.FILE_BASE}{kind}.{self.format}{self.COMPRESSIONS[self.compression]}'
+
+    def _write(self, kind: str, data: Union[dict, Iterable[dict]], token: str) -> None:
+        """
+        Stream :param data to a temporary file, and move it into place once complete
+        """
+        rows = [data] if isinstance(data, dict) else data
+        path = self.path(kind)
+        temp_path = f'{path}.tmp'
+
+        with self._open(temp_path) as f:
+            if self.format == 'jsonl':
+                f.write(json.dumps({'timestamp': token}) + '\n')
+                for row in rows:
+                    f.write(json.dumps(row) + '\n')
+            else:
+                f.write(f'{{"timestamp": {json.dumps(token)}, "data": [')
+                separator = '\n'
+                for row in rows:
+                    f.write(separator + json.dumps(row))
+                    separator = ',\n'
+                f.write('\n]}\n')
+
+        os.replace(temp_path, path)
+
+    def _open(self, path: str) -> TextIO:
+        """
+        Open :param path for writing text, through the configured compression
+        """
+        if self.compression == 'gzip':
+            return gzip.open(path, 'wt', encoding='utf-8')
+        if self.compression == 'zstd':
+            # optional dependency, only required when zstd output is configured
+            import zstandard
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'))
+            return io.TextIOWrapper(raw, encoding='utf-8')
+        return open(path, 'w', encoding='utf-8')
+
+
+class ParquetOutputter(_BaseDataOutputter):
+    """
+    Exports the processed catalog as Parquet for analytics, to the directory in [parquet] in
+    config file. Requires the optional pyarrow package.
+        restaurants.parquet     a row per restaurant
+        smiley_reports.parquet  a row per smiley report, referencing restaurants by name_seq_nr
+
+    Dates are typed as timestamps, coordinates as doubles and smileys as integers. Rows are
+    converted and written one row group at a time, and the files are renamed into place once
+    complete. The session token is stored in the metadata of both files.
+
+    Every run is a full export, i.e. get() is always empty, such that the whole catalog ends up
+    in the insert set, and the update and delete sets are always empty.
+    """
+    RESTAURANTS = 'restaurants.parquet'
+    SMILEY_REPORTS = 'smiley_reports.parquet'
+    DATE_FIELDS = ['start_date', 'end_date']
+    FLOAT_FIELDS = ['geo_lat', 'geo_lng']
+
+    def __init__(self, directory: Optional[str] = None, row_group_size: Optional[int] = None,
+                 compression: Optional[str] = None):
+        self.directory = directory if directory is not None \
+            else FilterXMLConfig.parquet_directory()
+        self.row_group_size = row_group_size if row_group_size is not None \
+            else FilterXMLConfig.parquet_row_group_size()
+        self.compression = compression if compression is not None \
+            else FilterXMLConfig.parquet_compression()
+
+    def get(self) -> Optional[RestaurantCatalog]:
+        """
+        Every export is a full export, so there is no previous state to diff against
+        """
+        return RestaurantCatalog()
+
+    def version(self) -> Optional[str]:
+        return None
+
+    def insert(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        """
+        Export restaurants marked as insert, i.e. the full catalog
+
+        :param data: a list of restaurants or a single restaurant
+        :param token: an identifier for the current session, stored in the file metadata
+        """
+        self._write([data] if isinstance(data, dict) else data, token)
+        return True
+
+    def update(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'update')
+
+    def patch(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'patch')
+
+    def delete(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'delete')
+
+    @staticmethod
+    def _ignore(data: Union[dict, Iterable[dict]], kind: str) -> bool:
+        """
+        The update and delete sets are empty, as get() is always empty
+        """
+        if data:
+            print(f'ParquetOutputter only exports full catalogs, ignoring {kind} set')
+        return True
+
+    def _schemas(self, token: str):
+        """
+        Construct the schemas of the restaurant and smiley report tables
+        """
+        import pyarrow as pa
+
+        fields = []
+        for key in Restaurant.FIELDS:
+            if key in self.DATE_FIELDS:
+                fields.append(pa.field(key, pa.timestamp('ms', tz='UTC')))
+            elif key in self.FLOAT_FIELDS:
+                fields.append(pa.field(key, pa.float64()))
+            elif key != 'smiley_reports':
+                fields.append(pa.field(key, pa.string()))
+
+        reports = [pa.field('name_seq_nr', pa.string()),
+                   pa.field('report_id', pa.string()),
+                   pa.field('smiley', pa.int8()),
+                   pa.field('date', pa.timestamp('ms', tz='UTC'))]
+
+        metadata = {'token': token}
+        return pa.schema(fields, metadata=metadata), pa.schema(reports, metadata=metadata)
+
+    def _write(self, rows: Iterable[dict], token: str) -> None:
+        """
+        Convert :param rows to typed columns and write them in row groups
+        """
+        # optional dependency, only required when exporting Parquet
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        schemas = self._schemas(token)
+        paths = [os.path.join(self.directory, self.RESTAURANTS),
+                 os.path.join(self.directory, self.SMILEY_REPORTS)]
+        compression = None if self.compression == 'none' else self.compression
+
+        writers = [pq.ParquetWriter(f'{path}.tmp', schema, compression=compression)
+                   for path, schema in zip(paths, schemas)]
+        groups = [[], []]  # type: List[List[dict]]
+
+        def flush(i: int) -> None:
+            writers[i].write_table(pa.Table.from_pylist(groups[i], schema=schemas[i]))
+            groups[i] = []
+
+        try:
+            for row in rows:
+                groups[0].append(self._restaurant_row(row))
+                groups[1].extend(self._report_rows(row))
+                for i in range(2):
+                    if len(groups[i]) >= self.row_group_size:
+                        flush(i)
+            for i in range(2):
+                if groups[i]:
+                    flush(i)
+        finally:
+            for writer in writers:
+                writer.close()
+
+        for path in paths:
+            os.replace(f'{path}.tmp', path)
+
+    def _restaurant_row(self, row: dict) -> Dict[str, object]:
+        d = {k: v for k, v in row.items() if k != 'smiley_reports'}
+        for key in self.DATE_FIELDS:
+            d[key] = self._date(d.get(key))
+        for key in self.FLOAT_FIELDS:
+            d[key] = float(d[key]) if d.get(key) not in [None, ''] else None
+        return d
+
+    def _report_rows(self, row: dict) -> List[Dict[str, object]]:
+        return [{'name_seq_nr': row['name_seq_nr'],
+                 'report_id': report['report_id'],
+                 'smiley': report['smiley'],
+                 'date': self._date(report['date'])}
+                for report in row.get('smiley_reports', [])]
+
+    @staticmethod
+    def _date(value: Optional[str]) -> Optional[datetime]:
+        return datetime.strptime(value, FilterXMLConfig.iso_fmt()) if value else None
+
+
+class ShardOutputter(_BaseDataOutputter):
+    """
+    Writes the processed catalog as shards partitioned by zip code range or region, to the
+    directory in [shards] in config file, such that clients only interested in a single area only
+    download the shards covering it.
+        manifest.json                           the shards of the latest export
+        <shard>.<sha256[:16]>.json[.gz|.zst]    the restaurants of a shard as a JSON list
+
+    Shard files are content-addressed, i.e. named by the SHA-256 of their uncompressed content,
+    which is also listed in the manifest. A client keeps the manifest of its last sync, downloads
+    the shards whose hash changed, and drops the shards that are no longer listed:
+        {"timestamp": token, "partition": "zip_code", "sha256": <digest of every shard hash>,
+         "shards": {"8000-8099": {"file": "8000-8099.1f3a...json.gz", "sha256": "1f3a...",
+                                  "restaurants": 1012}, ...}}
+
+    Restaurants are sorted by name_seq_nr within a shard and the session token is only stored in
+    the manifest, so a shard without changes keeps its hash and its file is not rewritten. Files
+    of the previous manifest are kept until the next export, such that clients syncing against
+    it do not find them missing.
+
+    Like ParquetOutputter every run is a full export, i.e. get() is always empty.
+    """
+    MANIFEST = 'manifest.json'
+    PARTITIONS = ['zip_code', 'region']
+    UNKNOWN = 'unknown'
+    _SHARD_FILE = re.compile(r'^[a-z0-9-]+\.[0-9a-f]{16}\.json(\.gz|\.zst)?$')
+
+    def __init__(self, directory: Optional[str] = None, partition: Optional[str] = None,
+                 zip_range: Optional[int] = None, compression: Optional[str] = None):
+        self.directory = directory if directory is not None \
+            else FilterXMLConfig.shards_directory()
+        self.partition = partition if partition is not None \
+            else FilterXMLConfig.shards_partition()
+        self.zip_range = zip_range if zip_range is not None \
+            else FilterXMLConfig.shards_zip_range()
+        self.compression = compression if compression is not None \
+            else FilterXMLConfig.shards_compression()
+
+        if self.partition not in self.PARTITIONS:
+            raise KeyError(f'shard partition \"{self.partition}\" is invalid, please choose one '
+                           f'of [ zip_code | region ]')
+        if self.compression not in FileOutputter.COMPRESSIONS:
+            raise KeyError(f'shard compression \"{self.compression}\" is invalid, please choose '
+                           f'one of [ none | gzip | zstd ]')
+        if self.zip_range < 1:
+            raise ValueError(f'shard zip_range must be positive, got {self.zip_range}')
+
+    def get(self) -> Optional[RestaurantCatalog]:
+        """
+        Every export is a full export, so there is no previous state to diff against
+        """
+        return RestaurantCatalog()
+
+    def version(self) -> Optional[str]:
+        return None
+
+    def insert(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        """
+        Export restaurants marked as insert, i.e. the full catalog
+
+        :param data: a list of restaurants or a single restaurant
+        :param token: an identifier for the current session, stored in the manifest
+        """
+        self._write([data] if isinstance(data, dict) else data, token)
+        return True
+
+    def update(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'update')
+
+    def patch(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'patch')
+
+    def delete(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        return self._ignore(data, 'delete')
+
+    @staticmethod
+    def _ignore(data: Union[dict, Iterable[dict]], kind: str) -> bool:
+        """
+        The update and delete sets are empty, as get() is always empty
+        """
+        if data:
+            print(f'ShardOutputter only exports full catalogs, ignoring {kind} set')
+        return True
+
+    def shard(self, row: dict) -> str:
+        """
+        The name of the shard :param row belongs to, e.g. 8000-8099 or region-midtjylland
+        """
+        value = row.get(self.partition)
+        if self.partition == 'zip_code':
+            try:
+                start = int(value) // self.zip_range * self.zip_range
+            except (TypeError, ValueError):
+                return self.UNKNOWN
+            return f'{start:04d}-{start + self.zip_range - 1:04d}'
+
+        slug = re.sub(r'[^a-z0-9]+', '-', normalise(value)).strip('-') if value else ''
+        return slug or self.UNKNOWN
+
+    def manifest(self) -> Optional[dict]:
+        """
+        The manifest of the latest export, or None if there is none
+        """
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST), 'r') as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, rows: Iterable[dict], token: str) -> None:
+        """
+        Partition :param rows into shards, write the shards that changed, and replace the
+        manifest
+        """
+        shards = dict()  # type: Dict[str, List[Tuple[str, str]]]
+        for row in rows:
+            shards.setdefault(self.shard(row), []).append((row['name_seq_nr'], json.dumps(row)))
+
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.manifest() or {'shards': {}}
+        extension = FileOutputter.COMPRESSIONS[self.compression]
+        listed = dict()  # type: Dict[str, dict]
+        written = 0
+
+        for name, lines in sorted(shards.items()):
+            lines.sort()
+            content = ('[\n' + ',\n'.join(line for _, line in lines) + '\n]\n').encode('utf-8')
+            digest = hashlib.sha256(content).hexdigest()
+            file = f'{name}.{digest[:16]}.json{extension}'
+            listed[name] = {'file': file, 'sha256': digest, 'restaurants': len(lines)}
+
+            path = os.path.join(self.directory, file)
+            if os.path.isfile(path):
+                continue
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(self._compress(content))
+            os.replace(f'{path}.tmp', path)
+            written += 1
+
+        manifest_path = os.path.join(self.directory, self.MANIFEST)
+        with open(f'{manifest_path}.tmp', 'w') as f:
+            f.write(json.dumps({
+                'timestamp': token,
+                'partition': self.partition,
+                'sha256': hashlib.sha256(''.join(
+                    f'{name} {shard["sha256"]}\n' for name, shard in listed.items()
+                ).encode('utf-8')).hexdigest(),
+                'shards': listed
+            }, indent=4))
+        os.replace(f'{manifest_path}.tmp', manifest_path)
+
+        # remove shard files referenced by neither the new nor the previous manifest
+        kept = {shard['file'] for shard in listed.values()} | \
+            {shard['file'] for shard in previous['shards'].values()}
+        for file in os.listdir(self.directory):
+            if self._SHARD_FILE.match(file) and file not in kept:
+                os.remove(os.path.join(self.directory, file))
+
+        Metrics.increment('shards.written', written)
+        Metrics.increment('shards.unchanged', len(listed) - written)
+        print(f'Wrote {written} of {len(listed)} shards to {self.directory}')
+
+    def _compress(self, content: bytes) -> bytes:
+        """
+        Compress :param content, deterministically such that equal shards are equal files
+        """
+        if self.compression == 'gzip':
+            return gzip.compress(content, mtime=0)
+        if self.compression == 'zstd':
+            # optional dependency, only required when zstd output is configured
+            import zstandard
+            return zstandard.ZstdCompressor().compress(content)
+        return content
+
+
+class ChunkSpill:
+    """
+    Rows of an upload encoded as JSON and spilled to a temporary file, in chunks of at most
+    chunk_bytes. Rows are only encoded once, however many times a chunk is sent, and neither the
+    rows nor their encoding are kept in memory:
+        >>> with ChunkSpill(rows, 65536) as chunks:
+        ...     len(chunks), chunks[0]
+        (3, b'{"name_seq_nr": "1", ...},{"name_seq_nr": "2", ...}')
+    """
+
+    def __init__(self, rows: Iterable, chunk_bytes: int):
+        self._file = tempfile.TemporaryFile()
+        # offset and length of every chunk in the file
+        self._chunks = []  # type: List[Tuple[int, int]]
+        self._lock = threading.Lock()
+
+        start, size = 0, 0
+        for row in rows:
+            encoded = json.dumps(row).encode('utf-8')
+            # a single row larger than the limit is a chunk of its own
+            if size and size + 1 + len(encoded) > chunk_bytes:
+                self._chunks.append((start, size))
+                start, size = start + size, 0
+            if size:
+                self._file.write(b',')
+                size += 1
+            self._file.write(encoded)
+            size += len(encoded)
+
+        if size:
+            self._chunks.append((start, size))
+
+    def __enter__(self) -> 'ChunkSpill':
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    def __getitem__(self, chunk: int) -> bytes:
+        """
+        The encoded rows of :param chunk, separated by commas
+        """
+        start, size = self._chunks[chunk]
+        with self._lock:
+            self._file.seek(start)
+            return self._file.read(size)
+
+    def rows(self, chunk: int) -> list:
+        """
+        The rows of :param chunk, decoded again
+        """
+        return json.loads(b'[' + self[chunk] + b']')
 
 
 class DatabaseOutputter(_BaseDataOutputter):
-    ENDPOINT = FilterXMLConfig.data_endpoint()
+    """
+    Sends restaurants to the data endpoint.
+
+    Every set is split into chunks of at most chunk_bytes of JSON rows, spilled to disk as they
+    are consumed, such that a streamed set is never held in memory. The chunks are gzip
+    compressed and sent in parallel over the pooled session of the shared HTTP client. Each chunk
+    carries an Idempotency-Key header derived from the session token and the chunk, such that a
+    chunk which is resent after a lost response is only applied once. Failed chunks are resent
+    up to retries times, and the rows of chunks that still fail are decoded again and written to
+    file by FileOutputter.
 
-    def get(self) -> RestaurantCatalog:
+    Settings default to [upload] in config file.
+    """
+    ENDPOINT = FilterXMLConfig.data_endpoint()
+    MIRRORED = True
+    METHODS = {'insert': 'POST', 'update': 'PUT', 'patch': 'PATCH', 'delete': 'DELETE'}
+
+    def __init__(self, chunk_bytes: Optional[int] = None, workers: Optional[int] = None,
+                 retries: Optional[int] = None, compress: Optional[bool] = None,
+                 backoff: float = 1.0):
+        self.chunk_bytes = chunk_bytes if chunk_bytes is not None \
+            else FilterXMLConfig.upload_chunk_bytes()
+        self.workers = workers if workers is not None else FilterXMLConfig.upload_workers()
+        self.retries = retries if retries is not None else FilterXMLConfig.upload_retries()
+        self.compress = compress if compress is not None else FilterXMLConfig.upload_compress()
+        self.backoff = backoff
+
+    def get(self) -> Optional[RestaurantCatalog]:
         """
-        Retrieve all current restaurants from the API
+        Retrieve all current restaurants from the API, or None if the API could not be reached
+        or did not answer with the restaurants, such that an error is never mistaken for an
+        empty state
         """
         catalog = RestaurantCatalog()
         try:
-            res = requests.get(self.ENDPOINT, timeout=4)
-            if res.status_code == 200:
-                catalog.add_many([Restaurant.from_json(row)
-                                  for row in res.json()])
-        except ConnectionError:
+            res = http_client.get(self.ENDPOINT, timeout=4)
+        except RequestException:
+            Metrics.increment('errors.data_endpoint')
             print('Failed to connect to API')
+            return None
+
+        if res.status_code != 200:
+            Metrics.increment('errors.data_endpoint')
+            print(f'Failed to retrieve restaurants from API, status {res.status_code}')
+            return None
+
+        catalog.add_many([Restaurant.from_json(row)
+                          for row in res.json()])
         return catalog
 
-    def insert(self, data: Union[dict, list], token: str) -> None:
+    def version(self) -> Optional[str]:
+        """
+        Retrieve the version of the data in the API, as reported by the X-Data-Version header.
+        None if the API does not report a version or could not be reached
+        """
+        try:
+            res = http_client.request('HEAD', self.ENDPOINT, timeout=4)
+        except RequestException:
+            return None
+        return res.headers.get('X-Data-Version') if res.status_code == 200 else None
+
+    def insert(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
         """
         Send restaurants marked as insert to API
 
@@ -139,20 +681,9 @@ class DatabaseOutputter(_BaseDataOutputter):
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        if len(data) == 0:
-            return
-
-        put_data = {
-            'timestamp': token,
-            'data': data
-        }
-        res = requests.post(self.ENDPOINT, json=put_data)
+        return self._upload('insert', data, token)
 
-        if res.status_code != 200:
-            print('Failed to send insert data to database, writing to file instead')
-            FileOutputter().insert(data, token)
-
-    def update(self, data: Union[dict, list], token: str) -> None:
+    def update(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
         """
         Send restaurants marked as update to API
 
@@ -160,20 +691,19 @@ class DatabaseOutputter(_BaseDataOutputter):
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        if len(data) == 0:
-            return
+        return self._upload('update', data, token)
 
-        post_data = {
-            'timestamp': token,
-            'data': data
-        }
-        res = requests.put(self.ENDPOINT, json=post_data)
+    def patch(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
+        """
+        Send patches to restaurants marked as update to API
 
-        if res.status_code != 200:
-            print('Failed to send update data to database, writing to file instead')
-            FileOutputter().update(data, token)
+        :param data: a list of patches or a single patch
+        :param token: an identifier for the current session, to ensure that separate
+                      POST / PUT / DELETE requests are recognized as a single version of data
+        """
+        return self._upload('patch', data, token)
 
-    def delete(self, data: Union[dict, list], token: str) -> None:
+    def delete(self, data: Union[dict, Iterable[dict]], token: str) -> bool:
         """
         Send restaurants marked as delete to API
 
@@ -181,25 +711,101 @@ class DatabaseOutputter(_BaseDataOutputter):
         :param token: an identifier for the current session, to ensure that separate
                       POST / PUT / DELETE requests are recognized as a single version of data
         """
-        if len(data) == 0:
-            return
+        return self._upload('delete', data, token)
 
-        delete_data = {
-            'timestamp': token,
-            'data': data
+    @staticmethod
+    def idempotency_key(token: str, kind: str, chunk: int, chunks: int, data: bytes) -> str:
+        """
+        Construct the idempotency key of a single chunk. The key is the same every time the
+        chunk is sent within the session identified by :param token, and includes a digest of
+        the encoded rows :param data, since tokens have a resolution of seconds, and different
+        data pushed within the same second must not be taken for a resent chunk
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        return hashlib.sha256(f'{token}|{kind}|{chunk}|{chunks}|{digest}'
+                              .encode('utf-8')).hexdigest()
+
+    def _chunk(self, rows: Iterable) -> ChunkSpill:
+        """
+        Split :param rows into chunks of at most self.chunk_bytes of encoded JSON, spilled to
+        disk, cf. ChunkSpill
+        """
+        return ChunkSpill(rows, self.chunk_bytes)
+
+    def _upload(self, kind: str, data: Union[dict, Iterable], token: str) -> bool:
+        """
+        Send :param data in chunks, resending failed chunks, and write the rows of chunks that
+        fail every attempt to file. Returns whether every chunk was sent
+        """
+        with self._chunk([data] if isinstance(data, (dict, str)) else data) as chunks:
+            if not chunks:
+                return True
+
+            pending = list(range(len(chunks)))
+            Metrics.increment('upload.chunks', len(chunks))
+
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    Metrics.increment('upload.retries', len(pending))
+                    print(f'Resending {len(pending)} of {len(chunks)} {kind} chunks')
+                    time.sleep(self.backoff * 2 ** (attempt - 1))
+
+                with ThreadPoolExecutor(max_workers=min(self.workers, len(pending))) as pool:
+                    sent = list(pool.map(lambda i: self._send_chunk(kind, chunks, i, token),
+                                         pending))
+
+                pending = [i for i, ok in zip(pending, sent) if not ok]
+                if not pending:
+                    return True
+
+            Metrics.increment('errors.data_endpoint')
+            print(f'Failed to send {len(pending)} of {len(chunks)} {kind} chunks to database, '
+                  f'writing to file instead')
+            getattr(FileOutputter(), kind)(self._failed_rows(chunks, pending), token)
+            return False
+
+    @staticmethod
+    def _failed_rows(chunks: ChunkSpill, failed: List[int]) -> Iterator:
+        for chunk in failed:
+            yield from chunks.rows(chunk)
+
+    def _send_chunk(self, kind: str, chunks: ChunkSpill, chunk: int, token: str) -> bool:
+        """
+        Send a single chunk. Returns whether the data endpoint accepted it
+        """
+        data = chunks[chunk]
+        body = f'{{"timestamp": {json.dumps(token)}, "chunk": {chunk}, ' \
+               f'"chunks": {len(chunks)}, "data": ['.encode('utf-8') + data + b']}'
+        headers = {
+            'Content-Type': 'application/json',
+            'Idempotency-Key': self.idempotency_key(token, kind, chunk, len(chunks), data)
         }
-        res = requests.delete(self.ENDPOINT, json=delete_data)
+        if self.compress:
+            # a fixed mtime keeps the compressed body identical between attempts
+            body = gzip.compress(body, mtime=0)
+            headers['Content-Encoding'] = 'gzip'
 
-        if res.status_code != 200:
-            print('Failed to send delete data to database, writing to file instead')
-            FileOutputter().delete(data, token)
+        Metrics.increment('upload.bytes', len(body))
+        try:
+            with Metrics.stage('upload_chunk'):
+                res = http_client.request(self.METHODS[kind], self.ENDPOINT, data=body,
+                                          headers=headers, timeout=30)
+        except RequestException:
+            return False
+
+        return res.status_code == 200
 
 
-def get_outputter(should_send_to_db: bool) -> _BaseDataOutputter:
+def get_outputter(should_send_to_db: bool, should_export_parquet: bool = False,
+                  should_shard: bool = False) -> _BaseDataOutputter:
     """
         A helper method used to pick which outputter should be used
     """
     if should_send_to_db:
         return DatabaseOutputter()
+    elif should_export_parquet:
+        return ParquetOutputter()
+    elif should_shard:
+        return ShardOutputter()
     else:
         return FileOutputter()
@@ -1,109 +1,456 @@
+import os
+import threading
 import time
 from datetime import datetime
+from typing import Iterable, Iterator, Optional, Set, Union, List
 from filter_xml.config import FilterXMLConfig
 from filter_xml.data_outputter import _BaseDataOutputter
 from filter_xml.temp_file import TempFile
+from filter_xml.aggregates import Aggregates
 from filter_xml.blacklist import Blacklist
 from filter_xml.cvr import get_cvr_handler, FindSmileyHandler
 from filter_xml.filters import PostFilters
-from filter_xml.catalog import RestaurantCatalog
+from filter_xml.industry_screen import IndustryScreen
+from filter_xml.catalog import RestaurantCatalog, Restaurant
+from filter_xml.pipeline import Pipeline, Stage
+from filter_xml.util import RateLimiter, SingleFlight
+from filter_xml.metrics import Metrics, Progress
+from filter_xml.merge_diff import MergeDiff
+from filter_xml.mirror import Mirror
+from filter_xml.profiling import Profiler
+from filter_xml.schedule import Schedule
 
 
 class DataProcessor:
     """
     Responsible for processing the data in smiley json file
     """
+    # amount of p-numbers looked up at once by CVR handlers with a pre-processing step
+    CVR_BATCH_SIZE = 3000
 
-    def __init__(self, sample_size: int, skip_scrape: bool, outputter: _BaseDataOutputter) -> None:
+    def __init__(self, sample_size: int, skip_scrape: bool, outputter: _BaseDataOutputter,
+                 deadline: Optional[float] = None) -> None:
         self._cvr_handler = get_cvr_handler()
         self._smiley_handler = FindSmileyHandler()
         self._sample_size = sample_size
         self._skip_scrape = skip_scrape
         self._outputter = outputter
         self.post_filters = PostFilters()
+        self._screen = IndustryScreen.load() if FilterXMLConfig.industry_screen() else None
+        self._screened = 0
 
-    def process_smiley_json(self, data: RestaurantCatalog) -> None:
+        # only sleep if --no-scrape is not passed, and if our cvr provider requests it.
+        self._rate_limiter = RateLimiter(
+            self._cvr_handler.CRAWL_DELAY
+            if not skip_scrape and self._cvr_handler.SHOULD_SLEEP else 0)
+
+        # guards the result catalog, temp file, blacklist and filter log, which are shared
+        # between the worker threads of the pipeline
+        self._state_lock = threading.Lock()
+
+        # these are only assigned while processing
+        self._pipeline = None  # type: Optional[Pipeline]
+        self._temp_file = None  # type: Optional[TempFile]
+        self._result = None  # type: Optional[RestaurantCatalog]
+        self._progress = None  # type: Optional[Progress]
+        # lookups by p-number and findsmiley.dk URL, shared between rows within a run
+        self._cvr_flight = SingleFlight()
+        self._smiley_flight = SingleFlight()
+
+        # the catalog most recently passed to output(), e.g. for the query service
+        self.last_output = None  # type: Optional[RestaurantCatalog]
+
+        # with a deadline, enrichment stops :param deadline seconds from now, and restaurants
+        # not reached by then are left for the next run, cf. enrich()
+        self._deadline = time.monotonic() + deadline if deadline is not None else None
+        self._dropped = set()  # type: Set[str]
+        self._pending = set()  # type: Set[str]
+
+    def process_smiley_json(self, data: Union[RestaurantCatalog, Iterable[Restaurant]]) -> None:
         """
         Processes smiley .json file.
             Includes only production units
             Applies filters from DataHandler
             Collects additional, external data through CVRHandler
 
-        Restaurants that have already been processed (i.e., external data has been collected) are
-        stored in processed_companies.csv - handled by PrevProcessedFile.
+        Restaurants are streamed through the stages below, connected by bounded queues. Every
+        stage runs in its own thread(s), cf. [pipeline] in config file.
+            source          read restaurants from :param data
+            pre_filter      skip invalid production units and rows processed prior to a crash
+            cvr             collect CVR data through CVRHandler
+            post_filter     apply PostFilters, blacklisting rows that do not pass
+            smiley          collect smiley reports through FindSmileyHandler
+            persist         add the restaurant to the result and the temp file
 
         Restaurants that have been processed during the current session are stored in
         temp.csv - handled by TempFile. This is done to save progress in the case of a crash
-        during the run.
+        during the run. Progress is kept as well when the deadline is reached, such that the next
+        run resumes with the restaurants left.
+        """
+        temp_file = TempFile()
+        res = self.enrich(data, temp_file)
+        self.output(res)
+
+        if self._pending:
+            print(f'Deadline reached, {len(self._pending)} restaurants are left for the next run')
+        else:
+            temp_file.close()
+        Blacklist.close_file()
+
+    def discard_progress(self) -> None:
+        """
+        Remove the temp file of a crashed run, such that every restaurant is processed again
+        """
+        if os.path.isfile(TempFile.FILE_NAME):
+            os.remove(TempFile.FILE_NAME)
 
-        Once data has been processed, keys are renamed. Cf. the translation map in _rename_keys()
+    def enrich(self, data: Union[RestaurantCatalog, Iterable[Restaurant]],
+               temp_file: TempFile) -> RestaurantCatalog:
         """
+        Run :param data through the processing pipeline, saving progress in :param temp_file.
+        Returns every restaurant processed in the current session, including those processed
+        prior to a crash.
 
-        temp_file = TempFile()
+        With a deadline, restaurants are enriched in the order of Schedule, and no restaurants
+        enter the pipeline once the deadline has passed. Restaurants already in the pipeline are
+        finished, and the rest are pending, cf. output()
+        """
+        self._temp_file = temp_file
+        self._result = temp_file.get_all()
+        self._dropped = set()
+        self._pending = set()
+        self._screened = 0
+        self._cvr_flight = SingleFlight()
+        self._smiley_flight = SingleFlight()
 
-        res = temp_file.get_all()
+        source = data.catalog if isinstance(data, RestaurantCatalog) else data
+        ordered = None  # type: Optional[List[Restaurant]]
+        if self._deadline is not None:
+            ordered = Schedule.load().order(source)
+            source = self._until_deadline(ordered)
 
-        total_rows = data.catalog_size
-        row_index = 0
+        if self._sample_size:
+            self._progress = Progress(self._sample_size, label='samples')
+        else:
+            self._progress = Progress(len(ordered) if ordered is not None else
+                                      len(data) if isinstance(data, list) else
+                                      data.catalog_size if isinstance(data, RestaurantCatalog)
+                                      else 0)
 
-        if self._cvr_handler.PRE_PROCESSING_STEP:
-            self._cvr_handler.pre_processing(data.catalog)
+        pre_processing = not self._skip_scrape and self._cvr_handler.PRE_PROCESSING_STEP
 
-        for restaurant in data.catalog:
-            # we use this to avoid using the same fallback in three separate if statements
-            row_kept = False
+        self._pipeline = Pipeline(source, [
+            Stage('pre_filter', self._pre_filter,
+                  FilterXMLConfig.pipeline_workers('pre_filter')),
+            Stage('cvr', self._collect_cvr, FilterXMLConfig.pipeline_workers('cvr'),
+                  batch_size=self.CVR_BATCH_SIZE if pre_processing else 1),
+            Stage('post_filter', self._post_filter,
+                  FilterXMLConfig.pipeline_workers('post_filter')),
+            Stage('smiley', self._collect_smiley, FilterXMLConfig.pipeline_workers('smiley')),
+            Stage('persist', self._persist, FilterXMLConfig.pipeline_workers('persist'))
+        ], queue_size=FilterXMLConfig.pipeline_queue_size())
+        with Metrics.stage('enrich'), Profiler.stage('enrich'):
+            self._pipeline.run()
+        print(self._progress.report())
+        if self._screen:
+            print(f'{self._screened} rows screened out by industry before their CVR lookup')
+        saved = self._cvr_flight.saved + self._smiley_flight.saved
+        if saved:
+            print(f'{saved} duplicate lookups answered from shared results')
+        Metrics.increment('coalesced.cvr', self._cvr_flight.saved)
+        Metrics.increment('coalesced.findsmiley', self._smiley_flight.saved)
 
-            # if sample size CLI arg is supplied, stop when its reached
-            if self._sample_size and res.catalog_size >= self._sample_size:
-                break
+        self.post_filters.log_filters()
 
-            # first check if the restaurant is valid
-            if restaurant.is_valid_production_unit():
+        if ordered is not None:
+            settled = {res.name_seq_nr for res in self._result.catalog} | self._dropped
+            self._pending = {res.name_seq_nr for res in ordered
+                             if res.name_seq_nr not in settled}
+            Metrics.increment('deadline.pending', len(self._pending))
 
-                # then ensure it hasn't already been processed prior to a crash
-                if not temp_file.contains(restaurant.name_seq_nr):
+        return self._result
 
-                    # only sleep if --no-scrape is not passed, and if our cvr provider requests it.
-                    if not self._skip_scrape and self._cvr_handler.SHOULD_SLEEP and row_index > 0:
-                        time.sleep(self._cvr_handler.CRAWL_DELAY)
+    def _until_deadline(self, restaurants: List[Restaurant]) -> Iterator[Restaurant]:
+        """
+        Pass :param restaurants on until the deadline has passed
+        """
+        for restaurant in restaurants:
+            if time.monotonic() >= self._deadline:
+                return
+            yield restaurant
 
-                    # only collect data if we haven't passed --no-scrape
-                    if not self._skip_scrape:
-                        restaurant = self._cvr_handler.collect_data(restaurant)
+    def output(self, res: RestaurantCatalog) -> None:
+        """
+        Calculate the diff between :param res and the current state of the outputter, and send
+        the insert, update and delete sets to the outputter.
 
-                    # check filters to see if we should keep the row
-                    # otherwise add it to blacklist so we don't scrape it next time
-                    if self.post_filters.filter(restaurant):
-                        if not self._skip_scrape:
-                            restaurant = self._smiley_handler.collect_data(restaurant)
+        The current state is taken from the local mirror of the last push when the outputter
+        reports the same data version as the mirror, or when the outputter cannot be reached.
+        Otherwise it is retrieved from the outputter. Without either, nothing is sent to an
+        outputter that is mirrored.
 
-                        res.add(restaurant)
-                        row_kept = True
-                        temp_file.add_data(restaurant)
-                    else:
-                        Blacklist.add(restaurant)
+        With delta in [diff] in config file, updated restaurants are sent as patches. With
+        external in [diff], the diff is computed by a merge join over sorted spill files, and the
+        sets are streamed to the outputter, cf. MergeDiff.
 
-            # if any check resulted in a row skip, decrement the total row count
-            # for terminal output purposes
-            if not row_kept:
-                total_rows -= 1
+        Restaurants pending after a deadline are retained as they are in the current state, i.e.
+        neither updated nor deleted, and pending restaurants that are new are not inserted yet
+        """
+        self.last_output = res
+        token = datetime.now().strftime(FilterXMLConfig.iso_fmt())
+        delta = FilterXMLConfig.diff_delta()
+        mirror = Mirror.load()
+        current = None
 
-            if self._sample_size:
-                if row_kept:
-                    print(f'Collected {res.catalog_size} of {self._sample_size} samples')
+        with Metrics.stage('outputter_get'), Profiler.stage('outputter_get'):
+            use_mirror = mirror.is_valid(self._outputter.version())
+            if not use_mirror:
+                current = self._outputter.get()
+                if current is None and mirror.fingerprints:
+                    print('Diffing against the state of the last push instead')
+                    use_mirror = True
+        Metrics.cache('mirror', use_mirror)
+
+        if current is None and not use_mirror and self._outputter.MIRRORED:
+            # diffing against an empty state would insert every restaurant again
+            print('Skipping output, as the current restaurants could not be retrieved and there '
+                  'is no mirror of the last push to diff against')
+            return
+
+        if FilterXMLConfig.diff_external():
+            aggregates = Aggregates.load()
+            with MergeDiff(res, retained=self._pending, delta=delta,
+                           known=aggregates if aggregates.path else None) as diff:
+                with Metrics.stage('diff'), Profiler.stage('diff'):
+                    diff.spill(mirror if use_mirror else current)
+                # only the spilled records of the current state are needed from here on
+                current = None
+                sent = self._output_merged(res, token, diff, aggregates)
+        else:
+            sent = self._output_sets(res, token, delta, mirror if use_mirror else current)
+
+        if all(sent):
+            self._schedule(res, token)
+
+        if not self._outputter.MIRRORED:
+            return
+        if all(sent):
+            mirror.update(res, token, self._outputter.version(), signatures=delta)
+            mirror.save()
+        else:
+            mirror.invalidate()
+
+    def _output_sets(self, res: RestaurantCatalog, token: str, delta: bool,
+                     old: Union[Mirror, RestaurantCatalog, None]) -> List[bool]:
+        """
+        Diff :param res against :param old in memory, and send the sets to the outputter. The
+        aggregates are updated once every set is sent. Returns whether each set was sent
+        """
+        with Metrics.stage('diff'), Profiler.stage('diff'):
+            if isinstance(old, Mirror):
+                res.setup_fingerprint_diff(old.fingerprints, old.signatures)
             else:
-                print(f'{total_rows - res.catalog_size} rows to go')
+                res.setup_diff(old or RestaurantCatalog())
+            res.retained = self._pending & res.old_ids
+            insert_set, delete_set = res.insert_set(), res.delete_set()
+            update_set = res.patch_set() if delta else res.update_set()
 
-            row_index += 1
+        Metrics.increment('diff.insert', len(insert_set))
+        Metrics.increment('diff.update', len(update_set))
+        Metrics.increment('diff.delete', len(delete_set))
 
-        self.post_filters.log_filters()
+        with Metrics.stage('output'), Profiler.stage('output'):
+            send_update = self._outputter.patch if delta else self._outputter.update
+            sent = [self._outputter.insert(insert_set, token),
+                    send_update(update_set, token),
+                    self._outputter.delete(delete_set, token)]
 
-        token = datetime.now().strftime(FilterXMLConfig.iso_fmt())
-        res.setup_diff(self._outputter.get())
+        # the aggregates have to match the state of the outputter, so a failed push keeps them
+        if all(sent):
+            with Metrics.stage('aggregates'), Profiler.stage('aggregates'):
+                self._aggregate(res, insert_set + update_set, delete_set, token)
+        return sent
 
-        self._outputter.insert(res.insert_set(), token)
-        self._outputter.update(res.update_set(), token)
-        self._outputter.delete(res.delete_set(), token)
+    def _output_merged(self, res: RestaurantCatalog, token: str, diff: MergeDiff,
+                       aggregates: Aggregates) -> List[bool]:
+        """
+        Stream the sets of the spilled :param diff of :param res to the outputter. The insert set
+        is streamed while the merge join runs, and the update and delete sets from their spill
+        files. The aggregates are updated once every set is sent. Returns whether each set was
+        sent
+        """
+        with Metrics.stage('output'), Profiler.stage('output'):
+            send_update = self._outputter.patch if diff.delta else self._outputter.update
+            sent = [self._outputter.insert(diff.inserts(), token),
+                    send_update(diff.updates(), token),
+                    self._outputter.delete(diff.deletes(), token)]
+        res.retained = diff.retained
 
-        temp_file.close()
-        Blacklist.close_file()
+        for kind, count in diff.counts.items():
+            Metrics.increment(f'diff.{kind}', count)
+
+        if aggregates.path and all(sent):
+            with Metrics.stage('aggregates'), Profiler.stage('aggregates'):
+                incremental = not diff.unknown_old and diff.old_count == len(aggregates)
+                if incremental:
+                    changed = set(diff.changed)
+                    aggregates.apply({r.name_seq_nr: r for r in res.catalog
+                                      if r.name_seq_nr in changed}, diff.changed, diff.deletes())
+                else:
+                    aggregates.rebuild(res)
+                Metrics.cache('aggregates', incremental)
+                aggregates.token = token
+                aggregates.save()
+        return sent
+
+    @staticmethod
+    def _aggregate(res: RestaurantCatalog, changed: list, deleted: list, token: str) -> None:
+        """
+        Update the aggregates of the previous run with the diff of :param res. The aggregates
+        are built from scratch if they do not cover exactly the restaurants diffed against
+        """
+        aggregates = Aggregates.load()
+        if not aggregates.path:
+            return
+
+        incremental = aggregates.ids() == res.old_ids
+        if incremental:
+            aggregates.apply(res.new_by_key, [row['name_seq_nr'] for row in changed], deleted)
+        else:
+            aggregates.rebuild(res)
+        Metrics.cache('aggregates', incremental)
+        aggregates.token = token
+        aggregates.save()
+
+    @staticmethod
+    def _schedule(res: RestaurantCatalog, token: str) -> None:
+        """
+        Record the restaurants of :param res as output, for prioritising later runs
+        """
+        schedule = Schedule.load()
+        if not schedule.path:
+            return
+
+        schedule.record(res.catalog, token, retained=res.retained)
+        schedule.save()
+
+    def prepare(self) -> None:
+        """
+        Perform the pre-processing of the CVR handler covering every restaurant, e.g. the bulk
+        export of CVRHandlerElastic, such that processes forked afterwards share it rather than
+        repeat it
+        """
+        if not self._skip_scrape and self._cvr_handler.PRE_PROCESSING_STEP:
+            self._cvr_handler.prepare()
+
+    def share(self, shares: int) -> None:
+        """
+        Configure this processor to handle one of :param shares equally sized shares of a run,
+        i.e. divide the sample size and the CVR provider rate limit between the shares
+        """
+        self._sample_size = -(-self._sample_size // shares)
+        self._rate_limiter = RateLimiter(self._rate_limiter.interval * shares)
+
+    def _pre_filter(self, restaurant: Restaurant) -> Optional[Restaurant]:
+        """
+        Keep only valid production units that haven't already been processed prior to a crash,
+        and, with [industry_screen] enabled, whose industry may pass the post-filters
+        """
+        if not restaurant.is_valid_production_unit():
+            self._row_skipped(restaurant)
+            return None
+
+        if self._screen and not self._screen.can_match(restaurant):
+            Metrics.increment('industry_screen.screened')
+            with self._state_lock:
+                self._screened += 1
+            self._row_skipped(restaurant)
+            return None
+
+        processed = self._temp_file.contains(restaurant.name_seq_nr)
+        Metrics.cache('temp_file', processed)
+        if processed:
+            self._row_skipped(restaurant)
+            return None
+
+        return restaurant
+
+    def _collect_cvr(self, restaurants: Union[Restaurant, List[Restaurant]]):
+        """
+        Collect CVR data, only if we haven't passed --no-scrape. CVR handlers with a
+        pre-processing step receive a batch of restaurants at a time, and other handlers look up
+        every p-number once per run, sharing the result between rows with the same p-number
+        """
+        if self._skip_scrape:
+            return restaurants
+
+        if isinstance(restaurants, list):
+            with Metrics.stage('cvr_batch'):
+                self._cvr_handler.pre_processing(restaurants)
+                return [self._cvr_handler.collect_data(restaurant) for restaurant in restaurants]
+
+        result = self._cvr_flight.do(restaurants.pnr, lambda: self._lookup_cvr(restaurants))
+        return self._cvr_handler.apply_result(restaurants, result)
+
+    def _lookup_cvr(self, restaurant: Restaurant) -> tuple:
+        self._rate_limiter.wait()
+        with Metrics.stage('cvr_lookup'):
+            return self._cvr_handler.result(self._cvr_handler.collect_data(restaurant))
+
+    def _post_filter(self, restaurant: Restaurant) -> Optional[Restaurant]:
+        """
+        Check filters to see if we should keep the row, otherwise add it to blacklist so we don't
+        scrape it next time
+        """
+        with self._state_lock:
+            if self.post_filters.filter(restaurant):
+                return restaurant
+            Blacklist.add(restaurant)
+
+        self._row_skipped(restaurant)
+        return None
+
+    def _collect_smiley(self, restaurant: Restaurant) -> Restaurant:
+        """
+        Collect smiley reports, only if we haven't passed --no-scrape. Every findsmiley.dk page is
+        fetched once per run, sharing the result between rows with the same URL
+        """
+        if self._skip_scrape:
+            return restaurant
+
+        result = self._smiley_flight.do(restaurant.url, lambda: self._fetch_smiley(restaurant))
+        return self._smiley_handler.apply_result(restaurant, result)
+
+    def _fetch_smiley(self, restaurant: Restaurant) -> tuple:
+        with Metrics.stage('findsmiley_fetch'):
+            return self._smiley_handler.report_ids(self._smiley_handler.page(restaurant.url))
+
+    def _persist(self, restaurant: Restaurant) -> None:
+        """
+        Add a processed restaurant to the result, and save progress in the temp file. Stops the
+        pipeline once the sample size is reached, if the sample size CLI arg is supplied
+        """
+        with self._state_lock:
+            if self._sample_size and self._result.catalog_size >= self._sample_size:
+                self._pipeline.stop()
+                return
+
+            with Metrics.stage('persist'):
+                self._result.add(restaurant)
+                self._temp_file.add_data(restaurant)
+
+            Metrics.increment('rows_processed')
+            self._progress.update()
+
+            if self._sample_size and self._result.catalog_size >= self._sample_size:
+                self._pipeline.stop()
+
+    def _row_skipped(self, restaurant: Restaurant) -> None:
+        """
+        Count a row that was dropped by a stage, for progress reporting
+        """
+        Metrics.increment('rows_skipped')
+        with self._state_lock:
+            self._dropped.add(restaurant.name_seq_nr)
+            if not self._sample_size:
+                self._progress.update()
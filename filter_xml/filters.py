@@ -1,8 +1,9 @@
 import json
 import os
+import threading
 
 from datetime import datetime
-from typing import List, Callable, Dict
+from typing import List, Callable, Dict, Tuple
 from filter_xml.blacklist import Blacklist
 from filter_xml.catalog import Restaurant
 from filter_xml.config import FilterXMLConfig
@@ -29,6 +30,10 @@ class FilterLog:
     """
     LOG_FILE = 'filter_log.json'
 
+    # the log file is read and rewritten on every access, which has to be serialized when
+    # filters run in several threads
+    _lock = threading.RLock()
+
     def __init__(self):
         if not os.path.isfile(self.LOG_FILE):
             self._create_file()
@@ -39,12 +44,13 @@ class FilterLog:
         >>> log = FilterLog()
         >>> log[key]
         """
-        if key not in self:
-            raise KeyError(f'key {key} does not exist in log file')
+        with self._lock:
+            if key not in self:
+                raise KeyError(f'key {key} does not exist in log file')
 
-        with open(self.LOG_FILE, 'r') as f:
-            data = json.loads(f.read())
-            return data['log'][key]
+            with open(self.LOG_FILE, 'r') as f:
+                data = json.loads(f.read())
+                return data['log'][key]
 
     def __setitem__(self, key: str, value: int):
         """
@@ -52,13 +58,14 @@ class FilterLog:
         >>> log = FilterLog()
         >>> log['hi'] = 1
         """
-        with open(self.LOG_FILE, 'r') as f:
-            data = json.loads(f.read())
+        with self._lock:
+            with open(self.LOG_FILE, 'r') as f:
+                data = json.loads(f.read())
 
-        data['log'][key] = value
+            data['log'][key] = value
 
-        with open(self.LOG_FILE, 'w') as f:
-            f.write(json.dumps(data, indent=4))
+            with open(self.LOG_FILE, 'w') as f:
+                f.write(json.dumps(data, indent=4))
 
     def __contains__(self, key: str):
         """
@@ -70,9 +77,10 @@ class FilterLog:
         >>> 'yeet' in log
         False
         """
-        with open(self.LOG_FILE, 'r') as f:
-            data = json.loads(f.read())
-            return key in data['log'].keys()
+        with self._lock:
+            with open(self.LOG_FILE, 'r') as f:
+                data = json.loads(f.read())
+                return key in data['log'].keys()
 
     def _create_file(self):
         """
@@ -92,11 +100,34 @@ class Filters:
     LOG = {}  # type: Dict[str, int]
     LOGGER = FilterLog()
 
+    # (filter class, prefix) -> filters, such that filters are only looked up once per class
+    _DECLARED = {}  # type: Dict[Tuple[type, str], List[Callable]]
+
+    @classmethod
+    def _declared(cls, prefix: str) -> List[Callable]:
+        """
+        Every filter of this class prefixed by :param prefix, in alphabetical order
+        """
+        key = (cls, prefix)
+        if key not in Filters._DECLARED:
+            Filters._DECLARED[key] = [getattr(cls, fun)
+                                      for fun in dir(cls)
+                                      if callable(getattr(cls, fun))
+                                      and fun.startswith(prefix)]
+        return Filters._DECLARED[key]
+
     def _filters(self) -> List[Callable]:
-        return [getattr(self.__class__, fun)
-                for fun in dir(self.__class__)
-                if callable(getattr(self.__class__, fun))
-                and fun.startswith('filter_')]
+        return self._declared('filter_')
+
+    def _row_filters(self) -> List[Callable]:
+        return self._declared('row_filter_')
+
+    def _restaurant_only_filters(self) -> List[Callable]:
+        """
+        Filters without a row filter counterpart, cf. accepts_row()
+        """
+        covered = {f.__name__[len('row_'):] for f in self._row_filters()}
+        return [f for f in self._filters() if f.__name__ not in covered]
 
     def print_log(self) -> None:
         print('Filtered rows:')
@@ -108,19 +139,42 @@ class Filters:
         for key, value in cls.LOG.items():
             cls.LOGGER[key] = value
 
-    def filter(self, restaurant: Restaurant):
-        for f in self._filters():
+    def filter(self, restaurant: Restaurant, row_filtered: bool = False):
+        """
+        Run every filter on :param restaurant. With :param row_filtered, the row it was
+        constructed from already passed accepts_row(), so only filters without a row counterpart
+        are run
+        """
+        filters = self._restaurant_only_filters() if row_filtered else self._filters()
+        for f in filters:
             if not f(restaurant):
                 return False
         return True
 
+    def accepts_row(self, row: dict) -> bool:
+        """
+        Run every row filter on the raw fields of a <row> of the smiley XML, i.e. tag -> text,
+        before it is constructed into a Restaurant
+        """
+        for f in self._row_filters():
+            if not f(row):
+                return False
+        return True
+
 
 class PreFilters(Filters):
     """
     Define filters that should be run BEFORE processing here.
 
-    Filters should be prefixed by 'filter_' and should have param 'data' of type dict, i.e., a row
-    of data. All filters should be static.
+    Filters should be prefixed by 'filter_' and should have param 'data' of type Restaurant. All
+    filters should be static.
+
+    A filter may also be declared against the raw fields of a <row> of the smiley XML by prefixing
+    its name with 'row_filter_' instead, e.g. row_filter_city for filter_city. Row filters are run
+    by SmileyExtractor before a Restaurant is constructed, such that rejected rows are never
+    converted, and the restaurant counterpart is then skipped. Both versions must reject the same
+    rows and count them in LOG the same way, as the restaurant version is still used on rows
+    loaded from the smiley JSON cache.
 
     A log of filtered rows is maintained in a file during run. For pre-filters we are able to
     avoid a read/write on each check, and as such only self.LOG[key] should be incremented, and
@@ -174,6 +228,38 @@ class PreFilters(Filters):
                 return False
         return True
 
+    @classmethod
+    def row_filter_null_control(cls, row: dict) -> bool:
+        res = any(row[smiley] for smiley, _ in Restaurant.REPORT_KEYS)
+        if not res:
+            cls.LOG['null_control'] += 1
+        return res
+
+    @classmethod
+    def row_filter_null_coordinates(cls, row: dict) -> bool:
+        res = bool(row['Geo_Lat'] and row['Geo_Lng'])
+        if not res:
+            cls.LOG['null_coordinates'] += 1
+        return res
+
+    @classmethod
+    def row_filter_blacklisted(cls, row: dict) -> bool:
+        res = not Blacklist.contains(row['navnelbnr'])
+        if not res:
+            cls.LOG['blacklisted'] += 1
+        return res
+
+    @classmethod
+    def row_filter_city(cls, row: dict) -> bool:
+        if not row['By']:
+            cls.LOG['null_city'] += 1
+            row['By'] = cls.ZIP_CODES[row['postnr']]
+
+            if not row['By']:
+                cls.LOG['invalid_zip'] += 1
+                return False
+        return True
+
 
 class PostFilters(Filters):
     """
@@ -191,6 +277,8 @@ class PostFilters(Filters):
         'industry_code': 0,
         'end_date': 0
     }
+    # also pushed into the bulk export of filter_xml.cvr.CVRHandlerElastic
+    INCLUDE_CODES = ['561010', '561020', '563000']
 
     def __init__(self):
         self.LOGGER['industry_code'] = 0
@@ -201,8 +289,7 @@ class PostFilters(Filters):
         """
         Checks if row 'data' has a valid industry code.
         """
-        include_codes = ['561010', '561020', '563000']
-        res = data.industry_code in include_codes
+        res = data.industry_code in cls.INCLUDE_CODES
         if not res:
             cls.LOGGER['industry_code'] += 1
         return res
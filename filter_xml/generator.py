@@ -0,0 +1,182 @@
+import random
+
+from argparse import ArgumentParser
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, TextIO
+from xml.sax.saxutils import escape
+
+
+class SmileyXMLGenerator:
+    """
+    Generates synthetic smiley XML in the format served by Fødevarestyrelsen, cf.
+        https://github.com/sw814f21/filter_xml#fresh-xml-download
+
+    Output is deterministic for a given seed. The share of rows exercising each pre-filter is
+    controlled by the null_* and invalid_* ratios.
+        >>> SmileyXMLGenerator(100000, seed=1, null_control=0.1).write('smiley_100k.xml')
+    """
+    INDUSTRIES = [
+        # (weight, brancheKode, branche, Pixibranche)
+        (30, 'DD.56.10.99', 'Serveringsvirksomhed - Restauranter m.v.',
+         'Restauranter, pizzeriaer, kantiner m.m.'),
+        (15, 'DD.56.10.00', 'Serveringsvirksomhed - Pizzeria, grillbar, isbar m.v.',
+         'Restauranter, pizzeriaer, kantiner m.m.'),
+        (10, 'DD.56.30.00', 'Serveringsvirksomhed - Cafeer, værtshuse m.v.',
+         'Caféer, værtshuse, diskoteker m.m.'),
+        (15, 'DD.47.11.00', 'Detail - Supermarked', 'Supermarkeder og andre dagligvarebutikker'),
+        (10, 'DD.10.71.20', 'Specialforretning - Bager m.v.', 'Bagere og bagerafdelinger'),
+        (5, 'DD.47.22.00', 'Specialforretning - Slagter m.v.', 'Slagtere og slagterafdelinger'),
+        (5, 'DD.56.29.00', 'Serveringsvirksomhed - Kantiner',
+         'Restauranter, pizzeriaer, kantiner m.m.'),
+        (5, 'DD.47.25.00', 'Specialforretning - Vin og spiritus', 'Vin- og spiritusforhandlere'),
+        (5, 'DD.10.00.00', 'Engros - Fødevarer', 'Engros og produktion'),
+    ]
+
+    CITIES = [
+        ('1000', 'København K', 55.6786, 12.5635), ('2100', 'København Ø', 55.7107, 12.5797),
+        ('2200', 'København N', 55.6971, 12.5465), ('2300', 'København S', 55.6578, 12.6048),
+        ('3000', 'Helsingør', 56.0360, 12.6136), ('3700', 'Rønne', 55.1009, 14.7066),
+        ('4000', 'Roskilde', 55.6415, 12.0803), ('4700', 'Næstved', 55.2299, 11.7609),
+        ('5000', 'Odense C', 55.3959, 10.3883), ('5260', 'Odense S', 55.3669, 10.3919),
+        ('6000', 'Kolding', 55.4904, 9.4722), ('6700', 'Esbjerg', 55.4765, 8.4594),
+        ('7100', 'Vejle', 55.7093, 9.5357), ('7400', 'Herning', 56.1393, 8.9738),
+        ('8000', 'Aarhus C', 56.1567, 10.2108), ('8200', 'Aarhus N', 56.1818, 10.1857),
+        ('8900', 'Randers C', 56.4607, 10.0364), ('9000', 'Aalborg', 57.0488, 9.9217),
+        ('9800', 'Hjørring', 57.4642, 9.9823), ('9900', 'Frederikshavn', 57.4407, 10.5366),
+    ]
+
+    CHAINS = ['Sunset Boulevard', 'Jensens Bøfhus', 'Lagkagehuset', 'Netto', 'Føtex', 'Baresso',
+              'Joe & The Juice', 'Sticks\'n\'Sushi']
+
+    NAMES = ['Pizza', 'Café', 'Restaurant', 'Grill', 'Bageri', 'Kro', 'Bistro', 'Sushi', 'Kebab',
+             'Slagter', 'Vinbar', 'Kantine', 'Ismejeri', 'Smørrebrød']
+    STREETS = ['Vestergade', 'Østergade', 'Nørregade', 'Søndergade', 'Algade', 'Torvet',
+               'Jernbanegade', 'Strandvejen', 'Kongensgade', 'Åboulevarden']
+
+    REPORT_KEYS = ['seneste_kontrol', 'naestseneste_kontrol', 'tredjeseneste_kontrol',
+                   'fjerdeseneste_kontrol']
+
+    def __init__(self, rows: int, seed: int = 0, null_control: float = 0.05,
+                 null_coordinates: float = 0.03, null_city: float = 0.02,
+                 invalid_zip: float = 0.005, null_pnr: float = 0.05):
+        self.rows = rows
+        self.seed = seed
+        self.null_control = null_control
+        self.null_coordinates = null_coordinates
+        self.null_city = null_city
+        self.invalid_zip = invalid_zip
+        self.null_pnr = null_pnr
+
+        self._industry_weights = [x[0] for x in self.INDUSTRIES]
+
+    @classmethod
+    def zip_map(cls) -> Dict[str, str]:
+        """
+        Mapping from every generated zip code to its city, in the format of
+        filter_xml.cvr.ZipcodeFinder
+        """
+        return {zip_code: city for zip_code, city, _, _ in cls.CITIES}
+
+    def write(self, path: str) -> None:
+        """
+        Write the generated XML to :param path, one row at a time
+        """
+        with open(path, 'w', encoding='utf-8') as f:
+            self.write_to(f)
+
+    def write_to(self, f: TextIO) -> None:
+        rnd = random.Random(self.seed)
+
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<document>\n')
+        for i in range(self.rows):
+            f.write(self._row(rnd, i))
+        f.write('</document>\n')
+
+    def _row(self, rnd: random.Random, i: int) -> str:
+        """
+        Generate a single <row> element
+        """
+        _, code, industry, niche = rnd.choices(self.INDUSTRIES, self._industry_weights)[0]
+        zip_code, city, lat, lng = rnd.choice(self.CITIES)
+        chain = rnd.choice(self.CHAINS) if rnd.random() < 0.1 else None
+
+        if rnd.random() < self.invalid_zip:
+            zip_code, city = '0000', None
+        elif rnd.random() < self.null_city:
+            city = None
+
+        has_coordinates = rnd.random() >= self.null_coordinates
+        controls = 0 if rnd.random() < self.null_control else rnd.randint(1, 4)
+
+        fields = [
+            ('navnelbnr', str(100000 + i)),
+            ('cvrnr', str(rnd.randint(10000000, 99999999))),
+            ('pnr', None if rnd.random() < self.null_pnr else str(rnd.randint(1000000000,
+                                                                                1999999999))),
+            ('region', None),
+            ('brancheKode', code),
+            ('branche', industry),
+            ('virksomhedstype', 'Detail' if code.startswith('DD.4') or code.startswith('DD.5')
+             else 'Engros'),
+            ('navn1', f'{chain or rnd.choice(self.NAMES)} {rnd.choice(self.STREETS)}'),
+            ('adresse1', f'{rnd.choice(self.STREETS)} {rnd.randint(1, 200)}'),
+            ('postnr', zip_code),
+            ('By', city),
+        ]
+
+        date = datetime(2021, 3, 1)
+        for n, key in enumerate(self.REPORT_KEYS):
+            if n < controls:
+                date -= timedelta(days=rnd.randint(30, 400))
+                fields.append((key, str(rnd.choices([1, 2, 3, 4], [80, 14, 4, 2])[0])))
+                fields.append((f'{key}_dato', date.strftime('%d-%m-%Y 00:00:00')))
+            else:
+                fields.append((key, None))
+                fields.append((f'{key}_dato', None))
+
+        fields += [
+            ('URL', f'http://www.findsmiley.dk/da-DK/Searching/DetailsView.htm?virk={100000 + i}'),
+            ('reklame_beskyttelse', str(int(rnd.random() < 0.05))),
+            ('Elite_Smiley', str(int(rnd.random() < 0.3))),
+            ('Kaedenavn', chain),
+            ('Geo_Lng', f'{lng + rnd.uniform(-0.05, 0.05):.7f}' if has_coordinates else None),
+            ('Geo_Lat', f'{lat + rnd.uniform(-0.05, 0.05):.7f}' if has_coordinates else None),
+            ('Pixibranche', niche),
+        ]
+
+        return '   <row>\n' + ''.join(self._field(tag, value) for tag, value in fields) + \
+               '   </row>\n'
+
+    @staticmethod
+    def _field(tag: str, value: Optional[str]) -> str:
+        if value is None:
+            return f'      <{tag} />\n'
+        return f'      <{tag}>{escape(value)}</{tag}>\n'
+
+
+arg_parser = ArgumentParser(description='Generate synthetic smiley XML')
+arg_parser.add_argument('--rows', '-r', type=int, default=10000, help='amount of rows')
+arg_parser.add_argument('--output', '-o', type=str, default='smiley_synthetic.xml',
+                        help='output file path')
+arg_parser.add_argument('--seed', type=int, default=0, help='random seed')
+arg_parser.add_argument('--null-control', type=float, default=0.05,
+                        help='share of rows without any controls')
+arg_parser.add_argument('--null-coordinates', type=float, default=0.03,
+                        help='share of rows without coordinates')
+arg_parser.add_argument('--null-city', type=float, default=0.02,
+                        help='share of rows without a city')
+arg_parser.add_argument('--invalid-zip', type=float, default=0.005,
+                        help='share of rows with an unknown zip code and no city')
+arg_parser.add_argument('--null-pnr', type=float, default=0.05,
+                        help='share of rows without a p-number')
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = arg_parser.parse_args(argv)
+    SmileyXMLGenerator(args.rows, args.seed, args.null_control, args.null_coordinates,
+                       args.null_city, args.invalid_zip, args.null_pnr).write(args.output)
+    print(f'Wrote {args.rows} rows to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
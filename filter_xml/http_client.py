@@ -0,0 +1,281 @@
+from __future__ import annotations
+
+import atexit
+import base64
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+
+from typing import Optional, Dict
+from requests import Session
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, RequestException
+
+from filter_xml.config import FilterXMLConfig
+from filter_xml.metrics import Metrics
+
+
+class CassetteResponse:
+    """
+    A recorded HTTP response. Mimics the parts of requests.Response that we use, i.e.
+    status_code, headers, content, text and json()
+    """
+
+    def __init__(self, status_code: int, content: bytes, headers: Optional[dict] = None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8')
+
+    def json(self):
+        return json.loads(self.content.decode('utf-8'))
+
+    @classmethod
+    def from_response(cls, response) -> CassetteResponse:
+        """
+        Constructs a CassetteResponse from a requests.Response
+        """
+        headers = {k: v for k, v in response.headers.items()
+                   if k.lower() in Cassette.KEPT_HEADERS}
+        return cls(response.status_code, response.content, headers)
+
+    def as_dict(self) -> dict:
+        """
+        Formats object as a dict. Bodies are stored as text when possible, and as base64
+        otherwise
+        """
+        try:
+            body, encoding = self.content.decode('utf-8'), 'text'
+        except UnicodeDecodeError:
+            body, encoding = base64.b64encode(self.content).decode('ascii'), 'base64'
+
+        return {
+            'status': self.status_code,
+            'headers': self.headers,
+            'encoding': encoding,
+            'body': body
+        }
+
+    @classmethod
+    def from_dict(cls, row: dict) -> CassetteResponse:
+        """
+        Constructs a CassetteResponse from a dict as defined by as_dict()
+        """
+        if row['encoding'] == 'base64':
+            content = base64.b64decode(row['body'])
+        else:
+            content = row['body'].encode('utf-8')
+        return cls(row['status'], content, row['headers'])
+
+
+class Cassette:
+    """
+    Compact store of recorded HTTP responses.
+
+    The store is a single gzipped JSON file mapping request keys to responses. A request key is a
+    hash of the method, URL, query parameters and body of the request, meaning that credentials
+    and headers are never written to the cassette.
+    """
+    KEPT_HEADERS = {'content-type', 'etag', 'last-modified', 'x-data-version'}
+
+    def __init__(self, path: str):
+        self.path = path
+        self._responses = dict()  # type: Dict[str, dict]
+        self._dirty = False
+
+        if os.path.isfile(path):
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                self._responses = json.load(f)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._responses
+
+    def __len__(self) -> int:
+        return len(self._responses)
+
+    @staticmethod
+    def key(method: str, url: str, params: Optional[dict] = None, body=None) -> str:
+        """
+        Construct the lookup key for a single request
+        """
+        raw = json.dumps([method.upper(), url, params or {}, body], sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Optional[CassetteResponse]:
+        """
+        Retrieve a recorded response, or None if the request has not been recorded
+        """
+        row = self._responses.get(key)
+        return CassetteResponse.from_dict(row) if row else None
+
+    def put(self, key: str, response: CassetteResponse) -> None:
+        """
+        Record a single response. The cassette is not written to disk until save() is called
+        """
+        self._responses[key] = response.as_dict()
+        self._dirty = True
+
+    def merge(self, path: str) -> None:
+        """
+        Add every response recorded in the cassette at :param path to this cassette
+        """
+        other = Cassette(path)
+        if other._responses:
+            self._responses.update(other._responses)
+            self._dirty = True
+
+    def save(self) -> None:
+        """
+        Write the cassette to disk, if anything has been recorded since the last save
+        """
+        if not self._dirty:
+            return
+
+        with gzip.open(self.path, 'wt', encoding='utf-8') as f:
+            json.dump(self._responses, f, separators=(',', ':'))
+        self._dirty = False
+
+
+class HTTPClient:
+    """
+    HTTP client used for every external integration.
+
+    Wraps a pooled requests.Session and operates in one of three modes, as specified by 'mode'
+    in the [http] section of the config file:
+        live    send every request to the network
+        record  send every request to the network and store the responses in a cassette
+        replay  serve every request from the cassette, with injected latency. Requests that have
+                not been recorded raise ConnectionError, as if the network was unavailable
+    """
+    MODES = ['live', 'record', 'replay']
+
+    def __init__(self, mode: Optional[str] = None, cassette: Optional[str] = None,
+                 latency: Optional[float] = None, jitter: Optional[float] = None):
+        self.mode = mode if mode is not None else FilterXMLConfig.http_mode()
+        if self.mode not in self.MODES:
+            raise KeyError(f'http mode \"{self.mode}\" is invalid, please choose one of '
+                           f'[ live | record | replay ]')
+
+        self.latency = latency if latency is not None else FilterXMLConfig.http_latency()
+        self.jitter = jitter if jitter is not None else FilterXMLConfig.http_jitter()
+        # seeded, so replayed runs are deterministic
+        self._random = random.Random(0)
+
+        self.session = Session()
+        # size the pool for parallel uploads, such that connections are reused between threads
+        pool_size = FilterXMLConfig.http_pool_size()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cassette = None  # type: Optional[Cassette]
+
+        if self.mode != 'live':
+            self.cassette = Cassette(cassette or FilterXMLConfig.http_cassette())
+
+        if self.mode == 'record':
+            atexit.register(self.cassette.save)
+
+    def request(self, method: str, url: str, **kwargs):
+        """
+        Send a single request, or serve it from the cassette in replay mode. The latency of every
+        request is recorded in Metrics, grouped by host
+        """
+        start = time.perf_counter()
+        try:
+            return self._request(method, url, **kwargs)
+        except RequestException:
+            Metrics.increment('errors.http')
+            raise
+        finally:
+            Metrics.observe_http(url, time.perf_counter() - start)
+
+    def _request(self, method: str, url: str, **kwargs):
+        if self.mode == 'live':
+            return self.session.request(method, url, **kwargs)
+
+        key = Cassette.key(method, url, kwargs.get('params'),
+                           kwargs.get('json', kwargs.get('data')))
+
+        if self.mode == 'replay':
+            response = self.cassette.get(key)
+            Metrics.cache('cassette', response is not None)
+            if response is None:
+                raise ConnectionError(f'no recorded response for {method} {url}')
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+            return response
+
+        response = self.session.request(method, url, **kwargs)
+        self.cassette.put(key, CassetteResponse.from_response(response))
+        return response
+
+    def get(self, url: str, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url: str, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url: str, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def close(self) -> None:
+        """
+        Close the session and save any recorded responses
+        """
+        if self.cassette:
+            self.cassette.save()
+        self.session.close()
+
+
+_client = None  # type: Optional[HTTPClient]
+
+
+def get_client() -> HTTPClient:
+    """
+    Retrieve the shared HTTP client, configured as specified by [http] in config file
+    """
+    global _client
+    if _client is None:
+        _client = HTTPClient()
+    return _client
+
+
+def fork_client(suffix: str) -> HTTPClient:
+    """
+    Replace the shared client in a forked process, such that connections are not shared with the
+    parent. In record mode the process records into its own cassette, named by appending
+    :param suffix to the cassette path, which the parent should merge once the process is done.
+    """
+    global _client
+    cassette = FilterXMLConfig.http_cassette()
+    mode = FilterXMLConfig.http_mode()
+    _client = HTTPClient(mode=mode, cassette=f'{cassette}{suffix}' if mode == 'record' else None)
+    return _client
+
+
+def request(method: str, url: str, **kwargs):
+    return get_client().request(method, url, **kwargs)
+
+
+def get(url: str, **kwargs):
+    return get_client().get(url, **kwargs)
+
+
+def post(url: str, **kwargs):
+    return get_client().post(url, **kwargs)
+
+
+def put(url: str, **kwargs):
+    return get_client().put(url, **kwargs)
+
+
+def delete(url: str, **kwargs):
+    return get_client().delete(url, **kwargs)
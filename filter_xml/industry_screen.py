@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import json
+
+from typing import Dict, Iterable, List, Optional
+
+from filter_xml.catalog import Restaurant
+from filter_xml.config import FilterXMLConfig
+from filter_xml.cvr import CVRHandlerBase
+from filter_xml.filters import PostFilters
+from filter_xml.util import RateLimiter
+
+
+class IndustryScreen:
+    """
+    Maps the industry of a smiley XML row, i.e. its Fødevarestyrelsen brancheKode and
+    Pixibranche, to the NACE codes CVR may hold for the production unit. Rows whose candidates
+    can never pass PostFilters.filter_industry_codes are screened out by DataProcessor before
+    their CVR lookup, cf. [industry_screen] in the config file.
+
+    A row is looked up by its brancheKode first, then by its Pixibranche. Rows found in neither
+    mapping are kept, so the screen only ever trades lookups for certainty it already has. The
+    defaults below are extended or overridden by the JSON file in [industry_screen] mapping:
+        {"brancheKode": {"DD.47.29.00": ["472900"]}, "Pixibranche": {...}}
+
+    The precision and recall of the mapping are measured against CVR with measure(), e.g. from
+    a recorded cassette.
+    """
+    BRANCHE_CODES = {
+        'DD.56.10.99': ['561010', '561020', '563000'],
+        'DD.56.10.00': ['561020', '561010'],
+        'DD.56.30.00': ['563000', '561010'],
+        'DD.56.21.00': ['562100', '561010'],
+        'DD.56.29.00': ['562900', '561010'],
+        'DD.47.11.00': ['471100', '471110', '471120', '471130'],
+        'DD.10.71.20': ['107110', '107120', '472400'],
+        'DD.47.21.00': ['472100'],
+        'DD.47.22.00': ['472200'],
+        'DD.47.23.00': ['472300'],
+        'DD.47.25.00': ['472500'],
+        'DD.10.00.00': ['463000', '463900', '101000', '108900']
+    }  # type: Dict[str, List[str]]
+
+    PIXIBRANCHER = {
+        'Restauranter, pizzeriaer, kantiner m.m.': ['561010', '561020', '562900'],
+        'Caféer, værtshuse, diskoteker m.m.': ['563000', '561010'],
+        'Supermarkeder og andre dagligvarebutikker': ['471100', '471110', '471120', '471130'],
+        'Bagere og bagerafdelinger': ['107110', '107120', '472400'],
+        'Slagtere og slagterafdelinger': ['472200'],
+        'Vin- og spiritusforhandlere': ['472500']
+    }  # type: Dict[str, List[str]]
+
+    def __init__(self, branche_codes: Optional[Dict[str, List[str]]] = None,
+                 pixibrancher: Optional[Dict[str, List[str]]] = None):
+        self.branche_codes = dict(self.BRANCHE_CODES)
+        self.branche_codes.update(branche_codes or {})
+        self.pixibrancher = dict(self.PIXIBRANCHER)
+        self.pixibrancher.update(pixibrancher or {})
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> IndustryScreen:
+        """
+        The default mapping, extended by the JSON file at :param path, defaulting to
+        [industry_screen] mapping
+        """
+        path = path if path is not None else FilterXMLConfig.industry_screen_mapping()
+        if not path:
+            return IndustryScreen()
+
+        with open(path, 'r') as f:
+            mapping = json.loads(f.read())
+        return IndustryScreen(mapping.get('brancheKode'), mapping.get('Pixibranche'))
+
+    def candidates(self, res: Restaurant) -> Optional[List[str]]:
+        """
+        NACE codes CVR may hold for :param res, as read from the smiley XML, or None if its
+        industry is not mapped
+        """
+        found = self.branche_codes.get(res.industry_code)
+        if found is None:
+            found = self.pixibrancher.get(res.niche_industry)
+        return found
+
+    def can_match(self, res: Restaurant) -> bool:
+        """
+        Whether :param res may pass PostFilters.filter_industry_codes once looked up in CVR
+        """
+        found = self.candidates(res)
+        return found is None or any(code in PostFilters.INCLUDE_CODES for code in found)
+
+    def measure(self, restaurants: Iterable[Restaurant], handler: CVRHandlerBase) -> dict:
+        """
+        Look up :param restaurants through :param handler, and compare the screen to the industry
+        codes found in CVR. A restaurant is relevant if its CVR industry code passes
+        PostFilters.filter_industry_codes:
+            precision   share of the restaurants kept by the screen that are relevant
+            recall      share of the relevant restaurants kept by the screen, i.e. 1.0 unless
+                        the screen loses restaurants
+            screened    share of the lookups saved by the screen
+        Returns counts by brancheKode as well. Lookups respect the crawl delay of :param handler
+        """
+        restaurants = list(restaurants)
+        rate_limiter = RateLimiter(handler.CRAWL_DELAY if handler.SHOULD_SLEEP else 0)
+        kept = {res.name_seq_nr: self.can_match(res) for res in restaurants}
+        branche = {res.name_seq_nr: res.industry_code for res in restaurants}
+
+        if handler.PRE_PROCESSING_STEP:
+            handler.pre_processing(restaurants)
+        counts = {'true_positive': 0, 'false_positive': 0, 'false_negative': 0,
+                  'true_negative': 0}
+        by_code = dict()  # type: Dict[str, Dict[str, int]]
+        for res in restaurants:
+            seq_nr = res.name_seq_nr
+            rate_limiter.wait()
+            relevant = handler.collect_data(res).industry_code in PostFilters.INCLUDE_CODES
+            outcome = ('true_' if kept[seq_nr] == relevant else 'false_') + \
+                      ('positive' if kept[seq_nr] else 'negative')
+            counts[outcome] += 1
+
+            code = by_code.setdefault(branche[seq_nr] or '', {'rows': 0, 'kept': 0,
+                                                              'relevant': 0})
+            code['rows'] += 1
+            code['kept'] += kept[seq_nr]
+            code['relevant'] += relevant
+
+        positives = counts['true_positive'] + counts['false_positive']
+        relevant = counts['true_positive'] + counts['false_negative']
+        return dict(counts,
+                    precision=counts['true_positive'] / positives if positives else 1.0,
+                    recall=counts['true_positive'] / relevant if relevant else 1.0,
+                    screened=1 - positives / len(restaurants) if restaurants else 0.0,
+                    by_code=dict(sorted(by_code.items())))
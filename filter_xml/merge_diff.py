@@ -0,0 +1,217 @@
+from __future__ import annotations
+
+import heapq
+import json
+import os
+import shutil
+import tempfile
+
+from operator import itemgetter
+from typing import Container, Iterable, Iterator, List, Optional, Set, Union
+
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+from filter_xml.mirror import Mirror
+
+
+class SpillStream:
+    """
+    Rows spilled to a JSON lines file, which can be iterated any number of times
+    """
+
+    def __init__(self, path: str, count: int):
+        self.path = path
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> Iterator:
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+
+class MergeDiff:
+    """
+    Diff of a catalog against the previous state, computed with bounded memory, cf. [diff]
+    external in config file, rather than with RestaurantCatalog.setup_diff().
+
+    Both sides are reduced to [name_seq_nr, fingerprint, ...] records, sorted in runs of
+    [diff] run_size records, and spilled to files. A single merge join over the sorted runs then
+    yields the insert stream, while the update and delete streams are spilled as they are found.
+    The streams are passed to the outputters directly, and rows are only constructed as they are
+    consumed:
+        >>> with MergeDiff(catalog, delta=False) as diff:
+        ...     diff.spill(current)
+        ...     outputter.insert(diff.inserts(), token)
+        ...     outputter.update(diff.updates(), token)
+        ...     outputter.delete(diff.deletes(), token)
+
+    As when diffing against the mirror, restaurants are compared by fingerprint, so an appended
+    smiley report is an update as well. A name_seq_nr occurring more than once on a side is
+    diffed by its last occurrence, as with the dicts of setup_diff().
+    """
+
+    def __init__(self, catalog: RestaurantCatalog, retained: Container[str] = (),
+                 delta: bool = False, known: Optional[Container[str]] = None,
+                 run_size: Optional[int] = None, directory: Optional[str] = None):
+        """
+        :param retained: restaurants of the previous state that are neither updated nor deleted
+        :param delta: whether updates are patches, cf. Restaurant.patch()
+        :param known: ids to check the previous state against, cf. self.unknown_old
+        """
+        self.catalog = catalog
+        self.delta = delta
+        self.run_size = run_size if run_size is not None else FilterXMLConfig.diff_run_size()
+        directory = directory if directory is not None \
+            else FilterXMLConfig.diff_spill_directory()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='merge_diff_', dir=directory or None)
+
+        self._retained_candidates = retained
+        self._known = known
+        self._runs = {'old': [], 'new': []}  # type: dict
+        self._merge = None  # type: Optional[Iterator[dict]]
+
+        self.counts = {'insert': 0, 'update': 0, 'delete': 0}
+        # name_seq_nr of every inserted and updated restaurant, e.g. for Aggregates.apply()
+        self.changed = []  # type: List[str]
+        # restaurants of the previous state that were retained, cf. RestaurantCatalog.retained
+        self.retained = set()  # type: Set[str]
+        # amount of restaurants in the previous state, and how many of them are not in known
+        self.old_count = 0
+        self.unknown_old = 0
+
+    def __enter__(self) -> MergeDiff:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Remove every spill file
+        """
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def spill(self, old: Union[Mirror, RestaurantCatalog, None]) -> None:
+        """
+        Sort and spill the previous state :param old, either a full catalog or the mirror of the
+        last push, along with the catalog diffed against it
+        """
+        if isinstance(old, Mirror):
+            signatures = old.signatures if self.delta else dict()
+            records = ([seq_nr, fingerprint, signatures.get(seq_nr)]
+                       for seq_nr, fingerprint in old.fingerprints.items())
+        else:
+            records = ([res.name_seq_nr, res.fingerprint(),
+                        res.signature() if self.delta else None]
+                       for res in (old.catalog if old else []))
+        self._spill('old', records)
+        self._spill('new', ([res.name_seq_nr, res.fingerprint(), i]
+                            for i, res in enumerate(self.catalog.catalog)))
+
+    def _spill(self, side: str, records: Iterable[list]) -> None:
+        run = []
+        for record in records:
+            run.append(record)
+            if len(run) >= self.run_size:
+                self._write_run(side, run)
+                run = []
+        if run or not self._runs[side]:
+            self._write_run(side, run)
+
+    def _write_run(self, side: str, run: List[list]) -> None:
+        """
+        Sort :param run by name_seq_nr, keeping the order of equal keys, and write it to a file
+        """
+        run.sort(key=itemgetter(0))
+        path = os.path.join(self.directory, f'{side}_{len(self._runs[side])}.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for record in run:
+                f.write(json.dumps(record) + '\n')
+        self._runs[side].append(path)
+
+    def _sorted(self, side: str) -> Iterator[list]:
+        """
+        Merge the runs of :param side into a single stream sorted by name_seq_nr, keeping only
+        the last record of every name_seq_nr
+        """
+        runs = [SpillStream(path, 0) for path in self._runs[side]]
+        last = None
+        for record in heapq.merge(*runs, key=itemgetter(0)):
+            if last is not None and record[0] != last[0]:
+                yield last
+            last = record
+        if last is not None:
+            yield last
+
+    def inserts(self) -> Iterator[dict]:
+        """
+        Stream the insert set, running the merge join as it is consumed
+        """
+        if self._merge is None:
+            self._merge = self._merge_join()
+        return self._merge
+
+    def updates(self) -> SpillStream:
+        """
+        The update set, as restaurants or with :param delta as patches
+        """
+        self._complete()
+        return SpillStream(self._path('update'), self.counts['update'])
+
+    def deletes(self) -> SpillStream:
+        """
+        The delete set, as name_seq_nr
+        """
+        self._complete()
+        return SpillStream(self._path('delete'), self.counts['delete'])
+
+    def _complete(self) -> None:
+        """
+        Finish the merge join, if the insert stream has not been consumed
+        """
+        for _ in self.inserts():
+            pass
+
+    def _path(self, kind: str) -> str:
+        return os.path.join(self.directory, f'{kind}.jsonl')
+
+    def _restaurant(self, record: list) -> Restaurant:
+        return self.catalog.catalog[record[2]]
+
+    def _merge_join(self) -> Iterator[dict]:
+        old, new = self._sorted('old'), self._sorted('new')
+        o, n = next(old, None), next(new, None)
+        with open(self._path('update'), 'w', encoding='utf-8') as updates, \
+                open(self._path('delete'), 'w', encoding='utf-8') as deletes:
+            while o is not None or n is not None:
+                if o is None or (n is not None and n[0] < o[0]):
+                    self.counts['insert'] += 1
+                    self.changed.append(n[0])
+                    yield self._restaurant(n).as_dict()
+                    n = next(new, None)
+                    continue
+
+                self.old_count += 1
+                if self._known is not None and o[0] not in self._known:
+                    self.unknown_old += 1
+
+                if n is None or o[0] < n[0]:
+                    if o[0] in self._retained_candidates:
+                        self.retained.add(o[0])
+                    else:
+                        self.counts['delete'] += 1
+                        deletes.write(json.dumps(o[0]) + '\n')
+                else:
+                    if n[1] != o[1]:
+                        res = self._restaurant(n)
+                        self.counts['update'] += 1
+                        self.changed.append(n[0])
+                        updates.write(json.dumps(res.patch(o[2]) if self.delta
+                                                 else res.as_dict()) + '\n')
+                    n = next(new, None)
+                o = next(old, None)
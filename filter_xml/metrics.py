@@ -0,0 +1,285 @@
+import json
+import os
+import threading
+import time
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from filter_xml.config import FilterXMLConfig
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets, given in seconds. Buckets are shared by every histogram
+    such that histograms from separate processes can be merged
+    """
+    BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None  # type: Optional[float]
+        self.max = None  # type: Optional[float]
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: dict) -> None:
+        """
+        Add the observations of a histogram formatted by as_dict() to this one
+        """
+        for i, count in enumerate(other['counts']):
+            self.counts[i] += count
+        self.count += other['count']
+        self.sum += other['sum']
+        for key, pick in [('min', min), ('max', max)]:
+            if other[key] is not None:
+                current = getattr(self, key)
+                setattr(self, key, other[key] if current is None else pick(current, other[key]))
+
+    def as_dict(self) -> dict:
+        """
+        Formats object as a dict
+        """
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'mean': self.sum / self.count if self.count else None,
+            'counts': self.counts
+        }
+
+
+class Metrics:
+    """
+    Registry of metrics for a single run.
+
+    Like Blacklist, every method is a class method such that every module records into the same
+    run without passing a registry around. Recording is thread safe.
+
+        >>> with Metrics.stage('xml_parse'):
+        ...     parse()
+        >>> Metrics.cache('temp_file', hit=True)
+        >>> Metrics.increment('errors.elastic')
+        >>> Metrics.write()
+    """
+    _lock = threading.Lock()
+    _started = time.time()
+    _stages = {}  # type: Dict[str, Histogram]
+    _http = {}  # type: Dict[str, Histogram]
+    _caches = {}  # type: Dict[str, Dict[str, int]]
+    _counters = {}  # type: Dict[str, int]
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Forget every recorded metric and restart the run clock
+        """
+        with cls._lock:
+            cls._started = time.time()
+            cls._stages = {}
+            cls._http = {}
+            cls._caches = {}
+            cls._counters = {}
+
+    @classmethod
+    @contextmanager
+    def stage(cls, name: str):
+        """
+        Time the enclosed block as a single observation of stage :param name
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            cls.observe(name, time.perf_counter() - start)
+
+    @classmethod
+    def observe(cls, name: str, seconds: float) -> None:
+        """
+        Record a single observation of stage :param name
+        """
+        with cls._lock:
+            cls._stages.setdefault(name, Histogram()).observe(seconds)
+
+    @classmethod
+    def observe_http(cls, url: str, seconds: float) -> None:
+        """
+        Record the latency of a single HTTP request, grouped by host
+        """
+        host = urlparse(url).netloc
+        with cls._lock:
+            cls._http.setdefault(host, Histogram()).observe(seconds)
+
+    @classmethod
+    def cache(cls, name: str, hit: bool) -> None:
+        """
+        Record a single hit or miss on the cache :param name
+        """
+        with cls._lock:
+            counts = cls._caches.setdefault(name, {'hits': 0, 'misses': 0})
+            counts['hits' if hit else 'misses'] += 1
+
+    @classmethod
+    def increment(cls, name: str, amount: int = 1) -> None:
+        """
+        Increment the counter :param name. Errors are counted as 'errors.<source>'
+        """
+        with cls._lock:
+            cls._counters[name] = cls._counters.get(name, 0) + amount
+
+    @classmethod
+    def counter(cls, name: str) -> int:
+        return cls._counters.get(name, 0)
+
+    @classmethod
+    def as_dict(cls) -> dict:
+        """
+        Formats every recorded metric as a dict
+        """
+        with cls._lock:
+            duration = time.time() - cls._started
+            rows = cls._counters.get('rows_processed', 0)
+
+            return {
+                'started': datetime.fromtimestamp(cls._started).strftime(FilterXMLConfig.iso_fmt()),
+                'duration_seconds': duration,
+                'rows_processed': rows,
+                'rows_per_second': rows / duration if duration else 0,
+                'stages': {k: v.as_dict() for k, v in sorted(cls._stages.items())},
+                'http': {k: v.as_dict() for k, v in sorted(cls._http.items())},
+                'caches': {k: dict(v, hit_rate=v['hits'] / (v['hits'] + v['misses']))
+                           for k, v in sorted(cls._caches.items())},
+                'counters': dict(sorted(cls._counters.items()))
+            }
+
+    @classmethod
+    def merge(cls, path: str) -> None:
+        """
+        Add the metrics in the JSON file at :param path, as written by write(), to this run
+        """
+        with open(path, 'r') as f:
+            other = json.loads(f.read())
+
+        with cls._lock:
+            for registry, key in [(cls._stages, 'stages'), (cls._http, 'http')]:
+                for name, histogram in other[key].items():
+                    registry.setdefault(name, Histogram()).merge(histogram)
+            for name, counts in other['caches'].items():
+                current = cls._caches.setdefault(name, {'hits': 0, 'misses': 0})
+                current['hits'] += counts['hits']
+                current['misses'] += counts['misses']
+            for name, value in other['counters'].items():
+                cls._counters[name] = cls._counters.get(name, 0) + value
+
+    @classmethod
+    def write(cls, json_path: Optional[str] = None, prometheus_path: Optional[str] = None) -> None:
+        """
+        Write every recorded metric as JSON and as a Prometheus textfile. Paths default to
+        [metrics] in config file, and an empty path skips the file
+        """
+        json_path = FilterXMLConfig.metrics_json() if json_path is None else json_path
+        prometheus_path = FilterXMLConfig.metrics_prometheus() \
+            if prometheus_path is None else prometheus_path
+        data = cls.as_dict()
+
+        if json_path:
+            cls._write_atomic(json_path, json.dumps(data, indent=4))
+        if prometheus_path:
+            cls._write_atomic(prometheus_path, cls._prometheus(data))
+
+    @staticmethod
+    def _prometheus(data: dict) -> str:
+        """
+        Format :param data, as returned by as_dict(), in the Prometheus text format
+        """
+        lines = [
+            '# TYPE filter_xml_run_duration_seconds gauge',
+            f'filter_xml_run_duration_seconds {data["duration_seconds"]}',
+            '# TYPE filter_xml_rows_per_second gauge',
+            f'filter_xml_rows_per_second {data["rows_per_second"]}',
+        ]
+
+        histograms = [('filter_xml_stage_duration_seconds', 'stage', data['stages']),
+                      ('filter_xml_http_request_duration_seconds', 'host', data['http'])]
+        for metric, label, registry in histograms:
+            lines.append(f'# TYPE {metric} histogram')
+            for name, histogram in registry.items():
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS + ['+Inf'], histogram['counts']):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label}="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{{label}="{name}"}} {histogram["sum"]}')
+                lines.append(f'{metric}_count{{{label}="{name}"}} {histogram["count"]}')
+
+        lines.append('# TYPE filter_xml_cache_requests_total counter')
+        for name, counts in data['caches'].items():
+            for result in ['hits', 'misses']:
+                lines.append(f'filter_xml_cache_requests_total{{cache="{name}",result="{result}"}} '
+                             f'{counts[result]}')
+
+        lines.append('# TYPE filter_xml_events_total counter')
+        for name, value in data['counters'].items():
+            lines.append(f'filter_xml_events_total{{event="{name}"}} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _write_atomic(path: str, content: str) -> None:
+        """
+        Write :param content to a temporary file and move it into place, such that readers never
+        see a partially written file
+        """
+        with open(f'{path}.tmp', 'w') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+
+
+class Progress:
+    """
+    Throttled progress reporting. Prints the amount of processed rows, the throughput and, if the
+    total is known, the estimated time left - at most once every :param interval seconds
+    """
+
+    def __init__(self, total: int = 0, interval: Optional[float] = None, label: str = 'rows'):
+        self.total = total
+        self.interval = FilterXMLConfig.metrics_progress_interval() \
+            if interval is None else interval
+        self.label = label
+        self.done = 0
+
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+    def update(self, amount: int = 1) -> None:
+        """
+        Count :param amount processed rows, and report if the interval has passed
+        """
+        self.done += amount
+        now = time.monotonic()
+
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            print(self.report(now))
+
+    def report(self, now: Optional[float] = None) -> str:
+        elapsed = (now or time.monotonic()) - self._started
+        rate = self.done / elapsed if elapsed else 0
+
+        if not self.total:
+            return f'{self.done} {self.label} processed, {rate:.1f} {self.label}/s'
+
+        left = max(self.total - self.done, 0)
+        eta = time.strftime('%H:%M:%S', time.gmtime(left / rate)) if rate else 'unknown'
+        return f'{self.done} of {self.total} {self.label} processed, {rate:.1f} {self.label}/s, ' \
+               f'ETA {eta}'
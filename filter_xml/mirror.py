@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import json
+import os
+
+from typing import Dict, Optional
+
+from filter_xml.catalog import RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+
+
+class Mirror:
+    """
+    Local mirror of the state last pushed to the data endpoint.
+
+    Keeps the fingerprint of every pushed restaurant, indexed by name_seq_nr, along with the token
+    of the push and the data version reported by the data endpoint afterwards. As long as the
+    data endpoint reports the same version, diffs are calculated against the mirror rather than
+    against a full download of the current state.
+
+    When updates are sent as patches, the signature of every restaurant is kept as well, such that
+    patches can be calculated against the mirror.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else FilterXMLConfig.mirror_path()
+        self.token = None  # type: Optional[str]
+        self.version = None  # type: Optional[str]
+        self.fingerprints = dict()  # type: Dict[str, str]
+        self.signatures = dict()  # type: Dict[str, dict]
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> Mirror:
+        """
+        Load the mirror from disk. A missing or unreadable mirror is empty, and thus never valid
+        """
+        self = Mirror(path)
+        if not self.path or not os.path.isfile(self.path):
+            return self
+
+        try:
+            with open(self.path, 'r') as f:
+                data = json.loads(f.read())
+        except (OSError, ValueError):
+            print('Failed to read mirror, validating against the data endpoint')
+            return self
+
+        self.token = data['token']
+        self.version = data['version']
+        self.fingerprints = data['fingerprints']
+        self.signatures = data.get('signatures', dict())
+        return self
+
+    def is_valid(self, version: Optional[str]) -> bool:
+        """
+        Whether the mirror matches the state of the data endpoint, as identified by
+        :param version. A data endpoint that reports no version is never matched
+        """
+        return bool(self.path) and self.version is not None and self.version == version
+
+    def update(self, catalog: RestaurantCatalog, token: str, version: Optional[str],
+               signatures: bool = False) -> None:
+        """
+        Replace the mirror by :param catalog, which has just been pushed in the session
+        :param token, after which the data endpoint reports :param version. Signatures are only
+        kept if :param signatures. Restaurants retained by :param catalog keep their current
+        fingerprint and signature, cf. RestaurantCatalog.retained
+        """
+        fingerprints = catalog.fingerprints()
+        new_signatures = catalog.signatures() if signatures else dict()
+        for seq_nr in catalog.retained:
+            if seq_nr in self.fingerprints:
+                fingerprints[seq_nr] = self.fingerprints[seq_nr]
+            if signatures and seq_nr in self.signatures:
+                new_signatures[seq_nr] = self.signatures[seq_nr]
+
+        self.token = token
+        self.version = version
+        self.fingerprints = fingerprints
+        self.signatures = new_signatures
+
+    def save(self) -> None:
+        """
+        Write the mirror to a temporary file and move it into place
+        """
+        if not self.path:
+            return
+
+        with open(f'{self.path}.tmp', 'w') as f:
+            f.write(json.dumps({
+                'token': self.token,
+                'version': self.version,
+                'fingerprints': self.fingerprints,
+                'signatures': self.signatures
+            }))
+        os.replace(f'{self.path}.tmp', self.path)
+
+    def invalidate(self) -> None:
+        """
+        Forget the mirror, such that the next run validates against the data endpoint, e.g.
+        after a push that did not fully succeed
+        """
+        self.token = self.version = None
+        self.fingerprints = dict()
+        self.signatures = dict()
+        if self.path and os.path.isfile(self.path):
+            os.remove(self.path)
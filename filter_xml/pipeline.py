@@ -0,0 +1,191 @@
+import threading
+
+from queue import Queue, Empty
+from typing import Callable, Iterable, List, Optional, Tuple
+from filter_xml.profiling import Profiler
+
+
+class _Done:
+    """
+    End-of-stream marker passed between stages
+    """
+
+
+_DONE = _Done()
+
+
+class Stage:
+    """
+    A single stage of a Pipeline.
+
+    :param name: name of the stage, used in error messages
+    :param fun: function run on every item. Returns the item to pass on to the next stage, or
+                None to drop it. If :param batch_size is above 1, it instead takes a list of
+                items and returns the list of items to pass on
+    :param workers: amount of threads running :param fun
+    :param batch_size: maximum amount of items passed to :param fun at once
+    """
+    # seconds a batching worker waits for more items before running an incomplete batch
+    BATCH_LINGER = 0.5
+
+    def __init__(self, name: str, fun: Callable, workers: int = 1, batch_size: int = 1):
+        if workers < 1:
+            raise ValueError(f'stage {name} needs at least one worker, got {workers}')
+
+        self.name = name
+        self.fun = fun
+        self.workers = workers
+        self.batch_size = batch_size
+
+        self._finished_workers = 0
+        self._lock = threading.Lock()
+
+    def process(self, items: list) -> list:
+        """
+        Run the stage function on :param items, and return the items to pass on
+        """
+        if self.batch_size > 1:
+            return self.fun(items)
+
+        return [out for out in (self.fun(item) for item in items) if out is not None]
+
+    def worker_finished(self) -> bool:
+        """
+        Mark a single worker as finished, and return whether or not it was the last one
+        """
+        with self._lock:
+            self._finished_workers += 1
+            return self._finished_workers == self.workers
+
+
+class Pipeline:
+    """
+    Runs items from a source through a list of stages connected by bounded queues.
+
+    Every stage runs in its own thread(s), such that a slow stage does not leave the others idle,
+    and no more than :param queue_size items wait between any two stages at a time. Items may
+    leave a stage in a different order than they entered it if it has more than one worker.
+
+        >>> pipeline = Pipeline(range(10), [Stage('double', lambda x: x * 2, workers=2),
+        ...                                 Stage('print', print)])
+        >>> pipeline.run()
+    """
+
+    def __init__(self, source: Iterable, stages: List[Stage], queue_size: int = 100):
+        self.source = source
+        self.stages = stages
+        self.queues = [Queue(maxsize=queue_size) for _ in stages]
+
+        self._stopped = threading.Event()
+        self._error = None  # type: Optional[BaseException]
+
+    def stop(self) -> None:
+        """
+        Stop the pipeline. The source stops producing, and items already in the pipeline are
+        drained without being processed
+        """
+        self._stopped.set()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stopped.is_set()
+
+    def run(self) -> None:
+        """
+        Run the pipeline until the source is exhausted or stop() is called. Re-raises the first
+        exception raised by any stage
+        """
+        threads = [threading.Thread(target=self._produce, name='source', daemon=True)]
+
+        for i, stage in enumerate(self.stages):
+            outbox = self.queues[i + 1] if i + 1 < len(self.stages) else None
+            next_workers = self.stages[i + 1].workers if outbox else 0
+            for n in range(stage.workers):
+                threads.append(threading.Thread(
+                    target=self._work, args=(stage, self.queues[i], outbox, next_workers, n),
+                    name=f'{stage.name}-{n}', daemon=True))
+
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if self._error:
+            raise self._error
+
+    def _produce(self) -> None:
+        """
+        Feed items from the source into the first queue
+        """
+        try:
+            with Profiler.thread('source'):
+                for item in self.source:
+                    if self.stopped:
+                        break
+                    self.queues[0].put(item)
+        except BaseException as e:
+            self._fail(e)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self.queues[0].put(_DONE)
+
+    def _work(self, stage: Stage, inbox: Queue, outbox: Optional[Queue],
+              next_workers: int, worker: int) -> None:
+        """
+        Worker loop for a single thread of :param stage
+        """
+        with Profiler.thread(f'{stage.name}-{worker}'):
+            self._work_loop(stage, inbox, outbox)
+
+        if stage.worker_finished() and outbox:
+            for _ in range(next_workers):
+                outbox.put(_DONE)
+
+    def _work_loop(self, stage: Stage, inbox: Queue, outbox: Optional[Queue]) -> None:
+        done = False
+
+        while not done:
+            items, done = self._take(stage, inbox)
+
+            if not items or self.stopped:
+                continue
+
+            try:
+                results = stage.process(items)
+            except BaseException as e:
+                self._fail(e)
+                continue
+
+            if outbox:
+                for result in results:
+                    outbox.put(result)
+
+    @staticmethod
+    def _take(stage: Stage, inbox: Queue) -> Tuple[list, bool]:
+        """
+        Take up to stage.batch_size items from :param inbox. Returns the items, and whether or not
+        the end of the stream has been reached
+        """
+        item = inbox.get()
+        if item is _DONE:
+            return [], True
+
+        items = [item]
+        while len(items) < stage.batch_size:
+            try:
+                item = inbox.get(timeout=stage.BATCH_LINGER)
+            except Empty:
+                break
+            if item is _DONE:
+                return items, True
+            items.append(item)
+
+        return items, False
+
+    def _fail(self, error: BaseException) -> None:
+        """
+        Record the first error raised in the pipeline and stop it
+        """
+        if self._error is None:
+            self._error = error
+        self.stop()
@@ -0,0 +1,160 @@
+import cProfile
+import os
+import threading
+import tracemalloc
+
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Profiler:
+    """
+    CPU and memory profiling of the stages of a run, enabled by the --profile and --trace-memory
+    CLI args.
+
+    Like Metrics, every method is a class method. Stages are wrapped as
+        >>> with Profiler.stage('diff'):
+        ...     catalog.setup_diff(current)
+
+    With --profile, every stage is run under cProfile, and a pstats file is written per stage
+    (or per worker thread of a pipeline stage) when write() is called. With --trace-memory, the
+    allocations made during every stage are traced with tracemalloc, and the top allocations are
+    written per stage.
+
+    When neither is enabled, stage() and thread() return a shared no-op context manager, such
+    that profiling adds no overhead.
+    """
+    TOP_ALLOCATIONS = 25
+
+    _directory = None  # type: Optional[str]
+    _cpu = False
+    _memory = False
+    _prefix = ''
+    _profiles = {}  # type: Dict[str, cProfile.Profile]
+    _memory_reports = {}  # type: Dict[str, List[str]]
+    _lock = threading.Lock()
+    _local = threading.local()
+
+    @classmethod
+    def configure(cls, directory: Optional[str], cpu: bool, memory: bool) -> None:
+        """
+        Enable CPU profiling and/or memory tracing, writing reports to :param directory
+        """
+        cls._directory = directory
+        cls._cpu = cpu
+        cls._memory = memory
+        cls._profiles = {}
+        cls._memory_reports = {}
+
+        if cls.enabled():
+            os.makedirs(directory, exist_ok=True)
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Forget every recorded report, keeping the configuration
+        """
+        with cls._lock:
+            cls._profiles = {}
+            cls._memory_reports = {}
+
+    @classmethod
+    def set_prefix(cls, prefix: str) -> None:
+        """
+        Prefix every report file name with :param prefix, e.g. to separate shard processes
+        """
+        cls._prefix = prefix
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return cls._cpu or cls._memory
+
+    @classmethod
+    def stage(cls, name: str):
+        """
+        Profile the enclosed block as part of stage :param name. Entering the same stage several
+        times accumulates into the same report
+        """
+        if not cls.enabled():
+            return _NULL_CONTEXT
+        return cls._profile(name, memory=cls._memory)
+
+    @classmethod
+    def thread(cls, name: str):
+        """
+        Profile the enclosed block, run in a worker thread, as stage :param name. Memory is not
+        traced per thread, as tracemalloc snapshots cover every thread
+        """
+        if not cls._cpu:
+            return _NULL_CONTEXT
+        return cls._profile(name, memory=False)
+
+    @classmethod
+    @contextmanager
+    def _profile(cls, name: str, memory: bool):
+        # cProfile can only profile one block per thread at a time, so nested stages are
+        # accounted to the outermost one
+        profile = None
+        if cls._cpu and not getattr(cls._local, 'active', False):
+            with cls._lock:
+                profile = cls._profiles.setdefault(name, cProfile.Profile())
+            cls._local.active = True
+
+        before = tracemalloc.take_snapshot() if memory else None
+
+        if profile:
+            try:
+                profile.enable()
+            except ValueError:
+                # python 3.12+ allows a single active profiler per interpreter
+                profile = None
+                cls._local.active = False
+        try:
+            yield
+        finally:
+            if profile:
+                profile.disable()
+                cls._local.active = False
+            if before is not None:
+                cls._record_memory(name, before)
+
+    @classmethod
+    def _record_memory(cls, name: str, before: tracemalloc.Snapshot) -> None:
+        """
+        Record the top allocations made since the snapshot :param before
+        """
+        after = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+
+        lines = [f'# {name}: {current / 1024 ** 2:.1f} MiB traced, peak {peak / 1024 ** 2:.1f} MiB']
+        # leave out the allocations made by the snapshots themselves
+        exclude = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(exclude).compare_to(before.filter_traces(exclude), 'lineno')
+
+        lines += [str(stat) for stat in stats[:cls.TOP_ALLOCATIONS]]
+
+        with cls._lock:
+            cls._memory_reports.setdefault(name, []).extend(lines + [''])
+
+    @classmethod
+    def write(cls) -> None:
+        """
+        Write every recorded report to the profile directory
+        """
+        if not cls.enabled():
+            return
+
+        with cls._lock:
+            for name, profile in cls._profiles.items():
+                profile.dump_stats(os.path.join(cls._directory, f'{cls._prefix}{name}.pstats'))
+
+            for name, lines in cls._memory_reports.items():
+                path = os.path.join(cls._directory, f'{cls._prefix}{name}.memory.txt')
+                with open(path, 'w') as f:
+                    f.write('\n'.join(lines))
+
+        print(f'Profiling reports written to {cls._directory}')
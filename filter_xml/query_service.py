@@ -0,0 +1,264 @@
+from __future__ import annotations
+
+import json
+import threading
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit, parse_qs
+
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+from filter_xml.spatial import GridIndex
+
+
+class QueryIndex:
+    """
+    In-memory indexes over a RestaurantCatalog, served by QueryService.
+
+    Restaurants are indexed by name_seq_nr, pnr and cvrnr, and by their coordinates on a
+    GridIndex. update() only touches the restaurants that differ from the indexed catalog, so
+    the index can follow the daemon from cycle to cycle.
+    """
+
+    def __init__(self, cell_size: Optional[float] = None):
+        self._restaurants = dict()  # type: Dict[str, Restaurant]
+        self._by_pnr = dict()  # type: Dict[str, Set[str]]
+        self._by_cvrnr = dict()  # type: Dict[str, Set[str]]
+        # restaurants serialized on first request, with the restaurant they were serialized from
+        self._json = dict()  # type: Dict[str, Tuple[Restaurant, str]]
+        self._grid = GridIndex(cell_size if cell_size is not None
+                               else FilterXMLConfig.query_cell_size())
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._restaurants)
+
+    def update(self, catalog: RestaurantCatalog) -> Tuple[int, int]:
+        """
+        Make the index reflect :param catalog. Restaurants that are the very same objects as the
+        indexed ones are skipped, as the daemon reuses unchanged restaurants between cycles.
+        Returns the amount of restaurants indexed and removed
+        """
+        current = {res.name_seq_nr: res for res in catalog.catalog}
+        indexed = 0
+
+        with self._lock:
+            removed = [key for key in self._restaurants if key not in current]
+            for key in removed:
+                self._remove(key)
+
+            for key, res in current.items():
+                if self._restaurants.get(key) is res:
+                    continue
+                self._remove(key)
+                self._add(res)
+                indexed += 1
+
+        return indexed, len(removed)
+
+    def _add(self, res: Restaurant) -> None:
+        key = res.name_seq_nr
+        self._restaurants[key] = res
+        if res.pnr:
+            self._by_pnr.setdefault(res.pnr, set()).add(key)
+        if res.cvrnr:
+            self._by_cvrnr.setdefault(res.cvrnr, set()).add(key)
+        if res.geo_lat is not None and res.geo_lng is not None:
+            self._grid.add(key, res.geo_lat, res.geo_lng)
+
+    def _remove(self, key: str) -> None:
+        res = self._restaurants.pop(key, None)
+        if res is None:
+            return
+        self._json.pop(key, None)
+        for index, value in [(self._by_pnr, res.pnr), (self._by_cvrnr, res.cvrnr)]:
+            keys = index.get(value)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[value]
+        self._grid.remove(key)
+
+    def get(self, name_seq_nr: str) -> Optional[Restaurant]:
+        with self._lock:
+            return self._restaurants.get(name_seq_nr)
+
+    def by_pnr(self, pnr: str) -> List[Restaurant]:
+        with self._lock:
+            return [self._restaurants[key] for key in sorted(self._by_pnr.get(pnr, ()))]
+
+    def by_cvrnr(self, cvrnr: str) -> List[Restaurant]:
+        with self._lock:
+            return [self._restaurants[key] for key in sorted(self._by_cvrnr.get(cvrnr, ()))]
+
+    def radius(self, lat: float, lng: float, meters: float,
+               limit: Optional[int] = None) -> List[Tuple[float, Restaurant]]:
+        """
+        Restaurants within :param meters of the point, nearest first, as (distance, restaurant)
+        """
+        with self._lock:
+            found = self._grid.radius(lat, lng, meters)
+            return [(distance, self._restaurants[key]) for distance, key in found[:limit]]
+
+    def nearest(self, lat: float, lng: float, k: int) -> List[Tuple[float, Restaurant]]:
+        """
+        The :param k restaurants nearest to the point, nearest first, as (distance, restaurant)
+        """
+        with self._lock:
+            return [(distance, self._restaurants[key])
+                    for distance, key in self._grid.nearest(lat, lng, k)]
+
+    def to_json(self, res: Restaurant) -> str:
+        """
+        :param res serialized as JSON. Serializing is most of the cost of a query, so it is done
+        once per restaurant and reused until the restaurant is updated
+        """
+        cached = self._json.get(res.name_seq_nr)
+        if cached is not None and cached[0] is res:
+            return cached[1]
+        serialized = json.dumps(res.as_dict())
+        self._json[res.name_seq_nr] = (res, serialized)
+        return serialized
+
+    def status(self) -> dict:
+        with self._lock:
+            return {'restaurants': len(self._restaurants), 'located': len(self._grid)}
+
+
+class _BadRequest(Exception):
+    pass
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    """
+    Read-only JSON API over a QueryIndex, cf. QueryService
+    """
+    MAX_RESULTS = 1000
+    # keep connections open between requests, every response carries a Content-Length. The
+    # headers and the body are written separately, which Nagle's algorithm would hold back
+    # until the delayed ACK of the client
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format: str, *args) -> None:
+        # keep load test output free of per-request log lines
+        return
+
+    def do_GET(self) -> None:
+        url = urlsplit(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        parts = [part for part in url.path.split('/') if part]
+        index = self.server.index  # type: QueryIndex
+
+        try:
+            if parts == ['restaurants'] and 'pnr' in params:
+                self._send_body(self._rows(index, index.by_pnr(params['pnr'])))
+            elif parts == ['restaurants'] and 'cvrnr' in params:
+                self._send_body(self._rows(index, index.by_cvrnr(params['cvrnr'])))
+            elif len(parts) == 2 and parts[0] == 'restaurants':
+                res = index.get(parts[1])
+                if res is None:
+                    self._send_json({'error': f'no restaurant {parts[1]}'}, status=404)
+                else:
+                    self._send_body(index.to_json(res))
+            elif parts == ['nearby']:
+                found = index.radius(self._float(params, 'lat'), self._float(params, 'lng'),
+                                     self._float(params, 'radius', 1000),
+                                     self._int(params, 'limit', self.MAX_RESULTS))
+                self._send_body(self._located(index, found))
+            elif parts == ['nearest']:
+                found = index.nearest(self._float(params, 'lat'), self._float(params, 'lng'),
+                                      self._int(params, 'k', 10))
+                self._send_body(self._located(index, found))
+            elif parts == ['status']:
+                self._send_json(index.status())
+            else:
+                self._send_json({'error': f'unknown path {url.path}'}, status=404)
+        except _BadRequest as e:
+            self._send_json({'error': str(e)}, status=400)
+
+    @staticmethod
+    def _rows(index: QueryIndex, restaurants: List[Restaurant]) -> str:
+        return '[' + ', '.join(index.to_json(res) for res in restaurants) + ']'
+
+    @staticmethod
+    def _located(index: QueryIndex, found: List[Tuple[float, Restaurant]]) -> str:
+        return '[' + ', '.join(f'{{"distance": {round(distance, 1)}, '
+                               f'"restaurant": {index.to_json(res)}}}'
+                               for distance, res in found) + ']'
+
+    @staticmethod
+    def _float(params: dict, key: str, default: Optional[float] = None) -> float:
+        if key not in params:
+            if default is None:
+                raise _BadRequest(f'missing parameter {key}')
+            return default
+        try:
+            return float(params[key])
+        except ValueError:
+            raise _BadRequest(f'parameter {key} must be a number')
+
+    @classmethod
+    def _int(cls, params: dict, key: str, default: int) -> int:
+        try:
+            value = int(params.get(key, default))
+        except ValueError:
+            raise _BadRequest(f'parameter {key} must be an integer')
+        if not 0 < value <= cls.MAX_RESULTS:
+            raise _BadRequest(f'parameter {key} must be between 1 and {cls.MAX_RESULTS}')
+        return value
+
+    def _send_json(self, data, status: int = 200) -> None:
+        self._send_body(json.dumps(data), status)
+
+    def _send_body(self, serialized: str, status: int = 200) -> None:
+        body = serialized.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class QueryService:
+    """
+    Local read API over the processed catalog, started by the --serve CLI arg.
+        GET /restaurants/<name_seq_nr>          a single restaurant
+        GET /restaurants?pnr=<pnr>              restaurants with the given p-number
+        GET /restaurants?cvrnr=<cvrnr>          restaurants with the given CVR number
+        GET /nearby?lat=&lng=&radius=&limit=    restaurants within radius meters, default 1000
+        GET /nearest?lat=&lng=&k=               the k nearest restaurants, default 10
+        GET /status                             size of the index
+
+    Distances are in meters, and results of /nearby and /nearest are nearest first. Use port 0
+    to let the OS pick a free port, which is then available as self.port
+        >>> service = QueryService(index, 0).start()
+        >>> service.url('/nearest?lat=55.68&lng=12.56&k=3')
+        'http://127.0.0.1:41234/nearest?lat=55.68&lng=12.56&k=3'
+        >>> service.stop()
+    """
+
+    def __init__(self, index: QueryIndex, port: Optional[int] = None,
+                 host: Optional[str] = None):
+        self.index = index
+        self.host = host if host is not None else FilterXMLConfig.query_host()
+        self._server = ThreadingHTTPServer(
+            (self.host, port if port is not None else FilterXMLConfig.query_port()),
+            _QueryHandler)
+        self._server.daemon_threads = True
+        self._server.index = index
+        self._thread = threading.Thread(target=self._server.serve_forever, name='query-service',
+                                        daemon=True)
+        self.port = self._server.server_address[1]
+
+    def url(self, path: str = '/') -> str:
+        return f'http://{self.host}:{self.port}{path}'
+
+    def start(self) -> QueryService:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import json
+import os
+
+from typing import Dict, Iterable, List, Optional
+
+from filter_xml.catalog import Restaurant
+from filter_xml.config import FilterXMLConfig
+
+
+class Schedule:
+    """
+    Order in which restaurants are enriched, such that a run cut short by --deadline has spent
+    its time on the restaurants where new data is most likely:
+        1. restaurants that have never been output, i.e. with a new name_seq_nr
+        2. restaurants inspected since they were last output
+        3. every other restaurant, least recently output first
+    Within the first two tiers, the most recently inspected restaurants come first. Ties keep
+    the order of the smiley XML.
+
+    For every restaurant output, the session token of the output and its latest inspection at
+    the time are kept, updated by DataProcessor.output():
+        >>> schedule = Schedule.load()
+        >>> ordered = schedule.order(restaurants)
+        >>> schedule.record(catalog, token, retained=['12345'])
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else FilterXMLConfig.schedule_path()
+        # name_seq_nr -> [token of the last output, latest inspection as a date ordinal]
+        self._entries = dict()  # type: Dict[str, list]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def latest_inspection(res: Restaurant) -> int:
+        """
+        Date ordinal of the latest smiley report of :param res, 0 if it has none
+        """
+        return max((report.date.toordinal() for report in res.smiley_reports if report.date),
+                   default=0)
+
+    def priority(self, res: Restaurant) -> tuple:
+        """
+        Sort key of :param res, lowest first
+        """
+        latest = self.latest_inspection(res)
+        entry = self._entries.get(res.name_seq_nr)
+        if entry is None:
+            return 0, -latest, ''
+        token, inspected = entry
+        if latest > inspected:
+            return 1, -latest, ''
+        return 2, 0, token or ''
+
+    def order(self, restaurants: Iterable[Restaurant]) -> List[Restaurant]:
+        return sorted(restaurants, key=self.priority)
+
+    def record(self, restaurants: Iterable[Restaurant], token: str,
+               retained: Iterable[str] = ()) -> None:
+        """
+        Record :param restaurants as output in the session :param token. Restaurants that were
+        not output are forgotten, except the :param retained ones, which were kept as they were
+        """
+        entries = {seq_nr: self._entries[seq_nr] for seq_nr in retained
+                   if seq_nr in self._entries}
+        for res in restaurants:
+            entries[res.name_seq_nr] = [token, self.latest_inspection(res)]
+        self._entries = entries
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> Schedule:
+        """
+        Load the schedule from disk. A missing or unreadable schedule is empty, such that every
+        restaurant is considered new
+        """
+        self = Schedule(path)
+        if not self.path or not os.path.isfile(self.path):
+            return self
+
+        try:
+            with open(self.path, 'r') as f:
+                self._entries = json.loads(f.read())['restaurants']
+        except (OSError, ValueError, KeyError):
+            print('Failed to read the enrichment schedule, treating every restaurant as new')
+        return self
+
+    def save(self) -> None:
+        """
+        Write the schedule to a temporary file and move it into place
+        """
+        if not self.path:
+            return
+
+        with open(f'{self.path}.tmp', 'w') as f:
+            f.write(json.dumps({'restaurants': self._entries}))
+        os.replace(f'{self.path}.tmp', self.path)
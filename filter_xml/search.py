@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+from argparse import ArgumentParser
+from typing import Dict, List, Optional, Set, Tuple
+
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.data_handler import DataHandler
+from filter_xml.smiley_extractor import SmileyExtractor
+from filter_xml.util import normalise
+
+_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def tokenise(text: Optional[str]) -> List[str]:
+    return _TOKEN.findall(normalise(text)) if text else []
+
+
+def _deletions(token: str) -> Set[str]:
+    return {token[:i] + token[i + 1:] for i in range(len(token))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """
+    Whether :param a and :param b differ by at most one insertion, deletion, substitution or
+    transposition of adjacent characters
+    """
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:] or \
+            (a[i + 2:] == b[i + 2:] and a[i:i + 2] == b[i:i + 2][::-1])
+    return a[i:] == b[i + 1:]
+
+
+class SearchIndex:
+    """
+    In-memory search over the name, address, franchise name and city of restaurants.
+
+    Every field is tokenised after normalise(), so queries are case and diacritic insensitive.
+    A query matches restaurants that match every query token, where a token matches
+        exactly         e.g. 'pizza'
+        as a prefix     only the last query token, of at least MIN_PREFIX characters, e.g. 'piz'
+        with a typo     one edit away, for tokens of at least MIN_TYPO characters that are not
+                        indexed as is, e.g. 'piza'
+    Matches are scored by the kind of match and by the field they are in, cf. FIELDS.
+
+    Typos are found with a deletion index, cf. SymSpell: every token is indexed under every
+    variant with one character deleted, so a query token only has to look up its own deletion
+    variants rather than compare against the whole vocabulary.
+        >>> index = SearchIndex()
+        >>> index.update(catalog)
+        >>> index.search('jensens bofhus aarhus', limit=3)
+        [(5.5, <filter_xml.catalog.Restaurant object at 0x7f...>), ...]
+    """
+    # field, weight
+    FIELDS = [('name', 3.0), ('franchise_name', 2.0), ('address', 1.0), ('city', 1.0)]
+    EXACT, PREFIX, TYPO = 1.0, 0.75, 0.5
+    MIN_PREFIX = 2
+    MIN_TYPO = 4
+
+    def __init__(self):
+        self._restaurants = dict()  # type: Dict[str, Restaurant]
+        # token -> key -> best field weight of the token in the restaurant
+        self._postings = dict()  # type: Dict[str, Dict[str, float]]
+        self._tokens = dict()  # type: Dict[str, Dict[str, float]]
+        self._vocabulary = []  # type: List[str]
+        self._deleted = dict()  # type: Dict[str, Set[str]]
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._restaurants)
+
+    def update(self, catalog: RestaurantCatalog) -> Tuple[int, int]:
+        """
+        Make the index reflect :param catalog. Restaurants that are the very same objects as the
+        indexed ones are skipped. Returns the amount of restaurants indexed and removed
+        """
+        current = {res.name_seq_nr: res for res in catalog.catalog}
+        indexed = 0
+
+        with self._lock:
+            removed = [key for key in self._restaurants if key not in current]
+            for key in removed:
+                self._remove(key)
+
+            for key, res in current.items():
+                if self._restaurants.get(key) is res:
+                    continue
+                self._remove(key)
+                self._add(res)
+                indexed += 1
+
+        return indexed, len(removed)
+
+    def _add(self, res: Restaurant) -> None:
+        key = res.name_seq_nr
+        tokens = dict()  # type: Dict[str, float]
+        for field, weight in self.FIELDS:
+            for token in tokenise(getattr(res, field)):
+                tokens[token] = max(tokens.get(token, 0), weight)
+
+        self._restaurants[key] = res
+        self._tokens[key] = tokens
+        for token, weight in tokens.items():
+            posting = self._postings.get(token)
+            if posting is None:
+                posting = self._postings[token] = dict()
+                bisect.insort(self._vocabulary, token)
+                if len(token) >= self.MIN_TYPO:
+                    for variant in _deletions(token):
+                        self._deleted.setdefault(variant, set()).add(token)
+            posting[key] = weight
+
+    def _remove(self, key: str) -> None:
+        if self._restaurants.pop(key, None) is None:
+            return
+        for token in self._tokens.pop(key):
+            posting = self._postings[token]
+            del posting[key]
+            if posting:
+                continue
+
+            del self._postings[token]
+            del self._vocabulary[bisect.bisect_left(self._vocabulary, token)]
+            if len(token) >= self.MIN_TYPO:
+                for variant in _deletions(token):
+                    tokens = self._deleted[variant]
+                    tokens.discard(token)
+                    if not tokens:
+                        del self._deleted[variant]
+
+    def _matches(self, token: str, prefix: bool) -> List[Tuple[str, float]]:
+        """
+        Indexed tokens matching the query :param token, with the score of the kind of match
+        """
+        matches = {token: self.EXACT} if token in self._postings else dict()
+
+        if prefix and len(token) >= self.MIN_PREFIX:
+            # walk the sorted vocabulary from the first candidate rather than slicing it, which
+            # would copy its tail on every query
+            vocabulary = self._vocabulary
+            for i in range(bisect.bisect_left(vocabulary, token), len(vocabulary)):
+                if not vocabulary[i].startswith(token):
+                    break
+                matches.setdefault(vocabulary[i], self.PREFIX)
+
+        # typos are only looked for when the token is not indexed as is
+        if len(token) >= self.MIN_TYPO and token not in self._postings:
+            # indexed tokens one deletion away, or sharing a deletion variant with the query
+            candidates = set(self._deleted.get(token, ()))
+            for variant in _deletions(token):
+                if variant in self._postings:
+                    candidates.add(variant)
+                candidates.update(self._deleted.get(variant, ()))
+            for candidate in candidates:
+                if candidate not in matches and _within_one_edit(token, candidate):
+                    matches[candidate] = self.TYPO
+
+        return list(matches.items())
+
+    def search(self, query: str, limit: int = 10) -> List[Tuple[float, Restaurant]]:
+        """
+        Restaurants matching every token of :param query, best first, as (score, restaurant)
+        """
+        tokens = tokenise(query)
+        if not tokens or limit <= 0:
+            return []
+
+        with self._lock:
+            scored = None  # type: Optional[Dict[str, float]]
+            # the most selective query tokens first, to keep the candidate set small
+            per_token = []
+            for n, token in enumerate(tokens):
+                matches = self._matches(token, prefix=n == len(tokens) - 1)
+                per_token.append((sum(len(self._postings[m]) for m, _ in matches), matches))
+            per_token.sort(key=lambda x: x[0])
+
+            for _, matches in per_token:
+                best = dict()  # type: Dict[str, float]
+                for match, kind in matches:
+                    posting = self._postings[match]
+                    # intersect in C rather than probing every key of the posting
+                    if scored is None and not best:
+                        best = {key: kind * weight for key, weight in posting.items()}
+                        continue
+                    keys = posting.keys() if scored is None else scored.keys() & posting.keys()
+                    for key in keys:
+                        score = kind * posting[key]
+                        if score > best.get(key, 0):
+                            best[key] = score
+                scored = best if scored is None else {key: scored[key] + score
+                                                      for key, score in best.items()}
+                if not scored:
+                    return []
+
+            # ties are ordered by name_seq_nr. Both sorts run in C and the second is stable
+            top = sorted(sorted(scored), key=scored.__getitem__, reverse=True)[:limit]
+            return [(scored[key], self._restaurants[key]) for key in top]
+
+
+arg_parser = ArgumentParser(description='Search restaurants by name, address, franchise or city')
+arg_parser.add_argument('query', type=str, nargs='+', help='search terms')
+arg_parser.add_argument('--file', '-f', type=str, default=None,
+                        help='smiley XML to search, default: the smiley JSON of the last run')
+arg_parser.add_argument('--limit', '-l', type=int, default=10, help='amount of results')
+
+
+def load(path: Optional[str]) -> RestaurantCatalog:
+    """
+    The pre-filtered restaurants of the smiley XML at :param path, or of the smiley JSON written
+    by the last run
+    """
+    if path:
+        return SmileyExtractor(path, False).create_smiley_json()
+
+    catalog = RestaurantCatalog()
+    with open(DataHandler.SMILEY_JSON, 'r') as f:
+        catalog.add_many([Restaurant.from_json(row) for row in json.loads(f.read())])
+    return catalog
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = arg_parser.parse_args(argv)
+    if not args.file and not os.path.isfile(DataHandler.SMILEY_JSON):
+        print(f'{DataHandler.SMILEY_JSON} not found, run filter_xml first or pass --file')
+        return 1
+
+    index = SearchIndex()
+    index.update(load(args.file))
+
+    query = ' '.join(args.query)
+    start = time.perf_counter()
+    results = index.search(query, args.limit)
+    elapsed = time.perf_counter() - start
+
+    for score, res in results:
+        print(f'{score:5.2f}  {res.name_seq_nr:<8} {res.name} - {res.address}, {res.zip_code} '
+              f'{res.city}' + (f' ({res.franchise_name})' if res.franchise_name else ''))
+    print(f'{len(results)} results of {len(index)} restaurants in {elapsed * 1000:.2f}ms')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
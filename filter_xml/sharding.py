@@ -0,0 +1,198 @@
+import glob
+import json
+import multiprocessing
+import os
+import zlib
+
+from typing import Iterable, List
+from filter_xml import http_client
+from filter_xml.blacklist import Blacklist
+from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.config import FilterXMLConfig
+from filter_xml.data_processor import DataProcessor
+from filter_xml.filters import Filters, FilterLog, PostFilters
+from filter_xml.metrics import Metrics
+from filter_xml.profiling import Profiler
+from filter_xml.temp_file import TempFile
+
+
+def shard_of(seq_nr: str, shards: int) -> int:
+    """
+    Determine the shard of a restaurant from its sequence number. Uses crc32 rather than hash(),
+    as the latter is salted per process and thus not stable across a crash
+    """
+    return zlib.crc32(str(seq_nr).encode('utf-8')) % shards
+
+
+class ShardedProcessor:
+    """
+    Runs the enrichment of a DataProcessor in several processes.
+
+    The pre-filtered catalog is partitioned by a hash of name_seq_nr, and every shard is enriched
+    in its own process with its own temp file, filter log and share of the CVR provider rate
+    limit. Once every shard is done, the results are merged into a single RestaurantCatalog,
+    which is diffed and sent to the outputter by the parent process.
+
+    A shard writes a done marker once it finishes. After a crash only the shards without a marker
+    are restarted, and those resume from their own temp file.
+    """
+    MANIFEST = 'shards.json'
+    TEMP_FILE = 'temp_shard_{}.json'
+    DONE_FILE = 'temp_shard_{}.done'
+    LOG_FILE = 'filter_log_shard_{}.json'
+    METRICS_FILE = 'metrics_shard_{}.json'
+    CASSETTE_SUFFIX = '.shard{}'
+
+    def __init__(self, processor: DataProcessor, workers: int):
+        if workers < 2:
+            raise ValueError(f'sharding needs at least two workers, got {workers}')
+
+        self.processor = processor
+        self.workers = workers
+
+    def process_smiley_json(self, data: Iterable[Restaurant]) -> None:
+        """
+        Enrich :param data in self.workers processes, then merge and output the results
+        """
+        self._check_manifest()
+
+        shards = [[] for _ in range(self.workers)]  # type: List[List[Restaurant]]
+        for restaurant in data:
+            shards[shard_of(restaurant.name_seq_nr, self.workers)].append(restaurant)
+
+        pending = [i for i in range(self.workers) if not os.path.isfile(self.DONE_FILE.format(i))]
+        if len(pending) < self.workers:
+            print(f'Resuming {len(pending)} of {self.workers} shards')
+
+        if pending:
+            # e.g. the bulk export of the CVR provider, which every shard inherits
+            self.processor.prepare()
+
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=self._run_shard, args=(i, shards[i]),
+                                     name=f'shard-{i}')
+                     for i in pending]
+        del shards
+
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        self._merge_cassettes(pending)
+        self._merge_metrics(pending)
+
+        failed = [p.name for p in processes if p.exitcode != 0]
+        if failed:
+            print(f'Shards failed: {", ".join(failed)}. Run again with --workers {self.workers} '
+                  f'to resume them')
+            return
+
+        res = RestaurantCatalog()
+        for i in range(self.workers):
+            res.add_many(TempFile(self.TEMP_FILE.format(i)).get_all().catalog)
+
+        self._merge_filter_logs()
+        self.processor.output(res)
+
+        self._clean()
+        Blacklist.close_file()
+
+    def discard_progress(self) -> None:
+        """
+        Remove every file of a crashed sharded run, such that every restaurant is processed again
+        """
+        self.processor.discard_progress()
+        self._clean()
+
+    def _run_shard(self, shard: int, rows: List[Restaurant]) -> None:
+        """
+        Process target, enriching a single shard
+        """
+        http_client.fork_client(self.CASSETTE_SUFFIX.format(shard))
+        Metrics.reset()
+        Profiler.reset()
+        Profiler.set_prefix(f'shard{shard}.')
+
+        FilterLog.LOG_FILE = self.LOG_FILE.format(shard)
+        Filters.LOGGER = FilterLog()
+        self.processor.post_filters = PostFilters()
+        self.processor.share(self.workers)
+
+        print(f'Shard {shard}: processing {len(rows)} rows')
+        try:
+            self.processor.enrich(rows, TempFile(self.TEMP_FILE.format(shard)))
+        finally:
+            Metrics.write(self.METRICS_FILE.format(shard), '')
+            Profiler.write()
+
+        http_client.get_client().close()
+        Blacklist.close_file()
+
+        with open(self.DONE_FILE.format(shard), 'w') as f:
+            f.write('done')
+
+    def _merge_metrics(self, shards: List[int]) -> None:
+        """
+        Add the metrics recorded by every shard to the metrics of the parent process
+        """
+        for i in shards:
+            path = self.METRICS_FILE.format(i)
+            if os.path.isfile(path):
+                Metrics.merge(path)
+                os.remove(path)
+
+    def _check_manifest(self) -> None:
+        """
+        Ensure that a crashed sharded run is resumed with the same amount of workers, as the
+        partitioning depends on it
+        """
+        if os.path.isfile(self.MANIFEST):
+            with open(self.MANIFEST, 'r') as f:
+                workers = json.loads(f.read())['workers']
+            if workers != self.workers:
+                raise ValueError(f'a sharded run with {workers} workers was not finished, resume '
+                                 f'it with --workers {workers} or remove it with --clean')
+        else:
+            with open(self.MANIFEST, 'w') as f:
+                f.write(json.dumps({'workers': self.workers}))
+
+    def _merge_filter_logs(self) -> None:
+        """
+        Add the post filter counts of every shard to the main filter log
+        """
+        for i in range(self.workers):
+            path = self.LOG_FILE.format(i)
+            if not os.path.isfile(path):
+                continue
+            with open(path, 'r') as f:
+                log = json.loads(f.read())['log']
+            for key in PostFilters.LOG:
+                Filters.LOGGER[key] = Filters.LOGGER[key] + log.get(key, 0) \
+                    if key in Filters.LOGGER else log.get(key, 0)
+
+    def _merge_cassettes(self, shards: List[int]) -> None:
+        """
+        Merge the responses recorded by every shard into the main cassette
+        """
+        client = http_client.get_client()
+        if client.mode != 'record':
+            return
+
+        for i in shards:
+            path = f'{FilterXMLConfig.http_cassette()}{self.CASSETTE_SUFFIX.format(i)}'
+            if os.path.isfile(path):
+                client.cassette.merge(path)
+                os.remove(path)
+        client.cassette.save()
+
+    def _clean(self) -> None:
+        """
+        Remove every file belonging to the sharded run
+        """
+        patterns = [self.TEMP_FILE, self.DONE_FILE, self.LOG_FILE]
+        paths = [path for pattern in patterns for path in glob.glob(pattern.format('*'))]
+
+        for path in paths + [self.MANIFEST]:
+            if os.path.isfile(path):
+                os.remove(path)
@@ -1,7 +1,11 @@
+import time
+
 from xml.etree import ElementTree as ET
-from requests import get
+from typing import Iterator, Optional
+from filter_xml.http_client import get
 from filter_xml.filters import PreFilters
 from filter_xml.catalog import Restaurant, RestaurantCatalog
+from filter_xml.metrics import Metrics
 
 
 class SmileyExtractor:
@@ -19,31 +23,79 @@ class SmileyExtractor:
         """
         Create .json file from smiley XML data from Fødevarestyrelsen.
         """
+        catalog = RestaurantCatalog()
+
+        for restaurant in self.iter_restaurants():
+            catalog.add(restaurant)
+
+        return catalog
+
+    def iter_restaurants(self) -> Iterator[Restaurant]:
+        """
+        Stream restaurants that pass all pre filters from the smiley XML. Rows are parsed one at a
+        time and discarded once converted, such that the full XML tree is never held in memory.
+
+        Pre-filters are run on the raw rows first, cf. PreFilters.accepts_row(), so only rows that
+        pass are constructed into restaurants. Parsing and pre-filtering are timed per row,
+        excluding the time spent by the consumer.
+        """
         if self.should_get_xml:
-            self._retrieve_smiley_data()
+            with Metrics.stage('xml_download'):
+                self.retrieve_smiley_data()
         print("Parsing the smiley file.")
-        tree = ET.parse(self.smiley_xml)
-        root = tree.getroot()
 
-        catalog = RestaurantCatalog()
+        start = time.perf_counter()
+        for _, row in ET.iterparse(self.smiley_xml):
+            if row.tag != 'row':
+                continue
 
-        for row in list(root):
-            new_obj = Restaurant.from_xml({col.tag: col.text for col in row})
+            fields = {col.tag: col.text for col in row}
+            row.clear()
+            parsed = time.perf_counter()
+            # run all pre filters, and only construct the restaurant if they pass
+            passed = self.pre_filters.accepts_row(fields)
+            filtered = time.perf_counter()
+            new_obj = Restaurant.from_xml(fields) if passed else None
+            constructed = time.perf_counter()
+            passed = passed and self.pre_filters.filter(new_obj, row_filtered=True)
 
-            # run all pre filters and skip if all does not pass
-            if not self.pre_filters.filter(new_obj):
-                continue
+            done = time.perf_counter()
+
+            Metrics.observe('xml_parse', (parsed - start) + (constructed - filtered))
+            Metrics.observe('pre_filters', (filtered - parsed) + (done - constructed))
 
-            catalog.add(new_obj)
+            if passed:
+                yield new_obj
+            start = time.perf_counter()
 
         self.pre_filters.log_filters()
-        return catalog
 
-    def _retrieve_smiley_data(self) -> None:
+    def retrieve_smiley_data(self, validators: Optional[dict] = None) -> dict:
         """
         Download smiley XML data from Fødevarestyrelsen.
+
+        With :param validators, as returned by a previous download of the same file, the file is
+        only downloaded if it has been modified since. Returns the validators of the file
         """
+        headers = {}
+        if validators and validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators and validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
         print("Downloading a new smiley file.")
-        res = get(self.SMILEY_XML_URL)
-        with open(self.smiley_xml, 'w') as f:
-            f.write(res.content.decode('utf-8'))
+        res = get(self.SMILEY_XML_URL, headers=headers)
+        Metrics.cache('smiley_xml', res.status_code == 304)
+
+        if res.status_code == 304:
+            print("Smiley file not modified since last download.")
+            return validators
+
+        with open(self.smiley_xml, 'wb') as f:
+            f.write(res.content)
+
+        return {
+            'url': self.SMILEY_XML_URL,
+            'etag': res.headers.get('ETag'),
+            'last_modified': res.headers.get('Last-Modified')
+        }
@@ -0,0 +1,189 @@
+import heapq
+import math
+
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+EARTH_RADIUS = 6371008.8
+METERS_PER_DEGREE = math.pi * EARTH_RADIUS / 180
+
+
+def haversine(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """
+    Great-circle distance in meters between two coordinates given in degrees
+    """
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lng2 - lng1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distance_from(lat: float, lng: float) -> Callable[[float, float], float]:
+    """
+    haversine() from a fixed point, for measuring many distances from the same point. The terms
+    that only depend on the fixed point are computed once
+    """
+    phi1 = math.radians(lat)
+    cos_phi1 = math.cos(phi1)
+    radians, sin, cos, asin, sqrt = math.radians, math.sin, math.cos, math.asin, math.sqrt
+
+    def distance(lat2: float, lng2: float) -> float:
+        phi2 = radians(lat2)
+        a = sin((phi2 - phi1) / 2) ** 2 + cos_phi1 * cos(phi2) * sin(radians(lng2 - lng) / 2) ** 2
+        return 2 * EARTH_RADIUS * asin(sqrt(a) if a < 1 else 1.0)
+
+    return distance
+
+
+class GridIndex:
+    """
+    Spatial index of points on a grid of :param cell_size degrees.
+
+    Every key is kept in the cell containing its point, so adding, moving and removing a key are
+    constant time, which allows the index to be updated incrementally.
+        >>> index = GridIndex(0.0025)
+        >>> index.add('81615', 55.6786, 12.5635)
+        >>> index.radius(55.68, 12.56, 500)
+        [(269.0..., '81615')]
+        >>> index.nearest(56.0, 10.0, 1)
+        [(163990.1..., '81615')]
+    """
+
+    def __init__(self, cell_size: float = 0.0025):
+        self.cell_size = cell_size
+        self._cells = dict()  # type: Dict[Tuple[int, int], Set[str]]
+        self._points = dict()  # type: Dict[str, Tuple[float, float]]
+        # bounds of every cell that has held a key, never shrunk on removal
+        self._bounds = None  # type: Optional[Tuple[int, int, int, int]]
+
+    def __len__(self) -> int:
+        return len(self._points)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._points
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def add(self, key: str, lat: float, lng: float) -> None:
+        """
+        Add :param key at the given point, moving it if it is already in the index
+        """
+        if key in self._points:
+            self.remove(key)
+        self._points[key] = (lat, lng)
+        cell = self._cell(lat, lng)
+        self._cells.setdefault(cell, set()).add(key)
+
+        if self._bounds is None:
+            self._bounds = (cell[0], cell[0], cell[1], cell[1])
+        else:
+            min_i, max_i, min_j, max_j = self._bounds
+            self._bounds = (min(min_i, cell[0]), max(max_i, cell[0]),
+                            min(min_j, cell[1]), max(max_j, cell[1]))
+
+    def remove(self, key: str) -> None:
+        point = self._points.pop(key, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        self._cells[cell].discard(key)
+        if not self._cells[cell]:
+            del self._cells[cell]
+
+    def radius(self, lat: float, lng: float, meters: float) -> List[Tuple[float, str]]:
+        """
+        Every key within :param meters of the point, as (distance in meters, key), nearest first
+        """
+        d_lat = meters / METERS_PER_DEGREE
+        # the widest longitude span of the circle, which is slightly poleward of its center
+        ratio = math.sin(meters / EARTH_RADIUS) / max(math.cos(math.radians(lat)), 1e-12)
+        d_lng = math.degrees(math.asin(ratio)) if ratio < 1 else 180.0
+        min_cell = self._cell(lat - d_lat, lng - d_lng)
+        max_cell = self._cell(lat + d_lat, lng + d_lng)
+
+        min_lat, max_lat, min_lng, max_lng = lat - d_lat, lat + d_lat, lng - d_lng, lng + d_lng
+        distance_to = distance_from(lat, lng)
+        cells, points = self._cells, self._points
+
+        found = []
+        for i in range(min_cell[0], max_cell[0] + 1):
+            for j in range(min_cell[1], max_cell[1] + 1):
+                for key in cells.get((i, j), ()):
+                    point_lat, point_lng = points[key]
+                    # points outside the bounding box of the circle are never within it
+                    if not (min_lat <= point_lat <= max_lat and min_lng <= point_lng <= max_lng):
+                        continue
+                    distance = distance_to(point_lat, point_lng)
+                    if distance <= meters:
+                        found.append((distance, key))
+        found.sort()
+        return found
+
+    def nearest(self, lat: float, lng: float, k: int) -> List[Tuple[float, str]]:
+        """
+        The :param k keys nearest to the point, as (distance in meters, key), nearest first.
+
+        Searches rings of cells around the cell of the point, and stops once no cell in the next
+        ring can be closer than the k-th nearest key found so far. Far from every key, where more
+        cells than keys would have to be searched, every key is scanned instead
+        """
+        if k <= 0 or not self._points:
+            return []
+
+        center = self._cell(lat, lng)
+        # the smallest extent of a cell in meters, bounding the distance to the next ring
+        cos_lat = max(math.cos(math.radians(abs(lat) + self.cell_size)), 1e-6)
+        cell_meters = self.cell_size * METERS_PER_DEGREE * cos_lat
+
+        # skip the empty rings between a point outside the bounds and the nearest occupied cell
+        min_i, max_i, min_j, max_j = self._bounds
+        ring = max(min_i - center[0], center[0] - max_i, min_j - center[1], center[1] - max_j, 0)
+
+        distance_to = distance_from(lat, lng)
+        heap = []  # type: List[Tuple[float, str]]
+        seen = 0
+        cells = 0
+        while seen < len(self._points):
+            cells += max(8 * ring, 1)
+            if cells > len(self._points):
+                return self._scan(lat, lng, k)
+
+            for cell in self._ring(center, ring):
+                for key in self._cells.get(cell, ()):
+                    seen += 1
+                    entry = (-distance_to(*self._points[key]), key)
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+            if len(heap) == k and -heap[0][0] <= ring * cell_meters:
+                break
+            ring += 1
+
+        return sorted((-distance, key) for distance, key in heap)
+
+    def _scan(self, lat: float, lng: float, k: int) -> List[Tuple[float, str]]:
+        distance_to = distance_from(lat, lng)
+        return heapq.nsmallest(k, ((distance_to(*point), key)
+                                   for key, point in self._points.items()))
+
+    @staticmethod
+    def _ring(center: Tuple[int, int], ring: int) -> Iterator[Tuple[int, int]]:
+        """
+        Cells at Chebyshev distance :param ring from :param center
+        """
+        ci, cj = center
+        if ring == 0:
+            yield center
+            return
+        for j in range(cj - ring, cj + ring + 1):
+            yield ci - ring, j
+            yield ci + ring, j
+        for i in range(ci - ring + 1, ci + ring):
+            yield i, cj - ring
+            yield i, cj + ring
+
+    def point(self, key: str) -> Optional[Tuple[float, float]]:
+        return self._points.get(key)
@@ -0,0 +1,327 @@
+from __future__ import annotations
+
+import base64
+import gzip
+import json
+import threading
+import zlib
+
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, List, Optional, Type
+from urllib.parse import parse_qs
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    """
+    Base request handler for local stand-in servers
+    """
+
+    def log_message(self, format: str, *args) -> None:
+        # keep benchmark output free of per-request log lines
+        return
+
+    def _read_json(self):
+        """
+        Read the request body as JSON, decompressing gzip encoded bodies
+        """
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if body and self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return json.loads(body.decode('utf-8')) if body else None
+
+    def _send_json(self, data, status: int = 200, headers: Optional[dict] = None) -> None:
+        """
+        Send :param data as a JSON response
+        """
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class ElasticStandIn(_StandInHandler):
+    """
+    Stand-in for the Virk CVR elastic search endpoint used by filter_xml.cvr.CVRHandlerElastic.
+
+    Answers 'terms' queries on VrproduktionsEnhed.pNummer. Production units are taken from
+    ElasticStandIn.FIXTURES if present, and are otherwise generated deterministically from the
+    p-number, such that repeated runs see the same data.
+
+    Requests with a 'scroll' parameter export the production units of FIXTURES and PNRS that
+    match a query of bool, terms and exists clauses, optionally sliced, page by page through
+    /_search/scroll. Scroll ids carry the position of the scroll rather than referring to server
+    state, such that recorded exports replay deterministically.
+    """
+    INDUSTRIES = [('561010', 'Restauranter'),
+                  ('561020', 'Pizzeriaer, grillbarer, isbarer m.v.'),
+                  ('563000', 'Cafeer, værtshuse, diskoteker m.v.'),
+                  ('471100', 'Supermarkeder'),
+                  ('107120', 'Bagerier')]
+
+    FIXTURES = {}  # type: Dict[str, dict]
+    # p-numbers of the production units served by scrolling exports, along with FIXTURES
+    PNRS = []  # type: List[str]
+
+    def do_POST(self) -> None:
+        query = self._read_json() or {}
+        path, _, params = self.path.partition('?')
+        if path.endswith('/_search/scroll'):
+            return self._send_page(query.get('scroll_id', ''))
+        if 'scroll' in parse_qs(params):
+            return self._send_page(self._scroll_id(query, 0))
+
+        pnrs = query.get('query', {}).get('terms', {}).get('VrproduktionsEnhed.pNummer', [])
+        size = query.get('size', 10)
+
+        hits = [{'_source': {'VrproduktionsEnhed': self.production_unit(str(pnr))}}
+                for pnr in pnrs[:size]]
+
+        self._send_json({'hits': {'total': len(hits), 'hits': hits}})
+
+    def do_DELETE(self) -> None:
+        # scrolls keep no server state
+        self._read_json()
+        self._send_json({'succeeded': True})
+
+    @staticmethod
+    def _scroll_id(query: dict, offset: int) -> str:
+        state = {key: query.get(key) for key in ['query', 'slice', 'size']}
+        state['offset'] = offset
+        return base64.urlsafe_b64encode(json.dumps(state).encode('utf-8')).decode('ascii')
+
+    def _send_page(self, scroll_id: str) -> None:
+        """
+        Send the page of the scroll at :param scroll_id
+        """
+        try:
+            state = json.loads(base64.urlsafe_b64decode(scroll_id.encode('ascii')))
+        except ValueError:
+            return self._send_json({'error': 'unknown scroll id'}, status=404)
+
+        sliced = state['slice'] or {'id': 0, 'max': 1}
+        pnrs = sorted(set(self.FIXTURES) | set(self.PNRS))
+        units = [unit for unit in (self.production_unit(pnr) for pnr in pnrs
+                                   if zlib.crc32(pnr.encode('utf-8')) % sliced['max']
+                                   == sliced['id'])
+                 if self.matches({'VrproduktionsEnhed': unit}, state['query'])]
+
+        offset, size = state['offset'], state['size'] or 10
+        hits = [{'_source': {'VrproduktionsEnhed': unit}} for unit in units[offset:offset + size]]
+        self._send_json({'_scroll_id': self._scroll_id(state, offset + len(hits)),
+                         'hits': {'total': len(units), 'hits': hits}})
+
+    @classmethod
+    def matches(cls, document: dict, query: Optional[dict]) -> bool:
+        """
+        Whether :param document matches :param query, of bool (filter, must, must_not), terms
+        and exists clauses
+        """
+        if not query:
+            return True
+        if 'bool' in query:
+            clauses = query['bool']
+            return (all(cls.matches(document, q)
+                        for q in clauses.get('filter', []) + clauses.get('must', []))
+                    and not any(cls.matches(document, q) for q in clauses.get('must_not', [])))
+        if 'terms' in query:
+            (field, terms), = query['terms'].items()
+            return any(str(value) in map(str, terms) for value in cls._values(document, field))
+        if 'exists' in query:
+            values = cls._values(document, query['exists']['field'])
+            return any(value is not None for value in values)
+        raise ValueError(f'unsupported query {query}')
+
+    @staticmethod
+    def _values(document: dict, field: str) -> list:
+        """
+        Values of the dotted :param field in :param document, through lists
+        """
+        values = [document]
+        for key in field.split('.'):
+            values = [value[key] for value in values if isinstance(value, dict) and key in value]
+            values = [item for value in values
+                      for item in (value if isinstance(value, list) else [value])]
+        return values
+
+    @classmethod
+    def production_unit(cls, pnr: str) -> dict:
+        """
+        Retrieve the production unit for :param pnr, in the format returned by Virk
+        """
+        if pnr in cls.FIXTURES:
+            return cls.FIXTURES[pnr]
+
+        seed = zlib.crc32(pnr.encode('utf-8'))
+        code, text = cls.INDUSTRIES[seed % len(cls.INDUSTRIES)]
+        start = datetime(1990, 1, 1) + timedelta(days=seed % 10000)
+        # roughly one in twenty production units has ceased
+        end = start + timedelta(days=365) if seed % 20 == 0 else None
+
+        return {
+            'pNummer': int(pnr) if pnr.isdigit() else pnr,
+            'livsforloeb': [{
+                'periode': {
+                    'gyldigFra': start.strftime('%Y-%m-%d'),
+                    'gyldigTil': end.strftime('%Y-%m-%d') if end else None
+                }
+            }],
+            'produktionsEnhedMetadata': {
+                'nyesteHovedbranche': {
+                    'branchekode': code,
+                    'branchetekst': text
+                }
+            }
+        }
+
+
+class DataEndpointStandIn(_StandInHandler):
+    """
+    Stand-in for the /admin/load data endpoint used by filter_xml.data_outputter.
+
+    Keeps the pushed restaurants in memory, indexed by name_seq_nr.
+        GET     retrieve all restaurants
+        POST    insert restaurants
+        PUT     update restaurants
+        PATCH   apply patches to restaurants, cf. filter_xml.catalog.Restaurant.patch()
+        DELETE  delete restaurants by name_seq_nr
+        HEAD    retrieve the data version only
+
+    Every response carries the token of the last applied write as X-Data-Version. Request bodies
+    may be gzip encoded. A request carrying an Idempotency-Key that has already been applied is
+    answered with the original response without being applied again.
+    The first FAIL_REQUESTS requests are answered with 503 before being applied, to test retries.
+    """
+    RESTAURANTS = {}  # type: Dict[str, dict]
+    IDEMPOTENCY = {}  # type: Dict[str, dict]
+    FAIL_REQUESTS = 0
+    REQUESTS = 0
+    VERSION = None  # type: Optional[str]
+    LOCK = threading.Lock()
+
+    @classmethod
+    def reset(cls) -> None:
+        """
+        Forget every stored restaurant, idempotency key and injected failure
+        """
+        with cls.LOCK:
+            cls.RESTAURANTS = {}
+            cls.IDEMPOTENCY = {}
+            cls.FAIL_REQUESTS = 0
+            cls.REQUESTS = 0
+            cls.VERSION = None
+
+    def do_HEAD(self) -> None:
+        self.send_response(200)
+        for key, value in self._version_headers().items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        with self.LOCK:
+            data = list(self.RESTAURANTS.values())
+        self._send_json(data, headers=self._version_headers())
+
+    def do_POST(self) -> None:
+        self._apply(self._store)
+
+    def do_PUT(self) -> None:
+        self._apply(self._store)
+
+    def do_PATCH(self) -> None:
+        self._apply(self._patch)
+
+    def do_DELETE(self) -> None:
+        self._apply(self._delete)
+
+    def _apply(self, fun) -> None:
+        """
+        Apply :param fun to the request body, honouring idempotency keys and injected failures
+        """
+        body = self._read_json()
+        key = self.headers.get('Idempotency-Key')
+
+        with self.LOCK:
+            DataEndpointStandIn.REQUESTS += 1
+            if DataEndpointStandIn.FAIL_REQUESTS > 0:
+                DataEndpointStandIn.FAIL_REQUESTS -= 1
+                response = None
+            elif key and key in self.IDEMPOTENCY:
+                response = self.IDEMPOTENCY[key]
+            else:
+                response = fun(body)
+                DataEndpointStandIn.VERSION = body['timestamp']
+                if key:
+                    self.IDEMPOTENCY[key] = response
+
+        if response is None:
+            self._send_json({'error': 'unavailable'}, status=503)
+        else:
+            self._send_json(response, headers=self._version_headers())
+
+    def _version_headers(self) -> dict:
+        version = DataEndpointStandIn.VERSION
+        return {'X-Data-Version': version} if version else {}
+
+    def _store(self, body: dict) -> dict:
+        for row in body['data']:
+            self.RESTAURANTS[row['name_seq_nr']] = row
+        return {'stored': len(body['data'])}
+
+    def _patch(self, body: dict) -> dict:
+        for patch in body['data']:
+            row = self.RESTAURANTS.setdefault(patch['name_seq_nr'],
+                                              {'name_seq_nr': patch['name_seq_nr']})
+            row.update(patch['set'])
+            if 'reports' in patch:
+                row['smiley_reports'] = patch['reports']
+                continue
+
+            removed = [[r[1], r[2]] for r in patch['remove_reports']]
+            row['smiley_reports'] = [r for r in row.get('smiley_reports', [])
+                                     if [r['smiley'], r['date']] not in removed]
+            row['smiley_reports'] = sorted(row['smiley_reports'] + patch['add_reports'],
+                                           key=lambda r: r['date'], reverse=True)
+        return {'patched': len(body['data'])}
+
+    def _delete(self, body: dict) -> dict:
+        for seq_nr in body['data']:
+            self.RESTAURANTS.pop(seq_nr, None)
+        return {'deleted': len(body['data'])}
+
+
+class StandInServer:
+    """
+    Runs a stand-in request handler on a local port in a background thread.
+
+    Use port 0 to let the OS pick a free port, which is then available as self.port
+        >>> server = StandInServer(DataEndpointStandIn, 0).start()
+        >>> server.url('/admin/load')
+        'http://127.0.0.1:41234/admin/load'
+        >>> server.stop()
+    """
+
+    def __init__(self, handler: Type[BaseHTTPRequestHandler], port: int,
+                 host: str = '127.0.0.1'):
+        self.handler = handler
+        self._server = ThreadingHTTPServer((host, port), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self.host = host
+        self.port = self._server.server_address[1]
+
+    def url(self, path: str = '/') -> str:
+        return f'http://{self.host}:{self.port}{path}'
+
+    def start(self) -> StandInServer:
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -15,8 +15,9 @@ class TempFile:
     """
     FILE_NAME = "temp.json"
 
-    def __init__(self) -> None:
-        file_exists = os.path.exists(self.FILE_NAME)
+    def __init__(self, file_name: str = FILE_NAME) -> None:
+        self.file_name = file_name
+        file_exists = os.path.exists(self.file_name)
 
         self.__data = dict()
 
@@ -30,7 +31,7 @@ class TempFile:
 
         out = dict()
 
-        with open(self.FILE_NAME) as json_file:
+        with open(self.file_name) as json_file:
             data = json.load(json_file)
             
             for entry in data:
@@ -56,14 +57,15 @@ class TempFile:
         self._write_json(data_to_dump)
 
     def _write_json(self, data: list):
-        with open(self.FILE_NAME, 'w') as json_file:
+        with open(self.file_name, 'w') as json_file:
             json.dump(data, json_file)
 
     def close(self) -> None:
         """
         Finish the current session by deleting the temp file
         """
-        os.remove(self.FILE_NAME)
+        if os.path.exists(self.file_name):
+            os.remove(self.file_name)
 
     def contains(self, seq_nr: str) -> bool:
         """
@@ -1,18 +1,115 @@
-import os
+import threading
+import time
+import unicodedata
 
-from datetime import datetime
-from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional
 
+# Danish letters are spelled out rather than stripped, such that Århus and Aarhus are the same
+_DANISH = str.maketrans({'æ': 'ae', 'ø': 'oe', 'å': 'aa', 'ä': 'ae', 'ö': 'oe', 'ü': 'ue'})
 
-def is_file_old(path: str) -> bool:
+
+def normalise(text: str) -> str:
+    """
+    Lower case :param text, spell out æ, ø and å as ae, oe and aa, and strip every other
+    diacritic, e.g. 'Café Ærø' -> 'cafe aeroe'
+    """
+    text = text.casefold().translate(_DANISH)
+    return ''.join(c for c in unicodedata.normalize('NFKD', text) if not unicodedata.combining(c))
+
+
+class RateLimiter:
     """
-    Check whether or not a file defined by :param path is modified today
+    Ensures that at least :param interval seconds pass between consecutive calls to wait(),
+    across every thread sharing the limiter. The first call never waits.
     """
-    if not os.path.isfile(path):
-        return True
 
-    f_stat = Path(path).stat()
-    m_stamp = datetime.fromtimestamp(f_stat.st_mtime)
-    now = datetime.now()
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        """
+        Block until the next call is allowed
+        """
+        if self.interval <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+
+        if delay > 0:
+            time.sleep(delay)
+
+
+class _Call:
+    __slots__ = ['done', 'result', 'error']
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None  # type: Optional[BaseException]
+
+
+class SingleFlight:
+    """
+    Coalesces identical calls, e.g. requests for the same p-number. The first call for a key
+    runs, calls for the same key made meanwhile wait for it and share its result, and later calls
+    are answered from the result as well. A failed call is raised in every waiting thread, but
+    not remembered, such that the next call for the key runs again.
+        >>> flight = SingleFlight()
+        >>> flight.do('1019551292', lambda: lookup('1019551292'))
+        >>> flight.saved
+        0
+
+    Results are kept for the lifetime of the instance, so keep results small and use a new
+    instance per run.
+    """
+
+    def __init__(self):
+        # amount of calls answered from a shared result
+        self.saved = 0
+        self._results = dict()  # type: Dict[Hashable, Any]
+        self._in_flight = dict()  # type: Dict[Hashable, _Call]
+        self._lock = threading.Lock()
+
+    def do(self, key: Hashable, fun: Callable[[], Any]) -> Any:
+        """
+        Return the result of :param fun, unless a call for :param key has already run, or is
+        running, in which case its result is returned instead. Calls without a key always run
+        """
+        if key is None:
+            return fun()
+
+        with self._lock:
+            if key in self._results:
+                self.saved += 1
+                return self._results[key]
+
+            call = self._in_flight.get(key)
+            leader = call is None
+            if leader:
+                call = self._in_flight[key] = _Call()
+            else:
+                self.saved += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
 
-    return now.date() != m_stamp.date()
\ No newline at end of file
+        try:
+            call.result = fun()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+                if call.error is None:
+                    self._results[key] = call.result
+            call.done.set()
+        return call.result
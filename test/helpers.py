@@ -0,0 +1,52 @@
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+from filter_xml.catalog import Restaurant, RestaurantCatalog, SmileyReport
+from filter_xml.cvr import CVRHandlerBase
+
+
+def restaurant(seq_nr: str, reports: Iterable[Tuple[Optional[int], Optional[datetime]]] = (),
+               **fields) -> Restaurant:
+    """
+    A restaurant with name_seq_nr :param seq_nr and a smiley report per (smiley, date) in
+    :param reports, in the given order. Every other field of Restaurant is set by keyword:
+        >>> restaurant('1', daily(2), name='Renamed', pnr='1234567890')
+    """
+    res = Restaurant()
+    res.name_seq_nr = seq_nr
+    for key, value in fields.items():
+        if key not in Restaurant.FIELDS:
+            raise AttributeError(f'Restaurant has no field {key}')
+        setattr(res, key, value)
+
+    for smiley, date in reports:
+        report = SmileyReport()
+        report.smiley, report.date = smiley, date
+        res.smiley_reports.append(report)
+    return res
+
+
+def daily(count: int, smiley: int = 1) -> List[Tuple[int, datetime]]:
+    """
+    :param count smiley reports, one per day of January 2021 and latest first, as in the smiley XML
+    """
+    return [(smiley, datetime(2021, 1, count - i)) for i in range(count)]
+
+
+def catalog(*restaurants: Restaurant) -> RestaurantCatalog:
+    cat = RestaurantCatalog()
+    cat.add_many(list(restaurants))
+    return cat
+
+
+class FixedCVRHandler(CVRHandlerBase):
+    """
+    Finds the industry code of every restaurant in a dict by p-number
+    """
+
+    def __init__(self, codes: dict):
+        super().__init__()
+        self.codes = codes
+
+    def collect_data(self, data: Restaurant) -> Restaurant:
+        data.industry_code = self.codes[data.pnr]
+        return super().collect_data(data)
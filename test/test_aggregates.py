@@ -0,0 +1,78 @@
+import unittest
+import os
+import tempfile
+
+from datetime import datetime
+from unittest import mock
+from filter_xml.aggregates import Aggregates
+from filter_xml.data_processor import DataProcessor
+from test.helpers import catalog, restaurant
+
+AARHUS = {'city': 'Aarhus C', 'zip_code': '8000', 'elite_smiley': '0'}
+ODENSE = {'city': 'Odense C', 'zip_code': '5000', 'elite_smiley': '0'}
+
+
+class AggregatesTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'aggregates.json')
+        self.restaurants = [
+            restaurant('1', [(2, datetime(2021, 1, 5)), (1, datetime(2021, 1, 3))],
+                       **dict(AARHUS, elite_smiley='1')),
+            restaurant('2', [(1, datetime(2021, 1, 9))], franchise_name='Netto', **AARHUS),
+            restaurant('3', franchise_name='Netto', **ODENSE)]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_statistics_use_latest_report(self):
+        aggregates = Aggregates(self.path)
+        aggregates.rebuild(catalog(*self.restaurants))
+
+        aarhus = aggregates.get('city', 'Aarhus C')
+
+        self.assertEqual(aarhus['restaurants'], 2)
+        self.assertEqual(aarhus['smileys'], {'1': 1, '2': 1})
+        self.assertEqual(aarhus['elite_share'], 0.5)
+        self.assertEqual(aarhus['latest_inspection'], '2021-01-09')
+        self.assertEqual(aggregates.get('franchise_name', 'Netto')['inspected'], 1)
+        self.assertIsNone(aggregates.get('zip_code', '9000'))
+
+    def test_incremental_update_matches_rebuild(self):
+        aggregates = Aggregates(self.path)
+        aggregates.rebuild(catalog(*self.restaurants))
+        aggregates.save()
+
+        new = catalog(self.restaurants[0], restaurant('2', [(4, datetime(2021, 1, 1))], **ODENSE),
+                      restaurant('4', [(1, datetime(2021, 1, 2))], **AARHUS))
+        loaded = Aggregates.load(self.path)
+        loaded.apply({res.name_seq_nr: res for res in new.catalog}, ['2', '4'], ['3'])
+        rebuilt = Aggregates(self.path)
+        rebuilt.rebuild(new)
+
+        for dimension in Aggregates.DIMENSIONS:
+            self.assertEqual(loaded.groups(dimension), rebuilt.groups(dimension))
+            for group in rebuilt.groups(dimension):
+                self.assertEqual(loaded.get(dimension, group), rebuilt.get(dimension, group))
+        # the most recent inspection in Aarhus C moved with restaurant 2
+        self.assertEqual(loaded.get('city', 'Aarhus C')['latest_inspection'], '2021-01-05')
+
+    def test_output_applies_diff_only_to_matching_aggregates(self):
+        old, new = catalog(*self.restaurants), catalog(*self.restaurants[:2])
+        new.setup_diff(old)
+
+        with mock.patch('filter_xml.aggregates.FilterXMLConfig.aggregates_path',
+                        return_value=self.path):
+            for previous, rebuilds in [(catalog(self.restaurants[0]), 1), (old, 0)]:
+                aggregates = Aggregates()
+                aggregates.rebuild(previous)
+                aggregates.save()
+
+                with mock.patch.object(Aggregates, 'rebuild',
+                                       side_effect=Aggregates.rebuild, autospec=True) as rebuild:
+                    DataProcessor._aggregate(new, [], ['3'], 'token')
+
+                self.assertEqual(rebuild.call_count, rebuilds)
+                self.assertEqual(Aggregates.load().ids(), {'1', '2'})
+                self.assertIsNone(Aggregates.load().get('city', 'Odense C'))
@@ -37,7 +37,8 @@ class BlacklistTest(unittest.TestCase):
 
     @classmethod
     def reset_blacklist_state(cls):
-        Blacklist._restaurants = []
+        Blacklist._restaurants = set()
+        Blacklist._loaded = False
         Blacklist._file_path = FILENAME
         Blacklist._file_writer = None
         Blacklist.close_file()
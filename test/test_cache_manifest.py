@@ -0,0 +1,46 @@
+import unittest
+import os
+
+from filter_xml.cache_manifest import CacheManifest
+
+MANIFEST = 'test/cache_manifest_test.json'
+ARTIFACT = 'test/cache_artifact_test.txt'
+
+
+class CacheManifestTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        with open(ARTIFACT, 'w') as f:
+            f.write('smiley')
+        self.manifest = CacheManifest(MANIFEST)
+
+    def tearDown(self) -> None:
+        for path in [MANIFEST, ARTIFACT]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_artifact_is_current_until_an_input_changes(self):
+        inputs = {'xml': self.manifest.digest(ARTIFACT), 'filters': 'v1'}
+        self.manifest.record('smiley_json', inputs)
+
+        reloaded = CacheManifest(MANIFEST)
+
+        self.assertTrue(reloaded.is_current('smiley_json', inputs, ARTIFACT))
+        self.assertFalse(reloaded.is_current('smiley_json', dict(inputs, filters='v2'), ARTIFACT))
+
+    def test_missing_artifact_is_not_current(self):
+        self.manifest.record('smiley_json', {})
+        os.remove(ARTIFACT)
+
+        self.assertFalse(self.manifest.is_current('smiley_json', {}, ARTIFACT))
+
+    def test_digest_follows_content(self):
+        before = self.manifest.digest(ARTIFACT)
+        with open(ARTIFACT, 'w') as f:
+            f.write('smileys')
+        # a different size, so the remembered digest is not used
+        self.assertNotEqual(self.manifest.digest(ARTIFACT), before)
+
+    def test_source_digest_differs_between_classes(self):
+        self.assertNotEqual(CacheManifest.source_digest(CacheManifest),
+                            CacheManifest.source_digest(CacheManifestTest))
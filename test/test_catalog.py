@@ -0,0 +1,45 @@
+import unittest
+
+from filter_xml.catalog import Restaurant, parse_date
+
+
+def xml_row(seq_nr: str, city: str) -> dict:
+    row = {key: None for key in ['cvrnr', 'pnr', 'region', 'brancheKode', 'branche', 'Elite_Smiley',
+                                 'Geo_Lat', 'Geo_Lng', 'Pixibranche', 'URL', 'adresse1', 'navn1',
+                                 'postnr', 'reklame_beskyttelse', 'virksomhedstype', 'Kaedenavn']}
+    for smiley, date in Restaurant.REPORT_KEYS:
+        row[smiley] = row[date] = None
+    row.update({'navnelbnr': seq_nr, 'By': city, 'seneste_kontrol': '1',
+                'seneste_kontrol_dato': '01-03-2021 00:00:00'})
+    return row
+
+
+class IngestionTest(unittest.TestCase):
+
+    def test_categorical_values_are_shared(self):
+        # build equal strings that are distinct objects, as parsed from separate rows
+        first = Restaurant.from_xml(xml_row('1', ''.join(['Aarhus', ' C'])))
+        second = Restaurant.from_xml(xml_row('2', ''.join(['Aarhus', ' C'])))
+
+        self.assertIs(first.city, second.city)
+
+    def test_report_dates_are_parsed_once(self):
+        parse_date.cache_clear()
+
+        first = Restaurant.from_xml(xml_row('1', 'Odense C'))
+        second = Restaurant.from_xml(xml_row('2', 'Odense C'))
+
+        self.assertEqual(parse_date.cache_info().misses, 1)
+        self.assertEqual(first.smiley_reports[0].date, second.smiley_reports[0].date)
+
+    def test_json_dates_are_decoded_lazily(self):
+        row = Restaurant.from_xml(xml_row('1', 'Odense C')).as_dict()
+        parse_date.cache_clear()
+
+        res = Restaurant.from_json(row)
+
+        # saved again without being parsed
+        self.assertEqual(res.as_dict(), row)
+        self.assertEqual(parse_date.cache_info().misses, 0)
+        self.assertEqual(res.smiley_reports[0].date.year, 2021)
+        self.assertEqual(parse_date.cache_info().misses, 1)
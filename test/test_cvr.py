@@ -0,0 +1,74 @@
+import unittest
+
+from unittest import mock
+from filter_xml.cvr import CVRHandlerElastic
+from filter_xml.filters import PostFilters
+from filter_xml.metrics import Metrics
+from filter_xml.stand_in import StandInServer, ElasticStandIn
+from test.helpers import restaurant
+
+
+
+class CVRHandlerElasticTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Metrics.reset()
+        self.pnrs = [str(1000000000 + i) for i in range(300)]
+        self.server = StandInServer(ElasticStandIn, 0).start()
+        self.patches = [
+            mock.patch.object(ElasticStandIn, 'PNRS', self.pnrs),
+            mock.patch.object(CVRHandlerElastic, 'URL',
+                              self.server.url('/cvr-permanent/produktionsenhed/_search')),
+            mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_slices', return_value=3),
+            mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_page_size',
+                       return_value=20),
+            mock.patch.object(PostFilters, 'LOGGER', {'industry_code': 0, 'end_date': 0})
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self) -> None:
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.server.stop()
+        Metrics.reset()
+
+    def enrich(self, bulk: bool) -> list:
+        with mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_bulk', return_value=bulk):
+            handler = CVRHandlerElastic()
+        restaurants = [restaurant(pnr, pnr=pnr) for pnr in self.pnrs]
+        handler.pre_processing(restaurants)
+        post_filters = PostFilters()
+        return [res.pnr for res in map(handler.collect_data, restaurants)
+                if post_filters.filter(res)]
+
+    def test_bulk_export_transfers_only_units_passing_post_filters(self):
+        expected = self.enrich(bulk=False)
+        looked_up = Metrics.counter('cvr_elastic.exported')
+
+        actual = self.enrich(bulk=True)
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(looked_up, 0)
+        # every page but the last of each slice is full, so the export paged through slices
+        self.assertEqual(Metrics.counter('cvr_elastic.exported'), len(expected))
+        self.assertGreater(len(expected), 3 * 20)
+        self.assertLess(len(expected), len(self.pnrs))
+
+    def test_failed_export_falls_back_to_lookup(self):
+        expected = self.enrich(bulk=False)
+
+        with mock.patch.object(CVRHandlerElastic, 'URL', self.server.url('/missing')), \
+                mock.patch.object(ElasticStandIn, '_send_page',
+                                  lambda handler, _: handler._send_json({}, status=503)):
+            with mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_bulk',
+                            return_value=True):
+                handler = CVRHandlerElastic()
+            restaurants = [restaurant(pnr, pnr=pnr) for pnr in self.pnrs]
+            handler.pre_processing(restaurants)
+
+        self.assertFalse(handler.bulk)
+        self.assertEqual(Metrics.counter('errors.cvr_elastic'), 3)
+        post_filters = PostFilters()
+        self.assertEqual([res.pnr for res in map(handler.collect_data, restaurants)
+                          if post_filters.filter(res)], expected)
@@ -0,0 +1,72 @@
+import unittest
+import os
+import tempfile
+
+from unittest import mock
+from filter_xml.daemon import Daemon
+from test.helpers import catalog, restaurant
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.directory.name, 'daemon.sock')
+        self.daemon = Daemon(mock.Mock(), interval=3600, socket_path=self.socket_path)
+
+    def tearDown(self) -> None:
+        self.daemon._stop_control()
+        self.directory.cleanup()
+
+    def test_split_enriches_only_changed_rows(self):
+        enriched = restaurant('1')
+        self.daemon._enriched = {'1': enriched}
+        self.daemon._sources = {'1': restaurant('1').fingerprint(),
+                                '2': restaurant('2').fingerprint(),
+                                '3': restaurant('3').fingerprint()}
+
+        current, sources, changed = self.daemon._split(
+            [restaurant('1'), restaurant('2'), restaurant('3', name='Renamed'), restaurant('4')])
+
+        # '2' was filtered while enriching and is unchanged, so it is skipped
+        self.assertEqual(current, {'1': enriched})
+        self.assertEqual([res.name_seq_nr for res in changed], ['3', '4'])
+        self.assertEqual(set(sources), {'1', '2', '3', '4'})
+
+    def test_control_socket_answers_commands(self):
+        self.daemon._serve_control()
+
+        status = Daemon.send('status', self.socket_path)
+        unknown = Daemon.send('unknown-command', self.socket_path)
+        Daemon.send('stop', self.socket_path)
+
+        self.assertEqual(status['state'], 'starting')
+        self.assertIn('error', unknown)
+        self.assertTrue(self.daemon._stopped.is_set())
+
+    def test_cycle_after_refresh_enriches_every_restaurant(self):
+        rows = [restaurant('1'), restaurant('2')]
+        self.daemon._enriched = {res.name_seq_nr: res for res in rows}
+        self.daemon._sources = {res.name_seq_nr: res.fingerprint() for res in rows}
+        self.daemon._digest = 'unchanged'
+
+        handler = self.daemon.handler
+        handler.should_get_xml = False
+        # a single cycle, with the same XML as the previous one
+        handler.manifest.digest.side_effect = lambda path: self.daemon.control('stop') and \
+            'unchanged'
+        self.daemon.processor.enrich.side_effect = lambda changed, temp_file: catalog(*changed)
+
+        self.daemon.control('refresh')
+        with mock.patch('filter_xml.daemon.SmileyExtractor') as extractor, \
+                mock.patch('filter_xml.daemon.TempFile'), \
+                mock.patch('filter_xml.daemon.Metrics'), \
+                mock.patch('filter_xml.daemon.Blacklist'):
+            extractor.return_value.iter_restaurants.return_value = iter(rows)
+            self.daemon.run()
+
+        changed = self.daemon.processor.enrich.call_args[0][0]
+        self.assertEqual([res.name_seq_nr for res in changed], ['1', '2'])
+        self.daemon.processor.output.assert_called_once()
+        self.assertEqual(self.daemon._status['cycles'], 1)
+        self.assertFalse(self.daemon._refresh.is_set())
@@ -0,0 +1,230 @@
+import unittest
+import gzip
+import importlib.util
+import json
+import os
+import shutil
+import tempfile
+
+from filter_xml import http_client
+from datetime import datetime
+from unittest import mock
+from filter_xml.data_outputter import DatabaseOutputter, FileOutputter, ParquetOutputter, \
+    ShardOutputter
+from filter_xml.http_client import HTTPClient
+from filter_xml.stand_in import StandInServer, DataEndpointStandIn
+from test.helpers import restaurant
+
+ROWS = [{'name_seq_nr': str(i), 'name': f'Restaurant {i}'} for i in range(10)]
+
+
+class DatabaseOutputterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        DataEndpointStandIn.reset()
+        self.server = StandInServer(DataEndpointStandIn, 0).start()
+        http_client._client = HTTPClient(mode='live')
+        # rows of failing chunks are written to file
+        self.directory = tempfile.TemporaryDirectory()
+        self.file_base = mock.patch.object(
+            FileOutputter, 'FILE_BASE', os.path.join(self.directory.name, 'processed_'))
+        self.file_base.start()
+
+        # roughly three rows per chunk
+        self.outputter = DatabaseOutputter(chunk_bytes=150, workers=2, retries=2, backoff=0)
+        self.outputter.ENDPOINT = self.server.url('/admin/load')
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        http_client._client = None
+        self.file_base.stop()
+        self.directory.cleanup()
+
+    def test_insert_is_sent_in_compressed_chunks(self):
+        self.outputter.insert(ROWS, 'token')
+
+        self.assertEqual(len(DataEndpointStandIn.RESTAURANTS), len(ROWS))
+        self.assertEqual(DataEndpointStandIn.REQUESTS, len(self.outputter._chunk(ROWS)))
+        self.assertGreater(DataEndpointStandIn.REQUESTS, 1)
+
+    def test_streamed_rows_are_spilled_in_chunks(self):
+        with self.outputter._chunk(row for row in ROWS) as chunks:
+            self.assertEqual(len(chunks), 4)
+            self.assertEqual(chunks[0], ','.join(json.dumps(row) for row in ROWS[:3]).encode())
+            self.assertEqual([row for i in range(len(chunks)) for row in chunks.rows(i)], ROWS)
+
+    def test_retry_resends_only_failed_chunks(self):
+        chunks = len(self.outputter._chunk(ROWS))
+        DataEndpointStandIn.FAIL_REQUESTS = 1
+
+        self.outputter.insert(ROWS, 'token')
+
+        self.assertEqual(DataEndpointStandIn.REQUESTS, chunks + 1)
+        self.assertEqual(len(DataEndpointStandIn.RESTAURANTS), len(ROWS))
+
+    def test_resent_chunk_is_applied_once(self):
+        self.outputter.insert(ROWS, 'token')
+        DataEndpointStandIn.RESTAURANTS.clear()
+
+        self.outputter.insert(ROWS, 'token')
+        self.assertEqual(len(DataEndpointStandIn.RESTAURANTS), 0)
+
+        self.outputter.insert(ROWS, 'another token')
+        self.assertEqual(len(DataEndpointStandIn.RESTAURANTS), len(ROWS))
+
+    def test_other_data_with_the_same_token_is_applied(self):
+        self.outputter.insert(ROWS, 'token')
+        renamed = [dict(row, name=f'Renamed {row["name_seq_nr"]}') for row in ROWS]
+
+        self.outputter.insert(renamed, 'token')
+
+        self.assertEqual(DataEndpointStandIn.RESTAURANTS,
+                         {row['name_seq_nr']: row for row in renamed})
+
+    def test_rows_of_failing_chunks_are_written_to_file(self):
+        self.outputter.retries = 0
+        DataEndpointStandIn.FAIL_REQUESTS = 1
+        self.outputter.workers = 1
+
+        self.outputter.insert(ROWS, 'token')
+
+        with open(FileOutputter().path('insert'), 'r') as f:
+            failed = json.loads(f.read())['data']
+
+        self.assertEqual(len(failed) + len(DataEndpointStandIn.RESTAURANTS), len(ROWS))
+        self.assertEqual(failed, ROWS[:len(failed)])
+
+    def test_get_is_none_unless_restaurants_are_returned(self):
+        # an empty endpoint is an empty state, whereas an error is no state at all
+        self.assertEqual(self.outputter.get().catalog_size, 0)
+
+        with mock.patch.object(DataEndpointStandIn, 'do_GET',
+                               lambda handler: handler._send_json({}, status=503)):
+            self.assertIsNone(self.outputter.get())
+
+
+class FileOutputterTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def _write(self, outputter: FileOutputter, data) -> str:
+        outputter.FILE_BASE = os.path.join(self.directory.name, 'processed_')
+        outputter.update(data, 'token')
+        return outputter.path('update')
+
+    def test_json_keeps_envelope(self):
+        path = self._write(FileOutputter('json', 'none'), ROWS)
+
+        with open(path, 'r') as f:
+            self.assertEqual(json.loads(f.read()), {'timestamp': 'token', 'data': ROWS})
+        self.assertFalse(os.path.exists(f'{path}.tmp'))
+
+    def test_json_accepts_empty_and_single_row(self):
+        outputter = FileOutputter('json', 'none')
+
+        with open(self._write(outputter, []), 'r') as f:
+            self.assertEqual(json.loads(f.read())['data'], [])
+        with open(self._write(outputter, ROWS[0]), 'r') as f:
+            self.assertEqual(json.loads(f.read())['data'], ROWS[:1])
+
+    def test_gzipped_json_lines_streams_generator(self):
+        path = self._write(FileOutputter('jsonl', 'gzip'), (row for row in ROWS))
+
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f]
+
+        self.assertTrue(path.endswith('.jsonl.gz'))
+        self.assertEqual(lines[0], {'timestamp': 'token'})
+        self.assertEqual(lines[1:], ROWS)
+
+
+class ShardOutputterTest(unittest.TestCase):
+    DIRECTORY = 'test/shards_test'
+
+    def setUp(self) -> None:
+        self.rows = [{'name_seq_nr': str(i), 'zip_code': zip_code, 'region': region}
+                     for i, (zip_code, region) in enumerate([('8000', 'Region Midtjylland'),
+                                                             ('8099', 'Region Midtjylland'),
+                                                             ('8100', 'Region Midtjylland'),
+                                                             ('4000', 'Region Sjælland'),
+                                                             (None, None)])]
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.DIRECTORY, ignore_errors=True)
+
+    def _export(self, outputter: ShardOutputter, rows: list, token: str) -> dict:
+        outputter.insert(iter(rows), token)
+        return outputter.manifest()
+
+    def _read(self, file: str) -> list:
+        with gzip.open(os.path.join(self.DIRECTORY, file), 'rt', encoding='utf-8') as f:
+            return json.loads(f.read())
+
+    def test_shards_by_zip_code_range(self):
+        manifest = self._export(ShardOutputter(self.DIRECTORY, 'zip_code', 100, 'gzip'),
+                                self.rows, 'token')
+
+        self.assertEqual(manifest['timestamp'], 'token')
+        self.assertEqual(sorted(manifest['shards']), ['4000-4099', '8000-8099', '8100-8199',
+                                                      'unknown'])
+        shard = manifest['shards']['8000-8099']
+        self.assertEqual(shard['restaurants'], 2)
+        self.assertEqual(self._read(shard['file']), self.rows[:2])
+        self.assertTrue(shard['file'].startswith(f'8000-8099.{shard["sha256"][:16]}'))
+
+    def test_shards_by_region(self):
+        manifest = self._export(ShardOutputter(self.DIRECTORY, 'region', 100, 'gzip'),
+                                self.rows, 'token')
+
+        self.assertEqual(sorted(manifest['shards']), ['region-midtjylland', 'region-sjaelland',
+                                                      'unknown'])
+
+    def test_only_changed_shards_are_rewritten(self):
+        outputter = ShardOutputter(self.DIRECTORY, 'zip_code', 100, 'gzip')
+        first = self._export(outputter, self.rows, 'first')
+        changed = [dict(row, name='Renamed') if row['name_seq_nr'] == '3' else row
+                   for row in reversed(self.rows[1:])]
+
+        second = self._export(outputter, changed, 'second')
+        third = self._export(outputter, changed, 'third')
+
+        self.assertEqual(second['shards']['8100-8199'], first['shards']['8100-8199'])
+        self.assertEqual(second['shards']['8000-8099']['restaurants'], 1)
+        self.assertNotEqual(second['shards']['4000-4099'], first['shards']['4000-4099'])
+        self.assertNotEqual(second['sha256'], first['sha256'])
+        self.assertEqual(third['sha256'], second['sha256'])
+        # files of the previous manifest are kept for one more export
+        files = set(os.listdir(self.DIRECTORY))
+        self.assertEqual(files - {ShardOutputter.MANIFEST},
+                         {shard['file'] for shard in third['shards'].values()})
+
+
+@unittest.skipUnless(importlib.util.find_spec('pyarrow'), 'requires pyarrow')
+class ParquetOutputterTest(unittest.TestCase):
+    DIRECTORY = 'test/parquet_test'
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.DIRECTORY, ignore_errors=True)
+
+    def test_export_is_typed_and_written_in_row_groups(self):
+        import pyarrow.parquet as pq
+
+        rows = [restaurant(str(i), [(2, datetime(2021, 1, 1))] * 2, geo_lat=55.5,
+                           start_date=datetime(2020, 1, 1)).as_dict() for i in range(5)]
+
+        ParquetOutputter(self.DIRECTORY, row_group_size=2).insert(iter(rows), 'token')
+
+        restaurants = pq.ParquetFile(os.path.join(self.DIRECTORY, ParquetOutputter.RESTAURANTS))
+        reports = pq.read_table(os.path.join(self.DIRECTORY, ParquetOutputter.SMILEY_REPORTS),
+                                columns=['name_seq_nr', 'smiley'])
+
+        self.assertEqual(restaurants.metadata.num_row_groups, 3)
+        self.assertEqual(str(restaurants.schema_arrow.field('start_date').type),
+                         'timestamp[ms, tz=UTC]')
+        self.assertEqual(restaurants.read(columns=['geo_lat']).column(0).to_pylist(), [55.5] * 5)
+        self.assertEqual(reports.num_rows, 10)
+        self.assertEqual(reports.column('smiley').to_pylist(), [2] * 10)
@@ -0,0 +1,56 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+from xml.etree import ElementTree as ET
+from filter_xml.catalog import Restaurant
+from filter_xml.cvr import ZipcodeFinder
+from filter_xml.filters import PreFilters
+from filter_xml.generator import SmileyXMLGenerator
+from filter_xml.smiley_extractor import SmileyExtractor
+
+
+class PreFiltersTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.xml_path = os.path.join(self.directory.name, 'smiley.xml')
+        SmileyXMLGenerator(2000, seed=3).write(self.xml_path)
+        first = ET.parse(self.xml_path).getroot()[0].findtext('navnelbnr')
+
+        zip_codes = ZipcodeFinder(SmileyXMLGenerator.zip_map())
+
+        self.patches = [
+            mock.patch.object(PreFilters, 'ZIP_CODES', zip_codes),
+            mock.patch.object(PreFilters, 'LOG', {key: 0 for key in PreFilters.LOG}),
+            mock.patch.object(PreFilters, 'log_filters'),
+            mock.patch('filter_xml.filters.Blacklist.contains', side_effect=lambda n: n == first)
+        ]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self) -> None:
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.directory.cleanup()
+
+    def test_row_filters_match_restaurant_filters(self):
+        pre_filters = PreFilters()
+        expected = [res.as_dict()
+                    for res in (Restaurant.from_xml({col.tag: col.text for col in row})
+                                for row in ET.parse(self.xml_path).getroot())
+                    if pre_filters.filter(res)]
+        expected_log = dict(PreFilters.LOG)
+        PreFilters.LOG.update({key: 0 for key in PreFilters.LOG})
+
+        with mock.patch.object(Restaurant, 'from_xml', side_effect=Restaurant.from_xml) as from_xml:
+            extractor = SmileyExtractor(self.xml_path, False)
+            actual = [res.as_dict() for res in extractor.iter_restaurants()]
+
+        self.assertEqual(actual, expected)
+        self.assertEqual(PreFilters.LOG, expected_log)
+        self.assertEqual(PreFilters.LOG['blacklisted'], 1)
+        self.assertTrue(all(PreFilters.LOG.values()))
+        # rejected rows are never constructed
+        self.assertEqual(from_xml.call_count, len(expected))
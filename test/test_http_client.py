@@ -0,0 +1,60 @@
+import unittest
+import os
+import time
+
+from requests.exceptions import ConnectionError
+from filter_xml.http_client import HTTPClient, Cassette
+from filter_xml.stand_in import StandInServer, ElasticStandIn, DataEndpointStandIn
+
+CASSETTE = 'test/cassette_test.json.gz'
+
+
+class HTTPClientTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        DataEndpointStandIn.reset()
+        self.server = StandInServer(DataEndpointStandIn, 0).start()
+        self.url = self.server.url('/admin/load')
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        if os.path.exists(CASSETTE):
+            os.remove(CASSETTE)
+
+    def test_replay_serves_recorded_response(self):
+        DataEndpointStandIn.RESTAURANTS = {'1': {'name_seq_nr': '1'}}
+        recorder = HTTPClient(mode='record', cassette=CASSETTE)
+        recorded = recorder.get(self.url)
+        recorder.close()
+
+        DataEndpointStandIn.reset()
+        replayer = HTTPClient(mode='replay', cassette=CASSETTE, latency=0, jitter=0)
+        replayed = replayer.get(self.url)
+
+        self.assertEqual(replayed.status_code, 200)
+        self.assertEqual(replayed.json(), recorded.json())
+
+    def test_replay_miss_raises_connection_error(self):
+        replayer = HTTPClient(mode='replay', cassette=CASSETTE)
+
+        with self.assertRaises(ConnectionError):
+            replayer.get(self.url)
+
+    def test_replay_injects_latency(self):
+        recorder = HTTPClient(mode='record', cassette=CASSETTE)
+        recorder.post(self.url, json={'timestamp': 't', 'data': []})
+        recorder.close()
+
+        replayer = HTTPClient(mode='replay', cassette=CASSETTE, latency=0.05, jitter=0)
+        start = time.perf_counter()
+        replayer.post(self.url, json={'timestamp': 't', 'data': []})
+
+        self.assertGreaterEqual(time.perf_counter() - start, 0.05)
+
+    def test_key_ignores_param_order(self):
+        self.assertEqual(Cassette.key('get', 'u', {'a': 1, 'b': 2}),
+                         Cassette.key('GET', 'u', {'b': 2, 'a': 1}))
+
+    def test_elastic_stand_in_is_deterministic(self):
+        self.assertEqual(ElasticStandIn.production_unit('1019551292'),
+                         ElasticStandIn.production_unit('1019551292'))
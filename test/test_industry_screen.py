@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bs4 import BeautifulSoup
+from unittest import mock
+from filter_xml.catalog import Restaurant
+from filter_xml.data_processor import DataProcessor
+from filter_xml.industry_screen import IndustryScreen
+from filter_xml.temp_file import TempFile
+from test.helpers import FixedCVRHandler, daily, restaurant
+
+
+def unit(seq_nr: str, branche: str, pixibranche: str = None) -> Restaurant:
+    """
+    A production unit with the smiley XML industry :param branche and :param pixibranche
+    """
+    return restaurant(seq_nr, daily(1), cvrnr='12345678', pnr=f'10{seq_nr}',
+                      industry_code=branche, niche_industry=pixibranche)
+
+
+class IndustryScreenTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_screens_only_industries_that_can_never_match(self):
+        path = os.path.join(self.directory.name, 'mapping.json')
+        with open(path, 'w') as f:
+            f.write(json.dumps({'brancheKode': {'DD.47.11.00': ['471100', '563000']}}))
+        screen = IndustryScreen.load(path)
+
+        self.assertTrue(screen.can_match(unit('1', 'DD.56.10.99')))
+        self.assertFalse(screen.can_match(unit('2', 'DD.10.71.20')))
+        # unmapped industries are kept, and Pixibranche is used for unmapped brancheKode
+        self.assertTrue(screen.can_match(unit('3', 'DD.99.99.99', 'Ukendt')))
+        self.assertFalse(screen.can_match(unit('4', 'DD.99.99.99',
+                                                     'Bagere og bagerafdelinger')))
+        self.assertTrue(screen.can_match(unit('5', 'DD.47.11.00')))
+
+    def test_measure_against_cvr(self):
+        restaurants = [unit('1', 'DD.56.10.99'), unit('2', 'DD.56.10.99'),
+                       unit('3', 'DD.10.71.20'), unit('4', 'DD.10.71.20')]
+        handler = FixedCVRHandler({'101': '561010', '102': '471100', '103': '107120',
+                                   '104': '563000'})
+
+        measured = IndustryScreen().measure(restaurants, handler)
+
+        self.assertEqual(measured['precision'], 0.5)
+        self.assertEqual(measured['recall'], 0.5)
+        self.assertEqual(measured['screened'], 0.5)
+        self.assertEqual(measured['by_code']['DD.10.71.20'],
+                         {'rows': 2, 'kept': 0, 'relevant': 1})
+
+    def test_measure_respects_crawl_delay(self):
+        handler = FixedCVRHandler({'101': '561010', '102': '471100'})
+        handler.SHOULD_SLEEP, handler.CRAWL_DELAY = True, 10
+
+        with mock.patch('filter_xml.util.time') as clock:
+            clock.monotonic.return_value = 0
+            IndustryScreen().measure([unit('1', 'DD.56.10.99'), unit('2', 'DD.56.10.99')],
+                                     handler)
+
+        # the first lookup never waits
+        clock.sleep.assert_called_once_with(10)
+
+    def test_screened_rows_are_not_looked_up(self):
+        outputter = mock.Mock(MIRRORED=False)
+        handler = FixedCVRHandler({'101': '561010', '102': '107120'})
+
+        with mock.patch('filter_xml.data_processor.get_cvr_handler', return_value=handler), \
+                mock.patch.object(FixedCVRHandler, 'collect_data',
+                                  side_effect=handler.collect_data) as collect_data, \
+                mock.patch('filter_xml.config.FilterXMLConfig.industry_screen',
+                           return_value=True), \
+                mock.patch('filter_xml.data_processor.Blacklist'), \
+                mock.patch('filter_xml.filters.PostFilters.log_filters'):
+            processor = DataProcessor(0, False, outputter)
+            temp_file = TempFile(os.path.join(self.directory.name, 'temp.json'))
+            with mock.patch.object(processor._smiley_handler, 'page',
+                                   return_value=BeautifulSoup('', 'html.parser')):
+                result = processor.enrich([unit('1', 'DD.56.10.99'),
+                                           unit('2', 'DD.10.71.20')], temp_file)
+
+        self.assertEqual([res.name_seq_nr for res in result.catalog], ['1'])
+        self.assertEqual(collect_data.call_count, 1)
+        self.assertEqual(processor._screened, 1)
@@ -0,0 +1,95 @@
+import os
+import tempfile
+import unittest
+
+from unittest import mock
+from filter_xml import http_client
+from filter_xml.data_outputter import DatabaseOutputter
+from filter_xml.data_processor import DataProcessor
+from filter_xml.http_client import HTTPClient
+from filter_xml.merge_diff import MergeDiff
+from filter_xml.mirror import Mirror
+from filter_xml.stand_in import StandInServer, DataEndpointStandIn
+from test.helpers import catalog, daily, restaurant
+
+
+class MergeDiffTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        # in reverse, and with a duplicate of which the last occurrence counts
+        self.old = catalog(*[restaurant(str(i), daily(1)) for i in range(20, 0, -1)],
+                           restaurant('5', daily(1), name='Old'))
+        self.new = catalog(*[restaurant(str(i), daily(2 if i == 7 else 1),
+                                        name='Renamed' if i % 4 == 0 else None)
+                             for i in range(25, 5, -1)])
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def merge(self, old, delta: bool) -> tuple:
+        with MergeDiff(self.new, retained={'3', '99'}, delta=delta, run_size=3,
+                       directory=self.directory.name) as diff:
+            diff.spill(old)
+            inserts = list(diff.inserts())
+            result = (sorted(inserts, key=lambda row: row['name_seq_nr']),
+                      sorted(diff.updates(), key=lambda row: row['name_seq_nr']),
+                      sorted(diff.deletes()), diff.retained)
+            self.assertEqual(len(os.listdir(self.directory.name)), 1)
+        self.assertEqual(os.listdir(self.directory.name), [])
+        return result
+
+    def expected(self, delta: bool) -> tuple:
+        self.new.setup_fingerprint_diff(self.old.fingerprints(), self.old.signatures())
+        self.new.retained = {'3', '99'} & self.new.old_ids
+        updates = self.new.patch_set() if delta else self.new.update_set()
+        return (sorted(self.new.insert_set(), key=lambda row: row['name_seq_nr']),
+                sorted(updates, key=lambda row: row['name_seq_nr']),
+                sorted(self.new.delete_set()), self.new.retained)
+
+    def test_merge_join_matches_fingerprint_diff(self):
+        for delta in [False, True]:
+            mirror = Mirror('')
+            mirror.fingerprints = self.old.fingerprints()
+            mirror.signatures = self.old.signatures()
+
+            expected = self.expected(delta)
+            self.assertEqual(self.merge(self.old, delta), expected)
+            self.assertEqual(self.merge(mirror, delta), expected)
+            # appended reports and renames are updates, and the duplicate is diffed as 'Old'
+            self.assertEqual(len(expected[1]), 5)
+            self.assertEqual(expected[2], ['1', '2', '4', '5'])
+
+    def test_output_streams_sets_to_outputter(self):
+        DataEndpointStandIn.reset()
+        server = StandInServer(DataEndpointStandIn, 0).start()
+        http_client._client = HTTPClient(mode='live')
+        outputter = DatabaseOutputter(backoff=0)
+        outputter.ENDPOINT = server.url('/admin/load')
+        state = {name: os.path.join(self.directory.name, f'{name}.json')
+                 for name in ['mirror', 'aggregates', 'schedule']}
+        try:
+            with mock.patch('filter_xml.data_processor.get_cvr_handler'), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.diff_external',
+                               return_value=True), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.diff_run_size',
+                               return_value=4), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.diff_spill_directory',
+                               return_value=os.path.join(self.directory.name, 'spill')), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.mirror_path',
+                               return_value=state['mirror']), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.aggregates_path',
+                               return_value=state['aggregates']), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.schedule_path',
+                               return_value=state['schedule']):
+                processor = DataProcessor(0, True, outputter)
+                processor.output(self.old)
+                # the mirror is invalidated, so the second diff is against the endpoint
+                Mirror().invalidate()
+                processor.output(self.new)
+        finally:
+            server.stop()
+            http_client._client = None
+
+        self.assertEqual(DataEndpointStandIn.RESTAURANTS,
+                         {res.name_seq_nr: res.as_dict() for res in self.new.catalog})
@@ -0,0 +1,67 @@
+import unittest
+import os
+
+from filter_xml.metrics import Metrics, Progress
+
+JSON_FILE = 'test/metrics_test.json'
+PROM_FILE = 'test/metrics_test.prom'
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Metrics.reset()
+
+    def tearDown(self) -> None:
+        Metrics.reset()
+        for path in [JSON_FILE, PROM_FILE]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def test_stage_records_observation(self):
+        with Metrics.stage('parse'):
+            pass
+
+        data = Metrics.as_dict()
+
+        self.assertEqual(data['stages']['parse']['count'], 1)
+
+    def test_cache_hit_rate(self):
+        Metrics.cache('temp_file', True)
+        Metrics.cache('temp_file', True)
+        Metrics.cache('temp_file', False)
+        Metrics.cache('temp_file', False)
+
+        self.assertEqual(Metrics.as_dict()['caches']['temp_file']['hit_rate'], 0.5)
+
+    def test_merge_adds_written_metrics(self):
+        Metrics.observe('cvr_lookup', 0.2)
+        Metrics.increment('errors.http')
+        Metrics.write(JSON_FILE, '')
+        Metrics.observe('cvr_lookup', 0.4)
+
+        Metrics.merge(JSON_FILE)
+        data = Metrics.as_dict()
+
+        self.assertEqual(data['stages']['cvr_lookup']['count'], 3)
+        self.assertAlmostEqual(data['stages']['cvr_lookup']['max'], 0.4)
+        self.assertEqual(data['counters']['errors.http'], 2)
+
+    def test_prometheus_buckets_are_cumulative(self):
+        Metrics.observe('diff', 0.002)
+        Metrics.observe('diff', 3)
+        Metrics.write('', PROM_FILE)
+
+        with open(PROM_FILE, 'r') as f:
+            lines = f.read().splitlines()
+
+        self.assertIn('filter_xml_stage_duration_seconds_bucket{stage="diff",le="0.005"} 1', lines)
+        self.assertIn('filter_xml_stage_duration_seconds_bucket{stage="diff",le="+Inf"} 2', lines)
+        self.assertIn('filter_xml_stage_duration_seconds_count{stage="diff"} 2', lines)
+
+    def test_progress_reports_eta_with_known_total(self):
+        progress = Progress(total=10, interval=3600)
+        progress.update(5)
+
+        self.assertIn('5 of 10 rows processed', progress.report())
+        self.assertIn('ETA', progress.report())
@@ -0,0 +1,147 @@
+import unittest
+import os
+import tempfile
+
+from unittest import mock
+from filter_xml import http_client
+from filter_xml.aggregates import Aggregates
+from filter_xml.config import FilterXMLConfig
+from filter_xml.data_outputter import DatabaseOutputter, FileOutputter
+from filter_xml.data_processor import DataProcessor
+from filter_xml.http_client import HTTPClient
+from filter_xml.metrics import Metrics
+from filter_xml.stand_in import StandInServer, DataEndpointStandIn
+from test.helpers import catalog, daily, restaurant
+
+
+class MirrorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Metrics.reset()
+        DataEndpointStandIn.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        self.patches = [
+            mock.patch('filter_xml.config.FilterXMLConfig.mirror_path',
+                       return_value=os.path.join(self.directory.name, 'mirror.json')),
+            mock.patch('filter_xml.config.FilterXMLConfig.aggregates_path',
+                       return_value=os.path.join(self.directory.name, 'aggregates.json')),
+            mock.patch('filter_xml.config.FilterXMLConfig.schedule_path',
+                       return_value=os.path.join(self.directory.name, 'schedule.json')),
+            # rows that fail to upload are written to file
+            mock.patch.object(FileOutputter, 'FILE_BASE',
+                              os.path.join(self.directory.name, 'processed_'))
+        ]
+        for patch in self.patches:
+            patch.start()
+        self.server = StandInServer(DataEndpointStandIn, 0).start()
+        http_client._client = HTTPClient(mode='live')
+
+        self.outputter = DatabaseOutputter(backoff=0)
+        self.outputter.ENDPOINT = self.server.url('/admin/load')
+        # output() needs no CVR provider
+        with mock.patch('filter_xml.data_processor.get_cvr_handler'):
+            self.processor = DataProcessor(0, True, self.outputter)
+
+    def tearDown(self) -> None:
+        self.server.stop()
+        http_client._client = None
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.directory.cleanup()
+
+    def test_fingerprint_diff_matches_diff(self):
+        old = catalog(restaurant('1', daily(1)), restaurant('2', daily(1)),
+                      restaurant('3', daily(1)))
+        new = catalog(restaurant('1', daily(1)), restaurant('2', daily(1), name='Renamed'),
+                      restaurant('4', daily(1)))
+
+        new.setup_diff(old)
+        expected = (new.insert_set(), new.update_set(), sorted(new.delete_set()))
+        new.setup_fingerprint_diff(old.fingerprints())
+
+        self.assertEqual((new.insert_set(), new.update_set(), sorted(new.delete_set())), expected)
+
+    def test_fingerprint_includes_appended_report(self):
+        self.assertNotEqual(restaurant('1', daily(1)).fingerprint(),
+                            restaurant('1', daily(2)).fingerprint())
+
+    def test_unchanged_server_is_diffed_against_mirror(self):
+        self.processor.output(catalog(restaurant('1', daily(1)), restaurant('2', daily(1))))
+        requests = DataEndpointStandIn.REQUESTS
+
+        self.processor.output(catalog(restaurant('1', daily(1)),
+                                      restaurant('2', daily(1), name='Renamed')))
+
+        self.assertEqual(Metrics.as_dict()['caches']['mirror'], {'hits': 1, 'misses': 1,
+                                                                 'hit_rate': 0.5})
+        self.assertEqual(DataEndpointStandIn.REQUESTS, requests + 1)
+        self.assertEqual(DataEndpointStandIn.RESTAURANTS['2']['name'], 'Renamed')
+
+    def test_unknown_state_without_mirror_is_not_pushed(self):
+        with mock.patch.object(DataEndpointStandIn, 'do_GET',
+                               lambda handler: handler._send_json({}, status=503)):
+            self.processor.output(catalog(restaurant('1', daily(1))))
+
+        self.assertEqual(DataEndpointStandIn.REQUESTS, 0)
+        self.assertEqual(DataEndpointStandIn.RESTAURANTS, {})
+        self.assertEqual(Metrics.counter('errors.data_endpoint'), 1)
+
+    def test_aggregates_are_kept_after_failed_push(self):
+        for external in [False, True]:
+            with mock.patch.object(FilterXMLConfig, 'diff_external', return_value=external), \
+                    mock.patch.object(FilterXMLConfig, 'diff_spill_directory',
+                                      return_value=self.directory.name):
+                DataEndpointStandIn.reset()
+                self.processor.output(catalog(restaurant('1', daily(1))))
+                DataEndpointStandIn.FAIL_REQUESTS = 100
+
+                self.processor.output(catalog(restaurant('1', daily(1)),
+                                              restaurant('2', daily(1))))
+
+            self.assertEqual(DataEndpointStandIn.RESTAURANTS.keys(), {'1'})
+            self.assertEqual(Aggregates.load().ids(), {'1'})
+
+    def test_changed_server_version_is_revalidated(self):
+        self.processor.output(catalog(restaurant('1', daily(1))))
+        DataEndpointStandIn.VERSION = 'pushed by someone else'
+
+        self.processor.output(catalog(restaurant('1', daily(1))))
+
+        self.assertEqual(Metrics.as_dict()['caches']['mirror']['hits'], 0)
+
+    def test_delta_push_patches_stored_restaurant(self):
+        with mock.patch.object(FilterXMLConfig, 'diff_delta', return_value=True):
+            self.processor.output(catalog(restaurant('1', daily(1))))
+            updated = restaurant('1', daily(2), name='Renamed')
+            self.processor.output(catalog(updated))
+
+        self.assertEqual(DataEndpointStandIn.RESTAURANTS['1'], updated.as_dict())
+
+
+class PatchTest(unittest.TestCase):
+
+    def test_patch_contains_only_changes(self):
+        old, new = restaurant('1', daily(1)), restaurant('1', daily(2), name='Renamed')
+
+        patch = new.patch(old.signature())
+
+        self.assertEqual(patch['set'], {'name': 'Renamed'})
+        self.assertEqual(patch['add_reports'], [new.smiley_reports[0].as_dict()])
+        self.assertEqual(patch['remove_reports'], [])
+
+    def test_patch_set_against_signatures(self):
+        old = catalog(restaurant('1', daily(2)), restaurant('2', daily(1)))
+        new = catalog(restaurant('1', daily(1)), restaurant('2', daily(1)))
+
+        new.setup_fingerprint_diff(old.fingerprints(), old.signatures())
+        patches = new.patch_set()
+
+        self.assertEqual(len(patches), 1)
+        self.assertEqual(patches[0]['set'], {})
+        self.assertEqual(patches[0]['remove_reports'],
+                         [[None, 1, old.catalog[0].smiley_reports[0].date_string]])
+
+    def test_patch_without_signature_replaces_reports(self):
+        new = restaurant('1', daily(1))
+
+        self.assertEqual(new.patch(None)['reports'], new.as_dict()['smiley_reports'])
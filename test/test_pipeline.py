@@ -0,0 +1,63 @@
+import unittest
+
+from filter_xml.pipeline import Pipeline, Stage
+
+
+class PipelineTest(unittest.TestCase):
+
+    def test_items_pass_through_every_stage(self):
+        out = []
+        pipeline = Pipeline(range(100), [
+            Stage('double', lambda x: x * 2, workers=3),
+            Stage('collect', out.append)
+        ], queue_size=5)
+
+        pipeline.run()
+
+        self.assertEqual(sorted(out), [x * 2 for x in range(100)])
+
+    def test_stage_can_drop_items(self):
+        out = []
+        pipeline = Pipeline(range(10), [
+            Stage('even', lambda x: x if x % 2 == 0 else None),
+            Stage('collect', out.append)
+        ])
+
+        pipeline.run()
+
+        self.assertEqual(sorted(out), [0, 2, 4, 6, 8])
+
+    def test_batches_are_limited_by_batch_size(self):
+        sizes = []
+
+        def batch(items):
+            sizes.append(len(items))
+            return items
+
+        pipeline = Pipeline(range(10), [Stage('batch', batch, batch_size=4)])
+        pipeline.run()
+
+        self.assertEqual(sum(sizes), 10)
+        self.assertTrue(all(size <= 4 for size in sizes))
+
+    def test_stop_ends_run(self):
+        out = []
+
+        def collect(x):
+            out.append(x)
+            if len(out) == 5:
+                pipeline.stop()
+
+        pipeline = Pipeline(iter(range(10 ** 6)), [Stage('collect', collect)], queue_size=2)
+        pipeline.run()
+
+        self.assertLess(len(out), 10)
+
+    def test_errors_are_raised(self):
+        def fail(x):
+            raise ValueError('nope')
+
+        pipeline = Pipeline(range(10), [Stage('fail', fail), Stage('noop', lambda x: x)])
+
+        with self.assertRaises(ValueError):
+            pipeline.run()
@@ -0,0 +1,51 @@
+import os
+import pstats
+import tempfile
+import tracemalloc
+import unittest
+
+from filter_xml.profiling import Profiler
+
+
+class ProfilerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.tracing = tracemalloc.is_tracing()
+
+    def tearDown(self) -> None:
+        Profiler.configure(None, False, False)
+        Profiler.set_prefix('')
+        if tracemalloc.is_tracing() and not self.tracing:
+            tracemalloc.stop()
+        self.directory.cleanup()
+
+    def test_stage_reports_are_written(self):
+        Profiler.configure(self.directory.name, cpu=True, memory=True)
+        Profiler.set_prefix('shard0.')
+
+        for _ in range(2):
+            with Profiler.stage('diff'):
+                rows = [{'name_seq_nr': str(i)} for i in range(1000)]
+        Profiler.write()
+
+        self.assertEqual(sorted(os.listdir(self.directory.name)),
+                         ['shard0.diff.memory.txt', 'shard0.diff.pstats'])
+        stats = pstats.Stats(os.path.join(self.directory.name, 'shard0.diff.pstats'))
+        self.assertGreater(stats.total_calls, 0)
+        with open(os.path.join(self.directory.name, 'shard0.diff.memory.txt'), 'r') as f:
+            # a report per time the stage was entered
+            self.assertEqual(f.read().count('# diff: '), 2)
+        self.assertEqual(len(rows), 1000)
+
+    def test_unconfigured_stage_is_a_no_op(self):
+        Profiler.configure(self.directory.name, cpu=False, memory=False)
+
+        self.assertIs(Profiler.stage('diff'), Profiler.stage('output'))
+        self.assertIs(Profiler.thread('cvr'), Profiler.stage('diff'))
+        with Profiler.stage('diff'):
+            pass
+        Profiler.write()
+
+        self.assertEqual(os.listdir(self.directory.name), [])
+        self.assertFalse(Profiler._profiles)
@@ -0,0 +1,96 @@
+import unittest
+import json
+import random
+
+from urllib.request import urlopen
+from urllib.error import HTTPError
+from filter_xml.query_service import QueryIndex, QueryService
+from filter_xml.spatial import GridIndex, haversine
+from test.helpers import catalog, restaurant
+
+
+class GridIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        rnd = random.Random(1)
+        self.points = {str(i): (54.5 + rnd.random() * 3, 8 + rnd.random() * 5)
+                       for i in range(2000)}
+        self.index = GridIndex(0.05)
+        for key, point in self.points.items():
+            self.index.add(key, *point)
+
+    def brute_force(self, lat: float, lng: float):
+        return sorted((haversine(lat, lng, *point), key) for key, point in self.points.items())
+
+    def test_nearest_matches_brute_force(self):
+        # inside, at the edge of and far away from the indexed points
+        for lat, lng in [(56.0, 10.0), (54.5, 8.0), (50.0, 0.0)]:
+            self.assertEqual([key for _, key in self.index.nearest(lat, lng, 7)],
+                             [key for _, key in self.brute_force(lat, lng)[:7]])
+
+    def test_radius_matches_brute_force(self):
+        expected = [key for distance, key in self.brute_force(56.0, 10.0) if distance <= 20000]
+
+        self.assertEqual([key for _, key in self.index.radius(56.0, 10.0, 20000)], expected)
+
+    def test_moved_key_is_found_at_new_point_only(self):
+        self.index.add('0', 60.0, 20.0)
+
+        self.assertEqual(self.index.nearest(60.0, 20.0, 1)[0][1], '0')
+        self.assertNotIn('0', [key for _, key in self.index.radius(*self.points['0'], 1)])
+
+
+class QueryIndexTest(unittest.TestCase):
+
+    def test_update_indexes_only_changed_restaurants(self):
+        index = QueryIndex(0.01)
+        kept = restaurant('1', geo_lat=55.0, geo_lng=10.0, pnr='p1')
+        moved = restaurant('2', geo_lat=55.0, geo_lng=10.0)
+        index.update(catalog(kept, moved, restaurant('3', cvrnr='c3')))
+
+        indexed, removed = index.update(catalog(kept, restaurant('2', geo_lat=56.0,
+                                                                 geo_lng=11.0)))
+
+        self.assertEqual((indexed, removed), (1, 1))
+        self.assertIsNone(index.get('3'))
+        self.assertEqual(index.by_cvrnr('c3'), [])
+        self.assertEqual([res.name_seq_nr for res in index.by_pnr('p1')], ['1'])
+        self.assertEqual(index.nearest(56.0, 11.0, 1)[0][1].name_seq_nr, '2')
+
+
+class QueryServiceTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        index = QueryIndex(0.01)
+        index.update(catalog(
+            restaurant('1', geo_lat=55.6786, geo_lng=12.5635, pnr='p1', cvrnr='c1'),
+            restaurant('2', geo_lat=55.6800, geo_lng=12.5700, pnr='p2', cvrnr='c1'),
+            restaurant('3', geo_lat=56.1567, geo_lng=10.2108, pnr='p3', cvrnr='c3')))
+        self.service = QueryService(index, 0, '127.0.0.1').start()
+
+    def tearDown(self) -> None:
+        self.service.stop()
+
+    def get(self, path: str):
+        with urlopen(self.service.url(path)) as response:
+            return json.loads(response.read())
+
+    def test_lookups(self):
+        self.assertEqual(self.get('/restaurants/3')['pnr'], 'p3')
+        self.assertEqual([r['name_seq_nr'] for r in self.get('/restaurants?cvrnr=c1')], ['1', '2'])
+        self.assertEqual([r['name_seq_nr'] for r in self.get('/restaurants?pnr=p2')], ['2'])
+
+    def test_spatial_queries(self):
+        nearby = self.get('/nearby?lat=55.6786&lng=12.5635&radius=1000')
+        nearest = self.get('/nearest?lat=56&lng=10&k=2')
+
+        self.assertEqual([r['restaurant']['name_seq_nr'] for r in nearby], ['1', '2'])
+        self.assertEqual(nearby[0]['distance'], 0)
+        self.assertEqual([r['restaurant']['name_seq_nr'] for r in nearest], ['3', '1'])
+
+    def test_errors(self):
+        for path, status in [('/restaurants/4', 404), ('/nearest?lat=56', 400),
+                             ('/nearest?lat=56&lng=10&k=0', 400), ('/unknown', 404)]:
+            with self.assertRaises(HTTPError) as cm:
+                self.get(path)
+            self.assertEqual(cm.exception.code, status)
@@ -0,0 +1,76 @@
+import itertools
+import os
+import tempfile
+import unittest
+
+from datetime import datetime
+from unittest import mock
+from filter_xml.catalog import Restaurant
+from filter_xml.data_processor import DataProcessor
+from filter_xml.schedule import Schedule
+from filter_xml.temp_file import TempFile
+from test.helpers import catalog, restaurant
+
+
+def inspected(seq_nr: str, date: datetime) -> Restaurant:
+    """
+    A production unit passing the post filters, last inspected at :param date
+    """
+    return restaurant(seq_nr, [(1, date)], cvrnr='12345678', pnr='1234567890',
+                      industry_code='561010')
+
+
+class ScheduleTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'schedule.json')
+        self.old = datetime(2021, 1, 1)
+
+        schedule = Schedule(self.path)
+        schedule.record([inspected('stale', self.old), inspected('fresh', self.old)], 'first')
+        schedule.record([inspected('fresh', self.old), inspected('inspected', self.old)],
+                        'second', retained=['stale'])
+        schedule.save()
+
+        # in XML order
+        self.restaurants = [inspected('fresh', self.old), inspected('stale', self.old),
+                            inspected('inspected', datetime(2021, 3, 1)),
+                            inspected('new', datetime(2021, 2, 1)),
+                            inspected('newer', datetime(2021, 4, 1))]
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_order_prioritises_new_then_inspected_then_stale(self):
+        ordered = Schedule.load(self.path).order(self.restaurants)
+
+        self.assertEqual([res.name_seq_nr for res in ordered],
+                         ['newer', 'new', 'inspected', 'stale', 'fresh'])
+
+    def test_deadline_retains_pending_restaurants(self):
+        outputter = mock.Mock(MIRRORED=False)
+        outputter.version.return_value = None
+        outputter.get.return_value = catalog(inspected('fresh', self.old),
+                                             inspected('stale', self.old),
+                                             inspected('gone', self.old))
+
+        with mock.patch('filter_xml.data_processor.get_cvr_handler'), \
+                mock.patch('filter_xml.data_processor.time') as clock, \
+                mock.patch('filter_xml.config.FilterXMLConfig.schedule_path',
+                           return_value=self.path), \
+                mock.patch('filter_xml.config.FilterXMLConfig.aggregates_path', return_value=''), \
+                mock.patch('filter_xml.config.FilterXMLConfig.mirror_path', return_value=''):
+            # the deadline passes once three restaurants have entered the pipeline
+            clock.monotonic.side_effect = itertools.chain([0, 0, 0, 0], itertools.repeat(100))
+            processor = DataProcessor(0, True, outputter, deadline=10)
+            temp_file = TempFile(os.path.join(self.directory.name, 'temp.json'))
+            result = processor.enrich(self.restaurants, temp_file)
+            processor.output(result)
+
+        self.assertEqual({res.name_seq_nr for res in result.catalog}, {'newer', 'new', 'inspected'})
+        self.assertEqual(processor._pending, {'stale', 'fresh'})
+        # pending restaurants are neither deleted nor updated
+        outputter.delete.assert_called_once_with(['gone'], mock.ANY)
+        self.assertEqual(Schedule.load(self.path).priority(inspected('stale', self.old)),
+                         (2, 0, 'first'))
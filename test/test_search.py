@@ -0,0 +1,50 @@
+import unittest
+
+from filter_xml.search import SearchIndex, normalise
+from test.helpers import catalog, restaurant
+
+
+class SearchIndexTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.index = SearchIndex()
+        self.index.update(catalog(
+            restaurant('1', name='Jensens Bøfhus', address='Åboulevarden 7', city='Århus C',
+                       franchise_name='Jensens Bøfhus'),
+            restaurant('2', name='Pizzeria Roma', address='Vestergade 3', city='Odense C'),
+            restaurant('3', name='Café Vestergade', address='Nørregade 1', city='Aarhus N'),
+            restaurant('4', name='Smørrebrødshuset', address='Vestergade 12',
+                       city='Ærøskøbing')))
+
+    def search(self, query: str):
+        return [res.name_seq_nr for _, res in self.index.search(query)]
+
+    def test_normalise_spells_out_danish_letters(self):
+        self.assertEqual(normalise('Café Ærø Åbenrå'), 'cafe aeroe aabenraa')
+
+    def test_danish_spellings_match(self):
+        self.assertEqual(self.search('jensens bofhus aarhus'), ['1'])
+        self.assertEqual(self.search('aeroeskoebing'), ['4'])
+        self.assertEqual(self.search('AARHUS'), ['1', '3'])
+
+    def test_prefix_only_on_last_token(self):
+        self.assertEqual(self.search('piz'), ['2'])
+        self.assertEqual(self.search('piz roma'), [])
+
+    def test_typos_are_tolerated(self):
+        self.assertEqual(self.search('pizzeira'), ['2'])
+        self.assertEqual(self.search('vestregade odense'), ['2'])
+
+    def test_name_scores_above_address(self):
+        self.assertEqual(self.search('vestergade'), ['3', '2', '4'])
+
+    def test_update_is_incremental(self):
+        kept = self.index._restaurants['1']
+        renamed = restaurant('2', name='Trattoria Roma', address='Vestergade 3', city='Odense C')
+
+        indexed, removed = self.index.update(catalog(kept, renamed))
+
+        self.assertEqual((indexed, removed), (1, 2))
+        self.assertEqual(self.search('pizzeria'), [])
+        self.assertEqual(self.search('trattoria'), ['2'])
+        self.assertEqual(self.search('vestergade'), ['2'])
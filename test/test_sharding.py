@@ -0,0 +1,130 @@
+import json
+import os
+import tempfile
+import unittest
+
+from bs4 import BeautifulSoup
+from unittest import mock
+from filter_xml.cvr import CVRHandlerElastic, FindSmileyHandler
+from filter_xml.data_processor import DataProcessor
+from filter_xml.filters import Filters
+from filter_xml.metrics import Metrics
+from filter_xml.sharding import ShardedProcessor, shard_of
+from filter_xml.stand_in import StandInServer, ElasticStandIn
+from filter_xml.temp_file import TempFile
+from test.helpers import FixedCVRHandler, daily, restaurant
+
+PNRS = [str(1000000000 + i) for i in range(30)]
+# every third production unit is a bakery, which is filtered away
+CODES = {pnr: '107120' if i % 3 == 0 else '561010' for i, pnr in enumerate(PNRS)}
+
+
+def rows() -> list:
+    return [restaurant(str(i), daily(1), cvrnr='12345678', pnr=pnr,
+                       url=f'https://www.findsmiley.dk/{i}')
+            for i, pnr in enumerate(PNRS)]
+
+
+class ShardedProcessorTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        Metrics.reset()
+        self.directory = tempfile.TemporaryDirectory()
+        files = {name: os.path.join(self.directory.name, getattr(ShardedProcessor, name))
+                 for name in ['MANIFEST', 'TEMP_FILE', 'DONE_FILE', 'LOG_FILE', 'METRICS_FILE']}
+        self.patches = [mock.patch.multiple(ShardedProcessor, **files),
+                        mock.patch.object(Filters, 'LOGGER', {}),
+                        mock.patch('filter_xml.data_processor.Blacklist'),
+                        mock.patch('filter_xml.sharding.Blacklist'),
+                        mock.patch.object(FindSmileyHandler, 'page',
+                                          return_value=BeautifulSoup('', 'html.parser'))]
+        for patch in self.patches:
+            patch.start()
+
+    def tearDown(self) -> None:
+        for patch in reversed(self.patches):
+            patch.stop()
+        self.directory.cleanup()
+        Metrics.reset()
+
+    def processor(self, handler=None) -> DataProcessor:
+        with mock.patch('filter_xml.data_processor.get_cvr_handler',
+                        return_value=handler or FixedCVRHandler(CODES)):
+            processor = DataProcessor(0, False, mock.Mock(MIRRORED=False))
+        processor.output = mock.Mock()
+        return processor
+
+    def run_sharded(self, workers: int = 2, handler=None) -> dict:
+        processor = self.processor(handler)
+        ShardedProcessor(processor, workers).process_smiley_json(rows())
+        return {res.name_seq_nr: res.as_dict() for res in processor.output.call_args[0][0].catalog}
+
+    def test_partition_is_stable(self):
+        # crc32 rather than the salted hash(), such that a resumed run partitions alike
+        self.assertEqual([shard_of(str(i), 3) for i in range(12)],
+                         [2, 2, 1, 1, 1, 1, 1, 0, 2, 0, 0, 0])
+
+    def test_merged_output_equals_single_process_output(self):
+        temp_file = TempFile(os.path.join(self.directory.name, 'temp.json'))
+        single = self.processor().enrich(rows(), temp_file)
+
+        merged = self.run_sharded()
+
+        self.assertEqual(merged, {res.name_seq_nr: res.as_dict() for res in single.catalog})
+        self.assertEqual(len(merged), 20)
+        # every file of the run is removed once it is output
+        self.assertEqual(os.listdir(self.directory.name), ['temp.json'])
+
+    def test_filter_logs_of_shards_are_added(self):
+        for i, count in enumerate([3, 4]):
+            with open(ShardedProcessor.LOG_FILE.format(i), 'w') as f:
+                f.write(json.dumps({'log': {'industry_code': count, 'end_date': 1}}))
+        sharded = ShardedProcessor(self.processor(), 2)
+        Filters.LOGGER['industry_code'] = 2
+
+        sharded._merge_filter_logs()
+
+        self.assertEqual(Filters.LOGGER, {'industry_code': 9, 'end_date': 2})
+
+    def test_resume_skips_finished_shards(self):
+        with open(ShardedProcessor.MANIFEST, 'w') as f:
+            f.write(json.dumps({'workers': 2}))
+        # shard 0 finished before the crash, having kept a single restaurant
+        i = next(i for i in range(len(PNRS)) if shard_of(str(i), 2) == 0)
+        finished = restaurant(str(i), daily(1), cvrnr='12345678', pnr=PNRS[i], name='Finished')
+        TempFile(ShardedProcessor.TEMP_FILE.format(0)).add_data(finished)
+        with open(ShardedProcessor.DONE_FILE.format(0), 'w') as f:
+            f.write('done')
+
+        merged = self.run_sharded()
+
+        shards = {seq_nr: shard_of(seq_nr, 2) for seq_nr in merged}
+        self.assertEqual([seq_nr for seq_nr, shard in shards.items() if shard == 0], [str(i)])
+        self.assertEqual(merged[str(i)]['name'], 'Finished')
+        self.assertEqual(len(merged) - 1, sum(shard_of(str(j), 2) == 1 and j % 3 != 0
+                                              for j in range(len(PNRS))))
+
+    def test_resume_with_other_workers_fails(self):
+        with open(ShardedProcessor.MANIFEST, 'w') as f:
+            f.write(json.dumps({'workers': 3}))
+
+        with self.assertRaises(ValueError):
+            self.run_sharded(workers=2)
+
+    def test_bulk_export_is_performed_once_before_forking(self):
+        server = StandInServer(ElasticStandIn, 0).start()
+        try:
+            with mock.patch.object(ElasticStandIn, 'PNRS', PNRS), \
+                    mock.patch.object(CVRHandlerElastic, 'URL',
+                                      server.url('/cvr-permanent/produktionsenhed/_search')), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_bulk',
+                               return_value=True), \
+                    mock.patch('filter_xml.config.FilterXMLConfig.cvr_elastic_page_size',
+                               return_value=5):
+                merged = self.run_sharded(workers=3, handler=CVRHandlerElastic())
+        finally:
+            server.stop()
+
+        # the metrics of the shards are merged, so an export per shard would count thrice
+        self.assertGreater(len(merged), 0)
+        self.assertEqual(Metrics.counter('cvr_elastic.exported'), len(merged))
@@ -0,0 +1,109 @@
+import threading
+import time
+import unittest
+
+from bs4 import BeautifulSoup
+from unittest import mock
+from filter_xml.catalog import Restaurant
+from filter_xml.data_processor import DataProcessor
+from filter_xml.util import SingleFlight
+from test.helpers import daily, restaurant
+
+
+def unit(seq_nr: str, pnr: str, reports: int = 1) -> Restaurant:
+    """
+    A restaurant of the production unit :param pnr, with its own findsmiley.dk page
+    """
+    return restaurant(seq_nr, daily(reports), cvrnr='12345678', pnr=pnr,
+                      url=f'https://www.findsmiley.dk/{pnr}')
+
+
+def smiley_page(*report_ids: str) -> BeautifulSoup:
+    links = ''.join(f'<a target="_blank" href="https://www.findsmiley.dk/pdf?{report_id}"></a>'
+                    for report_id in report_ids)
+    return BeautifulSoup(f'<html><body>{links}</body></html>', 'html.parser')
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def test_concurrent_and_later_calls_share_one_result(self):
+        flight = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def lookup():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'result'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(flight.do('pnr', lookup)))
+                   for _ in range(4)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        # wait until every follower is waiting for the leader
+        while flight.saved < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(results, ['result'] * 4)
+        self.assertEqual(flight.do('pnr', lambda: 'other'), 'result')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(flight.saved, 4)
+
+    def test_failures_are_not_remembered(self):
+        flight = SingleFlight()
+
+        with self.assertRaises(ValueError):
+            flight.do('pnr', mock.Mock(side_effect=ValueError))
+
+        self.assertEqual(flight.do('pnr', lambda: 'result'), 'result')
+        self.assertEqual(flight.do(None, lambda: 'unkeyed'), 'unkeyed')
+        self.assertEqual(flight.saved, 0)
+
+    def processor(self) -> tuple:
+        def collect_cvr(res: Restaurant) -> Restaurant:
+            res.industry_code = f'code {res.pnr}'
+            return res
+
+        with mock.patch('filter_xml.data_processor.get_cvr_handler') as get_cvr_handler:
+            handler = get_cvr_handler.return_value
+            handler.CRAWL_DELAY, handler.SHOULD_SLEEP = 0, False
+            handler.collect_data.side_effect = collect_cvr
+            handler.result.side_effect = lambda res: res.industry_code
+            handler.apply_result.side_effect = \
+                lambda res, code: setattr(res, 'industry_code', code) or res
+            return DataProcessor(0, False, mock.Mock()), handler
+
+    def test_processor_looks_up_duplicate_rows_once(self):
+        processor, handler = self.processor()
+        rows = [unit('1', '10'), unit('2', '10'), unit('3', '20')]
+        with mock.patch.object(processor._smiley_handler, 'page',
+                               side_effect=lambda url: smiley_page(f'report {url[-2:]}')) as fetch:
+            for row in rows:
+                processor._collect_smiley(processor._collect_cvr(row))
+
+        self.assertEqual(handler.collect_data.call_count, 2)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual([row.industry_code for row in rows], ['code 10', 'code 10', 'code 20'])
+        self.assertEqual(rows[1].smiley_reports[0].report_id, 'report 10')
+        self.assertEqual(processor._cvr_flight.saved + processor._smiley_flight.saved, 2)
+
+    def test_rows_of_a_page_share_every_report_id(self):
+        processor, _ = self.processor()
+        # the leader has fewer reports than the page, and the follower more than the leader
+        rows = [unit('1', '10', reports=1), unit('2', '10', reports=3),
+                unit('3', '10', reports=4)]
+        with mock.patch.object(processor._smiley_handler, 'page',
+                               return_value=smiley_page('r1', 'r2', 'r3')) as fetch:
+            for row in rows:
+                processor._collect_smiley(row)
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual([[report.report_id for report in row.smiley_reports] for row in rows],
+                         [['r1'], ['r1', 'r2', 'r3'], ['r1', 'r2', 'r3', None]])